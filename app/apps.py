@@ -4,3 +4,14 @@ from django.apps import AppConfig
 class AppConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "app"
+
+    def ready(self):
+        from django.db.backends.signals import connection_created
+        from django.db.models.signals import post_delete, post_save
+        from .instrumentation import install_query_recorder
+        from .models import Friendship
+        from .versioning import friendship_changed
+
+        connection_created.connect(install_query_recorder)
+        post_save.connect(friendship_changed, sender=Friendship)
+        post_delete.connect(friendship_changed, sender=Friendship)
@@ -0,0 +1,267 @@
+import json
+import mmap
+import os
+import time
+import uuid
+import zlib
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
+from django.utils import timezone
+
+from .models import ArchivedBlock, ChatRoom, Message
+from .search import get_message_search_index
+from .versioning import bump, index_key, room_key
+
+
+def check_archive_root():
+    """Raise ImproperlyConfigured unless MESSAGE_ARCHIVE_ROOT can be trusted
+    with the only copy of archived messages."""
+    root = settings.MESSAGE_ARCHIVE_ROOT
+    if not root:
+        raise ImproperlyConfigured('Set MESSAGE_ARCHIVE_ROOT to a persistent directory before archiving')
+    # A missing directory is more likely a typo or an unmounted volume than
+    # storage that will survive a redeploy, so it is never created here.
+    if not os.path.isdir(root):
+        raise ImproperlyConfigured(f'MESSAGE_ARCHIVE_ROOT {root} does not exist')
+    base_dir = os.path.realpath(settings.BASE_DIR)
+    if os.path.commonpath([os.path.realpath(root), base_dir]) == base_dir:
+        raise ImproperlyConfigured(
+            f'MESSAGE_ARCHIVE_ROOT {root} is inside the app directory, which is lost on redeploy'
+        )
+
+
+def segment_path(segment):
+    return os.path.join(settings.MESSAGE_ARCHIVE_ROOT, segment)
+
+
+def segment_name(chat_room_id, generation=None):
+    """A room's first segment file, or a later one written by purge_archived()."""
+    if generation is None:
+        return f"room-{chat_room_id}.seg"
+    return f"room-{chat_room_id}.{generation}.seg"
+
+
+def current_segment(chat_room_id):
+    """The segment new blocks of the room are appended to: the newest block's."""
+    segment = ArchivedBlock.objects.filter(chat_room_id=chat_room_id).order_by(
+        '-last_message_id'
+    ).values_list('segment', flat=True).first()
+    return segment or segment_name(chat_room_id)
+
+
+def lock_room(chat_room_id):
+    """Serialize archiving and purging of one room, which both write its
+    segment, on its ChatRoom row. Call inside a transaction."""
+    list(ChatRoom.objects.select_for_update().filter(id=chat_room_id).values_list('id', flat=True))
+
+
+def message_record(message_id, sender_id, username, anonymous_name, content, timestamp):
+    return {
+        'id': message_id,
+        'sender_id': sender_id,
+        'sender_name': anonymous_name or username or 'Unknown',
+        'anonymous_name': anonymous_name,
+        'content': content,
+        'timestamp': timestamp.isoformat(),
+    }
+
+
+def append_block(segment, records):
+    """Append one compressed block to a segment file; returns (offset, length).
+
+    Segments are append-only. If the process dies after the write but before
+    the ArchivedBlock row commits, the orphaned bytes are never referenced.
+    """
+    payload = zlib.compress(
+        '\n'.join(json.dumps(record, ensure_ascii=False) for record in records).encode('utf-8')
+    )
+    with open(segment_path(segment), 'ab') as f:
+        offset = f.tell()
+        f.write(payload)
+        f.flush()
+        os.fsync(f.fileno())
+    return offset, len(payload)
+
+
+def read_block(block):
+    """Decompress an archived block into a list of message records (ascending id)."""
+    with open(segment_path(block.segment), 'rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as segment:
+            payload = segment[block.offset:block.offset + block.length]
+    return [json.loads(line) for line in zlib.decompress(payload).decode('utf-8').split('\n')]
+
+
+def iter_archived_messages(chat_room_id):
+    """Yield every archived record of a room, oldest first."""
+    blocks = ArchivedBlock.objects.filter(chat_room_id=chat_room_id).order_by('first_message_id')
+    for block in blocks.iterator():
+        yield from read_block(block)
+
+
+def archived_page(chat_room_id, before_id, limit):
+    """Up to `limit` archived records with id < before_id, newest first."""
+    blocks = ArchivedBlock.objects.filter(chat_room_id=chat_room_id)
+    if before_id:
+        blocks = blocks.filter(first_message_id__lt=before_id)
+
+    records = []
+    for block in blocks.order_by('-last_message_id').iterator():
+        for record in reversed(read_block(block)):
+            if before_id and record['id'] >= before_id:
+                continue
+            records.append(record)
+            if len(records) >= limit:
+                return records
+    return records
+
+
+def archive_room(chat_room_id, cutoff, block_size=None):
+    """Move a room's messages older than cutoff into its segment file.
+    Tombstones of deleted messages are dropped rather than archived, and so
+    are the earlier versions of edited messages (MessageRevision): a block
+    keeps only each message's current content.
+
+    Returns the number of messages archived.
+    """
+    check_archive_root()
+    block_size = block_size or settings.MESSAGE_ARCHIVE_BLOCK_SIZE
+    archived = 0
+
+    while True:
+        rows = list(
+            Message.objects.filter(
+                chat_room_id=chat_room_id,
+                timestamp__lt=cutoff,
+                deleted_at__isnull=True
+            ).order_by('id').values_list(
+                'id', 'sender_id', 'sender__username', 'anonymous_name', 'content', 'timestamp'
+            )[:block_size]
+        )
+        if not rows:
+            break
+
+        records = [message_record(*row) for row in rows]
+        ids = [row[0] for row in rows]
+
+        with transaction.atomic():
+            lock_room(chat_room_id)
+            segment = current_segment(chat_room_id)
+            offset, length = append_block(segment, records)
+            ArchivedBlock.objects.create(
+                chat_room_id=chat_room_id,
+                segment=segment,
+                offset=offset,
+                length=length,
+                message_count=len(rows),
+                first_message_id=ids[0],
+                last_message_id=ids[-1],
+                first_timestamp=rows[0][-1],
+                last_timestamp=rows[-1][-1],
+            )
+            get_message_search_index().remove_messages(ids)
+            Message.objects.filter(id__in=ids).delete()
+
+        archived += len(rows)
+        if len(rows) < block_size:
+            break
+    tombstones, _ = Message.objects.filter(
+        chat_room_id=chat_room_id, timestamp__lt=cutoff, deleted_at__isnull=False
+    ).delete()
+    if archived or tombstones:
+        bump(room_key(chat_room_id, 'messages'), index_key('messages'))
+    return archived
+
+
+def purge_archived(chat_room_id, cutoff, dry_run=False):
+    """Drop a room's archived messages older than cutoff.
+
+    Segments are append-only, so the blocks that remain are copied into a
+    new segment file, with the expired records of a block that straddles
+    the cutoff left out, and the room's other segment files (including any
+    bytes orphaned by failed archive runs) are deleted once the new offsets
+    have committed. Returns the number of messages dropped.
+    """
+    with transaction.atomic():
+        lock_room(chat_room_id)
+        blocks = list(ArchivedBlock.objects.filter(chat_room_id=chat_room_id).order_by('first_message_id'))
+        expired = [block for block in blocks if block.first_timestamp < cutoff]
+        if not expired:
+            return 0
+        check_archive_root()
+
+        kept = []
+        purged = 0
+        for block in blocks:
+            if block.last_timestamp < cutoff:
+                purged += block.message_count
+            elif block.first_timestamp < cutoff:
+                records = [
+                    record for record in read_block(block)
+                    if datetime.fromisoformat(record['timestamp']) >= cutoff
+                ]
+                purged += block.message_count - len(records)
+                kept.append((block, records))
+            else:
+                kept.append((block, None))
+        if dry_run:
+            return purged
+
+        segment = segment_name(chat_room_id, uuid.uuid4().hex[:12])
+        for block, records in kept:
+            if records is None:
+                records = read_block(block)
+            else:
+                block.message_count = len(records)
+                block.first_message_id = records[0]['id']
+                block.first_timestamp = datetime.fromisoformat(records[0]['timestamp'])
+            block.segment = segment
+            block.offset, block.length = append_block(segment, records)
+        ArchivedBlock.objects.filter(chat_room_id=chat_room_id).exclude(
+            id__in=[block.id for block, _ in kept]
+        ).delete()
+        ArchivedBlock.objects.bulk_update(
+            [block for block, _ in kept],
+            ['segment', 'offset', 'length', 'message_count', 'first_message_id', 'first_timestamp'],
+        )
+        # Delete the old files only once nothing can point at them any more.
+        transaction.on_commit(lambda: remove_segments(chat_room_id, keep=segment if kept else None))
+
+    bump(room_key(chat_room_id, 'messages'))
+    return purged
+
+
+def remove_segments(chat_room_id, keep=None):
+    """Delete the room's segment files other than `keep`."""
+    first = segment_name(chat_room_id)
+    later = f"room-{chat_room_id}."
+    for name in os.listdir(settings.MESSAGE_ARCHIVE_ROOT):
+        if name != keep and (name == first or (name.startswith(later) and name.endswith('.seg'))):
+            os.remove(segment_path(name))
+
+
+def archive_messages(now=None, older_than=None, room_ids=None, block_size=None):
+    """Archive messages older than the cutoff, room by room.
+
+    Yields one report dict per room: {'chat_room_id', 'rows', 'seconds'}.
+    """
+    check_archive_root()
+    now = now or timezone.now()
+    older_than = older_than or timedelta(days=settings.MESSAGE_ARCHIVE_AFTER_DAYS)
+    cutoff = now - older_than
+
+    candidates = Message.objects.filter(timestamp__lt=cutoff)
+    if room_ids:
+        candidates = candidates.filter(chat_room_id__in=room_ids)
+    rooms = candidates.order_by('chat_room_id').values_list('chat_room_id', flat=True).distinct()
+
+    for chat_room_id in list(rooms):
+        started = time.monotonic()
+        rows = archive_room(chat_room_id, cutoff, block_size)
+        yield {
+            'chat_room_id': chat_room_id,
+            'rows': rows,
+            'seconds': time.monotonic() - started,
+        }
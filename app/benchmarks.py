@@ -0,0 +1,209 @@
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.db.models import Count, Q
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from .models import ChatRoom, FriendRequest, Friendship, Message
+
+
+def percentiles(values, points=(50, 95, 99)):
+    """Nearest-rank percentiles of `values`, plus min/max/mean, rounded to 3 places."""
+    if not values:
+        return {'count': 0}
+    ordered = sorted(values)
+    summary = {
+        'count': len(ordered),
+        'min': round(ordered[0], 3),
+        'mean': round(sum(ordered) / len(ordered), 3),
+        'max': round(ordered[-1], 3),
+    }
+    for point in points:
+        index = max(0, -(-point * len(ordered) // 100) - 1)
+        summary[f'p{point}'] = round(ordered[index], 3)
+    return summary
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR,
+            capture_output=True, text=True, timeout=5,
+        ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def environment():
+    """Where and what a run measured, so reports from different commits compare."""
+    return {
+        'revision': git_revision(),
+        'started_at': datetime.now(timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'database': settings.DATABASES['default']['ENGINE'].rsplit('.', 1)[-1],
+        'cpus': os.cpu_count(),
+    }
+
+
+def write_report(report, output=None, stdout=None):
+    """Write a report as JSON to `output`, or to stdout when it is None or '-'."""
+    text = json.dumps(report, indent=2, sort_keys=True)
+    if output and output != '-':
+        with open(output, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+    else:
+        (stdout or sys.stdout).write(text + '\n')
+
+
+# Most queries one request to each endpoint (URL name in app/urls.py) may
+# issue, whatever the amount of data behind it. Enforced by app.tests and
+# reported by the benchmark_api command.
+QUERY_BUDGETS = {
+    'register': 10,
+    'login': 1,
+    'profile': 1,
+    'get_friends': 2,
+    'get_friend_requests': 3,
+    'send_friend_request': 5,
+    'send_friend_request_alias': 5,
+    'respond_friend_request': 9,
+    'respond_alias': 9,
+    'get_presence': 2,
+    'search_users': 6,
+    'get_chatrooms': 3,
+    'get_unread_counts': 2,
+    'create_chatroom': 7,
+    'get_messages': 6,
+    'get_participants': 4,
+    'export_messages': 5,
+    'join_chatroom': 5,
+    'leave_chatroom': 5,
+    'update_members': 10,
+    'get_anonymous_rooms': 2,
+    'join_anonymous_room': 1,
+    'search_messages': 4,
+    'delete_message': 6,
+    'gateway_metrics': 1,
+    'endpoint_metrics': 1,
+    'slowest_traces': 1,
+}
+
+
+class Scenario:
+    __slots__ = ('name', 'method', 'path', 'body')
+
+    def __init__(self, name, method, path, body=None):
+        self.name = name
+        self.method = method
+        self.path = path
+        self.body = body
+
+
+def api_scenarios(user, password):
+    """One request per endpoint in app/urls.py, acting as `user` on whatever
+    data is in the database. Endpoints with nothing to act on (no pending
+    request, no message of the user's, ...) are left out."""
+    def url(name, **kwargs):
+        return reverse(name, kwargs=kwargs)
+
+    friend_ids = Friendship.get_friend_ids(user)
+    requested_ids = set()
+    for sender_id, receiver_id in FriendRequest.objects.filter(
+        Q(sender=user) | Q(receiver=user)
+    ).values_list('sender_id', 'receiver_id'):
+        requested_ids.update((sender_id, receiver_id))
+    stranger = User.objects.exclude(id__in=friend_ids | requested_ids | {user.id}).order_by('id').first()
+    pending = FriendRequest.objects.filter(receiver=user, status='pending').order_by('id').first()
+    groups = ChatRoom.objects.filter(participants=user, room_type='group', is_active=True)
+    busiest = groups.annotate(message_count=Count('messages')).order_by('-message_count', 'id').first()
+    other_group = ChatRoom.objects.filter(room_type='group').exclude(participants=user).order_by('id').first()
+    anonymous = ChatRoom.objects.filter(room_type='anonymous', is_active=True).order_by('id').first()
+    own_message = Message.objects.filter(sender=user).order_by('-id').first()
+
+    scenarios = [
+        Scenario('register', 'post', url('register'),
+                 {'username': f'bench_register_{user.id}', 'password': password, 'email': ''}),
+        Scenario('login', 'post', url('login'), {'username': user.username, 'password': password}),
+        Scenario('profile', 'get', url('profile')),
+        Scenario('get_friends', 'get', url('get_friends')),
+        Scenario('get_friend_requests', 'get', url('get_friend_requests')),
+        Scenario('get_presence', 'get', url('get_presence') + '?ids=' + ','.join(map(str, sorted(friend_ids)[:500]))),
+        Scenario('search_users', 'get', url('search_users') + f'?q={user.username[:3]}'),
+        Scenario('get_chatrooms', 'get', url('get_chatrooms')),
+        Scenario('get_unread_counts', 'get', url('get_unread_counts')),
+        Scenario('create_chatroom', 'post', url('create_chatroom'),
+                 {'room_type': 'group', 'name': 'bench', 'participant_ids': sorted(friend_ids)[:5]}),
+        Scenario('get_anonymous_rooms', 'get', url('get_anonymous_rooms')),
+        Scenario('search_messages', 'get', url('search_messages') + '?q=hello'),
+        Scenario('gateway_metrics', 'get', url('gateway_metrics')),
+        Scenario('endpoint_metrics', 'get', url('endpoint_metrics')),
+        Scenario('slowest_traces', 'get', url('slowest_traces')),
+    ]
+    if stranger:
+        scenarios += [
+            Scenario('send_friend_request', 'post', url('send_friend_request'), {'receiver_id': stranger.id}),
+            Scenario('send_friend_request_alias', 'post', url('send_friend_request_alias'),
+                     {'receiver_id': stranger.id}),
+        ]
+    if pending:
+        scenarios += [
+            Scenario('respond_friend_request', 'post', url('respond_friend_request', request_id=pending.id),
+                     {'action': 'accept'}),
+            Scenario('respond_alias', 'post', url('respond_alias', request_id=pending.id), {'action': 'accept'}),
+        ]
+    if busiest:
+        new_members = sorted(friend_ids - set(busiest.participants.values_list('id', flat=True)))[:5]
+        scenarios += [
+            Scenario('get_messages', 'get', url('get_messages', room_id=busiest.id) + '?limit=50'),
+            Scenario('get_participants', 'get', url('get_participants', room_id=busiest.id) + '?limit=100'),
+            Scenario('export_messages', 'get', url('export_messages', room_id=busiest.id)),
+            Scenario('leave_chatroom', 'post', url('leave_chatroom', room_id=busiest.id)),
+            Scenario('update_members', 'post', url('update_members', room_id=busiest.id), {'add': new_members}),
+        ]
+    if other_group:
+        scenarios.append(Scenario('join_chatroom', 'post', url('join_chatroom', room_id=other_group.id)))
+    if anonymous:
+        scenarios.append(Scenario('join_anonymous_room', 'post', url('join_anonymous_room', room_id=anonymous.id),
+                                  {'anonymous_name': 'bench'}))
+    if own_message:
+        scenarios.append(Scenario('delete_message', 'delete', url('delete_message', message_id=own_message.id)))
+    return scenarios
+
+
+def consume(response):
+    """Read a streaming response to the end, from sync or async iterators."""
+    if not response.is_async:
+        return b''.join(response.streaming_content)
+
+    async def read():
+        return b''.join([chunk async for chunk in response.streaming_content])
+    return async_to_sync(read)()
+
+
+def run_scenario(client, scenario, headers):
+    """Issue one request inside a rolled-back savepoint, so the database is
+    left unchanged; returns (status, queries, milliseconds)."""
+    kwargs = dict(headers)
+    if scenario.body is not None:
+        kwargs.update(data=json.dumps(scenario.body), content_type='application/json')
+
+    with transaction.atomic():
+        with CaptureQueriesContext(connection) as queries:
+            started = time.perf_counter()
+            response = getattr(client, scenario.method)(scenario.path, **kwargs)
+            if response.streaming:
+                consume(response)
+            elapsed = (time.perf_counter() - started) * 1000
+        transaction.set_rollback(True)
+    return response.status_code, len(queries), elapsed
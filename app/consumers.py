@@ -1,12 +1,37 @@
 import json
+import time
+import jwt
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from django.conf import settings
 from django.contrib.auth.models import User
 from .models import ChatRoom, Message
-import jwt
-from django.conf import settings
+from .search import get_message_search_index
+from . import edits, telemetry, versioning
+from .telemetry import track_db
+from .logs import get_logger
+from .presence import PresenceTracker, publish as publish_presence, user_group
+from .ratelimit import FrameLimiter
+from .rooms import RoomDirectory
+from .receipts import ReceiptBuffer
+from .tracing import current_trace, span, trace_frame
+
+log = get_logger('app.gateway')
+
+
+async def send_to_room(room_id, frame):
+    await get_channel_layer().group_send(f'chat_{room_id}', {'type': 'receipts_update', 'frame': frame})
+
+
+presence = PresenceTracker(publish_presence)
+receipts = ReceiptBuffer(send_to_room)
+limiter = FrameLimiter()
+rooms = RoomDirectory()
 
 class ChatConsumer(AsyncWebsocketConsumer):
+    counted = False
+
     async def connect(self):
         query_string = self.scope['query_string'].decode()
         self.token = None
@@ -25,14 +50,28 @@ class ChatConsumer(AsyncWebsocketConsumer):
         self.room_groups = set()
         
         await self.accept()
+        self.counted = True
+        telemetry.active_connections.inc()
+        if self.user:
+            await self.channel_layer.group_add(user_group(self.user.id), self.channel_name)
+            presence.connected(self.user.id)
+        log.info('ws.connected', channel=self.channel_name,
+                 user_id=self.user.id if self.user else None, anonymous=self.anonymous)
         
-        await self.send(text_data=json.dumps({
+        await self.send_frame({
             'type': 'connection_established',
             'message': 'Connected to WebSocket',
             'is_anonymous': self.anonymous
-        }))
+        })
 
     async def disconnect(self, close_code):
+        if self.counted:
+            self.counted = False
+            telemetry.active_connections.dec()
+            log.info('ws.closed', channel=self.channel_name, code=close_code)
+            if self.user:
+                await self.channel_layer.group_discard(user_group(self.user.id), self.channel_name)
+                presence.disconnected(self.user.id)
         for room_group_name in self.room_groups:
             await self.channel_layer.group_discard(
                 room_group_name,
@@ -40,24 +79,49 @@ class ChatConsumer(AsyncWebsocketConsumer):
             )
 
     async def receive(self, text_data):
+        with trace_frame('channels.frame', channel=self.channel_name) as trace:
+            try:
+                with trace.span('parse'):
+                    data = json.loads(text_data)
+                message_type = data.get('type')
+                telemetry.frames_received.inc(telemetry.frame_type(message_type))
+                trace.set(type=telemetry.frame_type(message_type))
+
+                user_id = self.user.id if self.user else None
+                if not limiter.allow(message_type, self.channel_name, user_id):
+                    trace.set(rate_limited=True)
+                    if message_type != 'typing':
+                        await self.send_frame({'type': 'error', 'message': 'Rate limit exceeded'})
+                    return
+
+                if message_type == 'join_room':
+                    await self.join_room(data)
+                elif message_type == 'send_message':
+                    await self.send_chat_message(data)
+                elif message_type == 'typing':
+                    await self.handle_typing(data)
+                elif message_type == 'delete_message':
+                    await self.delete_chat_message(data)
+                elif message_type == 'edit_message':
+                    await self.edit_chat_message(data)
+                elif message_type in ('mark_read', 'mark_delivered'):
+                    await self.mark_receipt(data, read=message_type == 'mark_read')
+
+            except Exception as e:
+                log.exception('ws.frame_failed', channel=self.channel_name, trace_id=trace.trace_id)
+                await self.send_frame({
+                    'type': 'error',
+                    'message': str(e)
+                })
+
+    async def send_frame(self, payload):
+        frame_type = telemetry.frame_type(payload.get('type'))
         try:
-            data = json.loads(text_data)
-            message_type = data.get('type')
-
-            if message_type == 'join_room':
-                await self.join_room(data)
-            elif message_type == 'send_message':
-                await self.send_chat_message(data)
-            elif message_type == 'typing':
-                await self.handle_typing(data)
-            elif message_type == 'delete_message':
-                await self.delete_chat_message(data)
-
-        except Exception as e:
-            await self.send(text_data=json.dumps({
-                'type': 'error',
-                'message': str(e)
-            }))
+            await self.send(text_data=json.dumps(payload))
+        except Exception:
+            telemetry.send_drops.inc(frame_type)
+            raise
+        telemetry.frames_sent.inc(frame_type)
 
     async def join_room(self, data):
         room_id = data.get('chat_room_id')
@@ -65,6 +129,13 @@ class ChatConsumer(AsyncWebsocketConsumer):
         if not room_id:
             return
 
+        room = await self.lookup_room(room_id)
+        if room is None or not self.may_use(room):
+            return
+        if not limiter.allow_room('join_room', room.id):
+            await self.send_frame({'type': 'error', 'message': 'Rate limit exceeded'})
+            return
+
         room_group_name = f'chat_{room_id}'
         
         await self.channel_layer.group_add(
@@ -74,9 +145,7 @@ class ChatConsumer(AsyncWebsocketConsumer):
         
         self.room_groups.add(room_group_name)
         
-        room_info = await self.get_room_info(room_id)
-        
-        if room_info and room_info['room_type'] == 'anonymous':
+        if room.room_type == 'anonymous':
             await self.channel_layer.group_send(
                 room_group_name,
                 {
@@ -95,20 +164,95 @@ class ChatConsumer(AsyncWebsocketConsumer):
         if not room_id or not content:
             return
 
-        message_data = await self.save_message(room_id, content, anonymous_name)
+        # Wall-clock time travels with the event so recipients in other
+        # processes can measure delivery latency.
+        received_at = time.time()
+        with span('room_lookup'):
+            room = await self.lookup_room(room_id)
+        if room is None or not self.may_use(room):
+            return
+        if not limiter.allow_room('send_message', room.id):
+            await self.send_frame({'type': 'error', 'message': 'Rate limit exceeded'})
+            return
+        with span('save_message'):
+            message_data = await self.save_message(room, content, anonymous_name)
         
         if not message_data:
             return
 
+        telemetry.message_latency.observe(time.time() - received_at, 'persist')
+        if message_data['sender_id'] and not message_data['anonymous_name']:
+            # Senders have read everything up to their own message.
+            receipts.mark(message_data['sender_id'], int(room_id), read=message_data['id'])
+
         room_group_name = f'chat_{room_id}'
         
-        await self.channel_layer.group_send(
-            room_group_name,
-            {
-                'type': 'new_message',
-                'message': message_data
-            }
-        )
+        trace_id = current_trace().trace_id
+        if trace_id:
+            message_data['trace_id'] = trace_id
+
+        with span('group_send'):
+            await self.channel_layer.group_send(
+                room_group_name,
+                {
+                    'type': 'new_message',
+                    'message': message_data,
+                    'received_at': received_at
+                }
+            )
+
+        await versioning.abump(versioning.room_key(room_id, 'messages'))
+        with span('index'):
+            await self.index_message(message_data)
+        log.debug('ws.message_sent', sample=True, chat_room_id=room_id, message_id=message_data['id'])
+
+    async def delete_chat_message(self, data):
+        await self.change_message(data, edit=False)
+
+    async def edit_chat_message(self, data):
+        await self.change_message(data, edit=True)
+
+    async def change_message(self, data, edit):
+        if not self.user or self.anonymous:
+            await self.send_frame({'type': 'error', 'message': 'Authentication required'})
+            return
+
+        try:
+            message_id = int(data.get('message_id'))
+        except (TypeError, ValueError):
+            await self.send_frame({'type': 'error', 'message': 'message_id must be an integer'})
+            return
+
+        content = (data.get('content') or '').strip()
+        if edit and not content:
+            await self.send_frame({'type': 'error', 'message': 'Missing content'})
+            return
+
+        try:
+            with span('persist'):
+                frame = await self.apply_message_change(message_id, content if edit else None)
+        except edits.MessageActionError as e:
+            await self.send_frame({'type': 'error', 'message': str(e)})
+            return
+
+        with span('group_send'):
+            await edits.publish(frame)
+
+    async def mark_receipt(self, data, read):
+        try:
+            room_id = int(data.get('chat_room_id'))
+            message_id = int(data.get('message_id'))
+        except (TypeError, ValueError):
+            await self.send_frame({'type': 'error', 'message': 'chat_room_id and message_id must be integers'})
+            return
+
+        if not self.user or self.anonymous:
+            return
+
+        if read:
+            receipts.mark(self.user.id, room_id, read=message_id)
+        else:
+            receipts.mark(self.user.id, room_id, delivered=message_id)
 
     async def handle_typing(self, data):
         room_id = data.get('chat_room_id')
@@ -117,6 +261,10 @@ class ChatConsumer(AsyncWebsocketConsumer):
         if not room_id:
             return
 
+        room = await self.lookup_room(room_id)
+        if room is None or not self.may_use(room) or not limiter.allow_room('typing', room.id):
+            return
+
         room_group_name = f'chat_{room_id}'
         user_name = self.anonymous_name if self.anonymous else (self.user.username if self.user else 'Someone')
         
@@ -133,8 +281,7 @@ class ChatConsumer(AsyncWebsocketConsumer):
 
     async def new_message(self, event):
         message = event['message']
-        
-        await self.send(text_data=json.dumps({
+        frame = {
             'type': 'new_message',
             'id': message['id'],
             'chat_room_id': message['chat_room_id'],
@@ -143,25 +290,41 @@ class ChatConsumer(AsyncWebsocketConsumer):
             'sender_name': message['sender_name'],
             'anonymous_name': message.get('anonymous_name', ''),
             'timestamp': message['timestamp']
-        }))
+        }
+        if 'trace_id' in message:
+            frame['trace_id'] = message['trace_id']
+
+        await self.send_frame(frame)
+        if 'received_at' in event:
+            telemetry.message_latency.observe(time.time() - event['received_at'], 'deliver')
 
     async def user_typing(self, event):
         if event.get('sender_channel') != self.channel_name:
-            await self.send(text_data=json.dumps({
+            await self.send_frame({
                 'type': 'user_typing',
                 'user_name': event['user_name'],
                 'is_typing': event['is_typing'],
                 'chat_room_id': event['chat_room_id']
-            }))
+            })
+
+    async def presence_update(self, event):
+        await self.send_frame(event['frame'])
+
+    async def receipts_update(self, event):
+        await self.send_frame(event['frame'])
+
+    async def message_changed(self, event):
+        await self.send_frame(event['frame'])
 
     async def user_joined(self, event):
-        await self.send(text_data=json.dumps({
+        await self.send_frame({
             'type': 'user_joined',
             'user_name': event['user_name'],
             'chat_room_id': event['chat_room_id'],
             'is_anonymous': event.get('is_anonymous', False)
-        }))
+        })
 
+    @track_db
     @database_sync_to_async
     def get_user_from_token(self, token):
         if not token:
@@ -174,46 +337,63 @@ class ChatConsumer(AsyncWebsocketConsumer):
         except:
             return None
 
+    @track_db
     @database_sync_to_async
-    def get_room_info(self, room_id):
+    def index_message(self, message_data):
+        get_message_search_index().add_message(
+            message_data['id'], int(message_data['chat_room_id']), message_data['content']
+        )
+
+    @track_db
+    @database_sync_to_async
+    def apply_message_change(self, message_id, content=None):
+        if content is None:
+            return edits.delete_message(self.user.id, message_id)
+        return edits.edit_message(self.user.id, message_id, content)
+
+    def may_use(self, room):
+        """Anyone may use an anonymous room; other rooms only their members."""
+        if room.room_type == 'anonymous':
+            return True
+        return self.user is not None and room.has_member(self.user.id)
+
+    async def lookup_room(self, room_id):
+        """Type and member ids of the room, from the directory shared with
+        the FastAPI gateway (app.rooms), or None when there is no such room."""
         try:
-            room = ChatRoom.objects.get(id=room_id)
-            return {
-                'id': room.id,
-                'name': room.name,
-                'room_type': room.room_type
-            }
-        except ChatRoom.DoesNotExist:
+            return await rooms.get(room_id)
+        except (ChatRoom.DoesNotExist, TypeError, ValueError):
             return None
 
+    @track_db
     @database_sync_to_async
-    def save_message(self, room_id, content, anonymous_name=''):
+    def save_message(self, room, content, anonymous_name=''):
         try:
-            room = ChatRoom.objects.get(id=room_id)
-            
-            if room.room_type == 'anonymous' or anonymous_name:
-                message = Message.objects.create(
-                    chat_room=room,
-                    content=content,
-                    anonymous_name=anonymous_name,
-                    sender=self.user if self.user and not self.anonymous else None
-                )
+            if room.room_type == 'anonymous':
+                with span('persist'):
+                    message = Message.objects.create(
+                        chat_room_id=room.id,
+                        content=content,
+                        anonymous_name=anonymous_name,
+                        sender=self.user if self.user and not self.anonymous else None
+                    )
             else:
                 if not self.user:
                     return None
                 
-                if self.user not in room.participants.all():
+                if not room.has_member(self.user.id):
                     return None
                 
-                message = Message.objects.create(
-                    chat_room=room,
-                    content=content,
-                    sender=self.user
-                )
+                with span('persist'):
+                    message = Message.objects.create(
+                        chat_room_id=room.id,
+                        content=content,
+                        sender=self.user
+                    )
             
             return {
                 'id': message.id,
-                'chat_room_id': room_id,
+                'chat_room_id': room.id,
                 'content': message.content,
                 'sender_id': message.sender.id if message.sender else None,
                 'sender_name': message.sender.username if message.sender else anonymous_name,
@@ -221,8 +401,6 @@ class ChatConsumer(AsyncWebsocketConsumer):
                 'timestamp': message.timestamp.isoformat()
             }
         
-        except ChatRoom.DoesNotExist:
+        except Exception:
+            log.exception('ws.save_message_failed', chat_room_id=room.id)
             return None
-        except Exception as e:
-            print(f"Error saving message: {e}")
-            return None
\ No newline at end of file
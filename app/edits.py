@@ -0,0 +1,104 @@
+"""Deleting and editing messages, shared by the REST view and both gateways.
+
+A delete keeps the row as a tombstone (content blanked, deleted_at set, old
+revisions dropped); an edit stores the previous content as a
+MessageRevision. Either way the search index and the room's history
+version (app.versioning) are updated, and the caller gets back a small
+delta frame to broadcast so connected clients patch their copy of the room
+instead of refetching it.
+
+publish() delivers that frame to both gateways: to the room's Channels
+group, and to GATEWAY_GROUP, which every FastAPI gateway process reads
+(through the shared channel layer, so Redis is needed across processes)
+and fans out to its own sockets in the room.
+"""
+from channels.layers import get_channel_layer
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+
+from .models import ChatRoom, Message, MessageRevision
+from .search import get_message_search_index
+from .versioning import bump, index_key, room_key
+
+GATEWAY_GROUP = 'gateway_message_changes'
+
+Membership = ChatRoom.participants.through
+
+
+class MessageActionError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def _own_message(user_id, message_id):
+    try:
+        message = Message.objects.select_for_update().annotate(
+            is_member=Exists(Membership.objects.filter(chatroom_id=OuterRef('chat_room_id'), user_id=user_id))
+        ).get(id=message_id)
+    except Message.DoesNotExist:
+        raise MessageActionError('Message not found', status=404)
+    if message.anonymous_name:
+        raise MessageActionError('Cannot change anonymous messages', status=403)
+    if message.sender_id != user_id:
+        raise MessageActionError('You can only change your own messages', status=403)
+    if not message.is_member:
+        raise MessageActionError('You are no longer in this chat room', status=403)
+    if message.deleted_at:
+        raise MessageActionError('Message has been deleted', status=410)
+    return message
+
+
+def delete_message(user_id, message_id):
+    """Tombstone one of user_id's messages; returns the message_deleted frame."""
+    with transaction.atomic():
+        message = _own_message(user_id, message_id)
+        message.content = ''
+        message.deleted_at = timezone.now()
+        message.save(update_fields=['content', 'deleted_at'])
+        if message.edited_at:
+            message.revisions.all().delete()
+
+    get_message_search_index().remove_message(message.id)
+    bump(room_key(message.chat_room_id, 'messages'), index_key('messages'))
+    return {
+        'type': 'message_deleted',
+        'message_id': message.id,
+        'chat_room_id': message.chat_room_id,
+        'deleted_at': message.deleted_at.isoformat(),
+    }
+
+
+def edit_message(user_id, message_id, content):
+    """Replace the content of one of user_id's messages; returns the
+    message_edited frame."""
+    with transaction.atomic():
+        message = _own_message(user_id, message_id)
+        MessageRevision.objects.create(message=message, content=message.content)
+        message.content = content
+        message.edited_at = timezone.now()
+        message.save(update_fields=['content', 'edited_at'])
+
+    index = get_message_search_index()
+    index.remove_message(message.id)
+    index.add_message(message.id, message.chat_room_id, message.content)
+    bump(room_key(message.chat_room_id, 'messages'), index_key('messages'))
+    return {
+        'type': 'message_edited',
+        'message_id': message.id,
+        'chat_room_id': message.chat_room_id,
+        'content': message.content,
+        'edited_at': message.edited_at.isoformat(),
+    }
+
+
+async def publish(frame, origin=None):
+    """Send a change frame to every client in its room, on both gateways.
+
+    origin is the sending FastAPI gateway's relay channel: that process has
+    already broadcast the frame to its own sockets and skips its copy."""
+    channel_layer = get_channel_layer()
+    event = {'type': 'message_changed', 'frame': frame}
+    await channel_layer.group_send(f"chat_{frame['chat_room_id']}", event)
+    await channel_layer.group_send(GATEWAY_GROUP, {**event, 'origin': origin})
@@ -0,0 +1,123 @@
+import csv
+import io
+import json
+import zlib
+
+from asgiref.sync import sync_to_async
+
+from .archive import iter_archived_messages
+from .models import ArchivedBlock, Message
+
+EXPORT_FIELDS = [
+    'id', 'chat_room_id', 'sender_id', 'sender_name',
+    'anonymous_name', 'content', 'timestamp',
+]
+
+# Lines are grouped into writes of roughly this many bytes so a large export
+# is not sent as millions of tiny chunks.
+WRITE_SIZE = 64 * 1024
+
+
+def iter_messages(room_ids=None, chunk_size=2000):
+    """Yield message records, archived ones first, using a server-side cursor.
+
+    Within a room records come in id order; archived history of every room
+    precedes the hot table.
+    """
+    blocks = ArchivedBlock.objects.all()
+    if room_ids is not None:
+        blocks = blocks.filter(chat_room_id__in=room_ids)
+    archived_rooms = blocks.order_by('chat_room_id').values_list('chat_room_id', flat=True).distinct()
+    for room_id in list(archived_rooms):
+        for record in iter_archived_messages(room_id):
+            yield {'chat_room_id': room_id, **record}
+
+    messages = Message.objects.filter(deleted_at__isnull=True)
+    if room_ids is not None:
+        messages = messages.filter(chat_room_id__in=room_ids)
+
+    rows = messages.order_by('chat_room_id', 'id').values_list(
+        'id', 'chat_room_id', 'sender_id', 'sender__username',
+        'anonymous_name', 'content', 'timestamp'
+    )
+    for message_id, room_id, sender_id, username, anonymous_name, content, timestamp in rows.iterator(chunk_size=chunk_size):
+        yield {
+            'id': message_id,
+            'chat_room_id': room_id,
+            'sender_id': sender_id,
+            'sender_name': anonymous_name or username or 'Unknown',
+            'anonymous_name': anonymous_name,
+            'content': content,
+            'timestamp': timestamp.isoformat(),
+        }
+
+
+def ndjson_lines(records):
+    for record in records:
+        yield json.dumps(record, ensure_ascii=False) + '\n'
+
+
+def csv_lines(records):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=EXPORT_FIELDS)
+    writer.writeheader()
+    for record in records:
+        writer.writerow(record)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def batched(lines, size=WRITE_SIZE):
+    """Encode lines to UTF-8 and group them into chunks of about `size` bytes."""
+    parts = []
+    pending = 0
+    for line in lines:
+        data = line.encode('utf-8')
+        parts.append(data)
+        pending += len(data)
+        if pending >= size:
+            yield b''.join(parts)
+            parts = []
+            pending = 0
+    if parts:
+        yield b''.join(parts)
+
+
+def gzip_chunks(chunks, level=6):
+    """Gzip-compress a byte stream on the fly."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def export_stream(room_ids=None, fmt='ndjson', compress=False, chunk_size=2000):
+    """Bytes iterator of the export; memory use is independent of history size."""
+    records = iter_messages(room_ids, chunk_size=chunk_size)
+    lines = csv_lines(records) if fmt == 'csv' else ndjson_lines(records)
+    chunks = batched(lines)
+    return gzip_chunks(chunks) if compress else chunks
+
+
+async def aexport_stream(room_ids=None, fmt='ndjson', compress=False, chunk_size=2000):
+    """export_stream() as an async iterator, for streaming responses under
+    ASGI. Each chunk is produced on the ORM thread, so the event loop never
+    blocks and Django sends the export as it goes instead of buffering it."""
+    chunks = export_stream(room_ids, fmt=fmt, compress=compress, chunk_size=chunk_size)
+    next_chunk = sync_to_async(next)
+    try:
+        while (chunk := await next_chunk(chunks, None)) is not None:
+            yield chunk
+    finally:
+        # Releases the server-side cursor if the client goes away early.
+        await sync_to_async(chunks.close)()
+
+
+def export_filename(name, fmt='ndjson', compress=False):
+    extension = 'csv' if fmt == 'csv' else 'ndjson'
+    return f"{name}.{extension}" + ('.gz' if compress else '')
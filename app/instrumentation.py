@@ -0,0 +1,209 @@
+import bisect
+import contextvars
+import random
+import threading
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.http import JsonResponse as DjangoJsonResponse
+
+# Upper bounds of the latency buckets, in milliseconds.
+LATENCY_BUCKETS_MS = (
+    0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000,
+)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89, 144, 233, 377)
+SIZE_BUCKETS = (
+    256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216,
+)
+
+
+class Histogram:
+    """Fixed-bucket histogram; cheap to observe, approximate quantiles."""
+
+    __slots__ = ('buckets', 'counts', 'count', 'sum', '_lock')
+
+    def __init__(self, buckets=LATENCY_BUCKETS_MS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[i] += 1
+            self.count += 1
+            self.sum += value
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q-th observation."""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, bucket_count in enumerate(self.counts):
+            seen += bucket_count
+            if seen >= rank:
+                return self.buckets[i] if i < len(self.buckets) else float('inf')
+        return float('inf')
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'mean': self.sum / self.count if self.count else None,
+            'p50': self.quantile(0.5),
+            'p95': self.quantile(0.95),
+            'p99': self.quantile(0.99),
+        }
+
+
+class RequestMetrics:
+    __slots__ = ('queries', 'db_seconds', 'serialization_seconds')
+
+    def __init__(self):
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.serialization_seconds = 0.0
+
+
+_current_metrics = contextvars.ContextVar('request_metrics', default=None)
+
+
+def record_query(execute, sql, params, many, context):
+    """Database execute wrapper; attributes query time to the current request."""
+    metrics = _current_metrics.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        metrics.queries += 1
+        metrics.db_seconds += time.perf_counter() - started
+
+
+def install_query_recorder(sender, connection, **kwargs):
+    """connection_created receiver: wrap every new DB connection."""
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+class JsonResponse(DjangoJsonResponse):
+    """JsonResponse that attributes its encoding time to the current request."""
+
+    def __init__(self, *args, **kwargs):
+        metrics = _current_metrics.get()
+        if metrics is None:
+            super().__init__(*args, **kwargs)
+            return
+        started = time.perf_counter()
+        super().__init__(*args, **kwargs)
+        metrics.serialization_seconds += time.perf_counter() - started
+
+
+class EndpointStats:
+    __slots__ = ('latency_ms', 'queries', 'db_ms', 'serialization_ms', 'response_bytes')
+
+    def __init__(self):
+        self.latency_ms = Histogram(LATENCY_BUCKETS_MS)
+        self.queries = Histogram(COUNT_BUCKETS)
+        self.db_ms = Histogram(LATENCY_BUCKETS_MS)
+        self.serialization_ms = Histogram(LATENCY_BUCKETS_MS)
+        self.response_bytes = Histogram(SIZE_BUCKETS)
+
+    def summary(self):
+        return {name: getattr(self, name).summary() for name in self.__slots__}
+
+
+endpoint_stats = {}
+_endpoint_stats_lock = threading.Lock()
+
+
+def get_endpoint_stats(name):
+    stats = endpoint_stats.get(name)
+    if stats is None:
+        with _endpoint_stats_lock:
+            stats = endpoint_stats.setdefault(name, EndpointStats())
+    return stats
+
+
+class PerformanceMiddleware:
+    """Per-view query count, DB time, serialization time and response size.
+
+    Only a PERF_SAMPLE_RATE fraction of requests is measured, so the cost
+    for the rest is one random() call. Measurements are aggregated into
+    in-process histograms (see endpoint_metrics) and, when
+    PERF_SERVER_TIMING is on, returned in a Server-Timing header.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.sample_rate = getattr(settings, 'PERF_SAMPLE_RATE', 0.1)
+        self.server_timing = getattr(settings, 'PERF_SERVER_TIMING', False)
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        if not self.sampled():
+            return self.get_response(request)
+
+        metrics = RequestMetrics()
+        token = _current_metrics.set(metrics)
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current_metrics.reset(token)
+        return self.finish(request, response, metrics, started)
+
+    async def __acall__(self, request):
+        if not self.sampled():
+            return await self.get_response(request)
+
+        metrics = RequestMetrics()
+        token = _current_metrics.set(metrics)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current_metrics.reset(token)
+        return self.finish(request, response, metrics, started)
+
+    def sampled(self):
+        return self.sample_rate >= 1 or random.random() < self.sample_rate
+
+    def finish(self, request, response, metrics, started):
+        total_ms = (time.perf_counter() - started) * 1000
+        db_ms = metrics.db_seconds * 1000
+        serialization_ms = metrics.serialization_seconds * 1000
+
+        match = getattr(request, 'resolver_match', None)
+        if match is not None:
+            stats = get_endpoint_stats(match.view_name)
+            stats.latency_ms.observe(total_ms)
+            stats.queries.observe(metrics.queries)
+            stats.db_ms.observe(db_ms)
+            stats.serialization_ms.observe(serialization_ms)
+            if not response.streaming:
+                stats.response_bytes.observe(len(response.content))
+
+        if self.server_timing:
+            response['Server-Timing'] = (
+                f'db;dur={db_ms:.2f};desc="{metrics.queries} queries", '
+                f'ser;dur={serialization_ms:.2f}, '
+                f'total;dur={total_ms:.2f}'
+            )
+        return response
+
+
+def endpoint_metrics():
+    return {name: stats.summary() for name, stats in sorted(endpoint_stats.items())}
@@ -0,0 +1,136 @@
+import atexit
+import json
+import logging
+import queue
+import random
+import re
+import sys
+import threading
+from logging.handlers import QueueHandler, QueueListener
+
+from django.conf import settings
+
+# Field names whose values are never written, and a pattern for JWTs that
+# end up inside other values (headers, query strings, exception messages).
+REDACTED_FIELDS = frozenset({'token', 'authorization', 'password', 'secret', 'cookie'})
+JWT_PATTERN = re.compile(r'eyJ[\w-]+\.[\w-]+\.[\w-]*')
+REDACTED = '[redacted]'
+
+
+def redact(key, value):
+    if key.lower() in REDACTED_FIELDS:
+        return REDACTED
+    if isinstance(value, str):
+        return JWT_PATTERN.sub(REDACTED, value)
+    if isinstance(value, (int, float, bool)) or value is None:
+        return value
+    return JWT_PATTERN.sub(REDACTED, str(value))
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line. Runs on the listener thread, not the caller."""
+
+    def format(self, record):
+        entry = {
+            'ts': round(record.created, 6),
+            'level': record.levelname.lower(),
+            'logger': record.name,
+            'event': record.msg,
+        }
+        for key, value in getattr(record, 'fields', {}).items():
+            entry[key] = redact(key, value)
+        if record.exc_info:
+            entry['exc'] = JWT_PATTERN.sub(REDACTED, self.formatException(record.exc_info))
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """Hands records to the listener without formatting them, and drops
+    records instead of blocking when the queue is full."""
+
+    dropped = 0
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            NonBlockingQueueHandler.dropped += 1
+
+
+class EventLogger:
+    """Structured logger: log.info('ws.connected', connection_id=..., active=...).
+
+    Events logged with sample=True are kept with probability LOG_SAMPLE_RATE;
+    use it for per-frame events. Field values are only turned into text on
+    the listener thread.
+    """
+
+    def __init__(self, logger, sample_rate):
+        self.logger = logger
+        self.sample_rate = sample_rate
+
+    def log(self, level, event, sample=False, exc_info=None, **fields):
+        if not self.logger.isEnabledFor(level):
+            return
+        if sample and self.sample_rate < 1 and random.random() >= self.sample_rate:
+            return
+        if sample:
+            fields['sample_rate'] = self.sample_rate
+        self.logger.handle(self.logger.makeRecord(
+            self.logger.name, level, '(event)', 0, event, None, exc_info,
+            extra={'fields': fields},
+        ))
+
+    def debug(self, event, **fields):
+        self.log(logging.DEBUG, event, **fields)
+
+    def info(self, event, **fields):
+        self.log(logging.INFO, event, **fields)
+
+    def warning(self, event, **fields):
+        self.log(logging.WARNING, event, **fields)
+
+    def error(self, event, **fields):
+        self.log(logging.ERROR, event, **fields)
+
+    def exception(self, event, **fields):
+        self.log(logging.ERROR, event, exc_info=sys.exc_info(), **fields)
+
+
+_listener = None
+_handler = None
+_setup_lock = threading.Lock()
+
+
+def _start_listener():
+    global _listener, _handler
+    records = queue.Queue(maxsize=settings.LOG_QUEUE_SIZE)
+    stream = logging.StreamHandler(sys.stdout)
+    stream.setFormatter(JsonFormatter())
+    _handler = NonBlockingQueueHandler(records)
+    _listener = QueueListener(records, stream)
+    _listener.start()
+    atexit.register(stop_logging)
+
+
+def stop_logging():
+    """Flush queued records; called at exit."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def get_logger(name):
+    with _setup_lock:
+        if _listener is None:
+            _start_listener()
+    logger = logging.getLogger(name)
+    if _handler not in logger.handlers:
+        logger.addHandler(_handler)
+        logger.setLevel(settings.LOG_LEVEL)
+        logger.propagate = False
+    return EventLogger(logger, settings.LOG_SAMPLE_RATE)
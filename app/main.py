@@ -1,77 +1,305 @@
+import time
+
+# Start of the import-time profile logged when the server starts.
+import_started = time.perf_counter()
+
+import asyncio
 import os
 import django
 import json
-import uuid
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Query
-from typing import Dict, Optional
-from asgiref.sync import sync_to_async
-
-os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'chat_app.settings')
+import jwt
+import random
+import itertools
+import signal
+import sys
+import threading
+from channels.layers import get_channel_layer
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request, WebSocket, WebSocketDisconnect, Query
+from fastapi.responses import JSONResponse, Response
+from typing import Dict, Optional, Tuple
+
+# The slim profile loads only the apps the gateway uses.
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'chat_app.settings_gateway')
 django.setup()
+django_ready = time.perf_counter()
 
+from django.apps import apps as django_apps
+from django.conf import settings
 from django.contrib.auth.models import User
 from app.models import ChatRoom, Message
+from app.search import index_message
+from app import telemetry, versioning
+from app.edits import GATEWAY_GROUP, MessageActionError, delete_message, edit_message, publish
+from app.telemetry import db_call
+from app.logs import get_logger
+from app.presence import PresenceTracker, publish as publish_presence
+from app.ratelimit import FrameLimiter
+from app.rooms import RoomDirectory
+from app.receipts import ReceiptBuffer
+from app.tracing import MemoryExporter, current_trace, get_exporter, span, trace_frame
+
+log = get_logger('app.gateway')
+
+# Close code for sockets shut by a draining gateway.
+SERVICE_RESTART = 1012
+
+# Seconds between renewals of the relay's group membership, well inside the
+# channel layer's group expiry.
+RELAY_RENEW_SECONDS = 3600
+
+
+@asynccontextmanager
+async def lifespan(app):
+    log_startup()
+    install_drain_handler()
+    preload = asyncio.create_task(manager.rooms.preload())
+    relay = asyncio.create_task(relay_message_changes())
+    yield
+    preload.cancel()
+    relay.cancel()
+
+
+app = FastAPI(lifespan=lifespan)
+
+class Connection:
+    """One open socket. There is one per client, so the record is slotted
+    and keyed by a small integer id rather than a UUID string."""
+
+    __slots__ = ('id', 'websocket', 'user_id')
+
+    def __init__(self, connection_id: int, websocket: WebSocket, user_id: Optional[int]):
+        self.id = connection_id
+        self.websocket = websocket
+        self.user_id = user_id
 
-app = FastAPI()
 
 class ConnectionManager:
     def __init__(self):
-        self.active_connections: Dict[str, WebSocket] = {}
-        self.user_to_connection: Dict[int, str] = {}
+        self.connections: Dict[int, Connection] = {}
+        # A user may be connected from several tabs or devices. Nearly all
+        # have one, and a tuple of records is much smaller than a set.
+        self.user_connections: Dict[int, Tuple[Connection, ...]] = {}
+        self.connection_ids = itertools.count(1)
+        self.presence = PresenceTracker(self.notify_presence)
+        self.rooms = RoomDirectory()
+        self.draining = False
+
+    def new_id(self) -> int:
+        return next(self.connection_ids)
+
+    def add(self, connection: Connection):
+        self.connections[connection.id] = connection
+        if connection.user_id:
+            self.user_connections[connection.user_id] = self.user_connections.get(connection.user_id, ()) + (connection,)
+
+    def remove(self, connection_id: int) -> Optional[Connection]:
+        connection = self.connections.pop(connection_id, None)
+        if connection and connection.user_id:
+            others = tuple(c for c in self.user_connections[connection.user_id] if c is not connection)
+            if others:
+                self.user_connections[connection.user_id] = others
+            else:
+                del self.user_connections[connection.user_id]
+        return connection
 
-    async def connect(self, websocket: WebSocket, connection_id: str, user_id: Optional[int] = None):
-        #await websocket.accept()
-        self.active_connections[connection_id] = websocket
+    async def connect(self, websocket: WebSocket, connection_id: int, user_id: Optional[int] = None):
+        self.add(Connection(connection_id, websocket, user_id))
         if user_id:
-            self.user_to_connection[user_id] = connection_id
-        print(f"Connection {connection_id} established. Active: {len(self.active_connections)}")
-
-    def disconnect(self, connection_id: str, user_id: Optional[int] = None):
-        if connection_id in self.active_connections:
-            del self.active_connections[connection_id]
-        if user_id and user_id in self.user_to_connection:
-            del self.user_to_connection[user_id]
-        print(f"Connection {connection_id} closed. Active: {len(self.active_connections)}")
-
-    async def send_to_connection(self, connection_id: str, message: dict):
-        if connection_id in self.active_connections:
-            try:
-                await self.active_connections[connection_id].send_text(json.dumps(message))
-                return True
-            except:
-                self.disconnect(connection_id)
-                return False
-        return False
-
-    async def broadcast_to_room(self, chat_room_id: int, message: dict, exclude_connection_id: str = None):
+            self.presence.connected(user_id)
+        telemetry.active_connections.set(len(self.connections))
+        log.info('ws.connected', connection_id=connection_id, user_id=user_id, active=len(self.connections))
+
+    def disconnect(self, connection_id: int):
+        connection = self.remove(connection_id)
+        if connection is None:
+            return
+        if connection.user_id:
+            self.presence.disconnected(connection.user_id)
+        telemetry.active_connections.set(len(self.connections))
+        log.info('ws.closed', connection_id=connection_id, user_id=connection.user_id, active=len(self.connections))
+
+    async def send_to_users(self, message: dict, user_ids):
+        for user_id in user_ids:
+            for connection in self.user_connections.get(user_id, ()):
+                await self.send(connection, message)
+
+    async def notify_presence(self, frame: dict, user_ids):
+        await self.send_to_users(frame, user_ids)
+        await publish_presence(frame, user_ids, origin=relay_channel)
+
+    async def send_to_connection(self, connection_id: int, message: dict):
+        connection = self.connections.get(connection_id)
+        return connection is not None and await self.send(connection, message)
+
+    async def send(self, connection: Connection, message: dict):
+        # The record may have been closed by another task since it was looked up.
+        if self.connections.get(connection.id) is not connection:
+            return False
+        frame_type = telemetry.frame_type(message.get('type'))
         try:
-            chatroom = await sync_to_async(ChatRoom.objects.get)(id=chat_room_id)
+            await connection.websocket.send_text(json.dumps(message))
+            telemetry.frames_sent.inc(frame_type)
+            return True
+        except:
+            telemetry.send_drops.inc(frame_type)
+            self.disconnect(connection.id)
+            return False
+
+    async def close_for_restart(self, connection_id: int):
+        """Tell the client when to come back, then close its socket."""
+        connection = self.connections.get(connection_id)
+        if connection is None:
+            return
+        delay_ms = int(random.uniform(0, settings.GATEWAY_RECONNECT_JITTER) * 1000)
+        await self.send(connection, {'type': 'reconnect', 'delay_ms': delay_ms})
+        try:
+            await connection.websocket.close(code=SERVICE_RESTART)
+        except Exception:
+            pass
+        self.disconnect(connection_id)
+
+    async def broadcast_to_room(self, chat_room_id: int, message: dict, exclude_connection_id: int = None):
+        try:
+            with span('broadcast.room_lookup'):
+                room = await self.rooms.get(chat_room_id)
             sent_count = 0
 
-            if chatroom.room_type == 'anonymous':
-                for conn_id, ws in list(self.active_connections.items()):
-                    if exclude_connection_id and conn_id == exclude_connection_id:
-                        continue
-                    if await self.send_to_connection(conn_id, message):
-                        sent_count += 1
-            else:
-                participants = await sync_to_async(list)(chatroom.participants.all())
-                for user in participants:
-                    if user.id in self.user_to_connection:
-                        conn_id = self.user_to_connection[user.id]
-                        if exclude_connection_id and conn_id == exclude_connection_id:
+            if room.room_type == 'anonymous':
+                with span('broadcast.send'):
+                    for connection in list(self.connections.values()):
+                        if connection.id == exclude_connection_id:
                             continue
-                        if await self.send_to_connection(conn_id, message):
+                        if await self.send(connection, message):
                             sent_count += 1
-
-            print(f"Broadcasted to {sent_count} connections in room {chat_room_id}")
+            else:
+                with span('broadcast.send'):
+                    for user_id in room.members:
+                        for connection in self.user_connections.get(user_id, ()):
+                            if connection.id == exclude_connection_id:
+                                continue
+                            if await self.send(connection, message):
+                                sent_count += 1
+
+            telemetry.broadcast_fanout.observe(sent_count)
+            log.debug('ws.broadcast', sample=True, chat_room_id=chat_room_id, type=message.get('type'), sent=sent_count)
             return sent_count
         except ChatRoom.DoesNotExist:
-            print(f'Chat room {chat_room_id} not found')
+            log.warning('ws.broadcast_room_missing', chat_room_id=chat_room_id)
             return 0
 
 
 manager = ConnectionManager()
+receipts = ReceiptBuffer(manager.broadcast_to_room)
+limiter = FrameLimiter()
+drain_task = None
+relay_channel = None
+
+
+async def relay_message_changes():
+    """Deliver the frames published from the REST API, the Channels gateway
+    and other gateway processes to the sockets in this one: message changes
+    (app.edits.publish) and presence changes (app.presence.publish)."""
+    global relay_channel
+    channel_layer = get_channel_layer()
+    relay_channel = channel = await channel_layer.new_channel()
+    try:
+        while True:
+            await channel_layer.group_add(GATEWAY_GROUP, channel)
+            renew_at = time.monotonic() + RELAY_RENEW_SECONDS
+            while (remaining := renew_at - time.monotonic()) > 0:
+                try:
+                    event = await asyncio.wait_for(channel_layer.receive(channel), remaining)
+                except asyncio.TimeoutError:
+                    break
+                # This process delivered its own frames already.
+                if event.get('origin') == channel:
+                    continue
+                frame = event['frame']
+                try:
+                    if event['type'] == 'presence_update':
+                        await manager.send_to_users(frame, event['user_ids'])
+                    else:
+                        await manager.broadcast_to_room(frame['chat_room_id'], frame)
+                except Exception:
+                    log.exception('ws.relay_failed', type=event['type'])
+    finally:
+        await channel_layer.group_discard(GATEWAY_GROUP, channel)
+
+
+async def drain():
+    """Move every client off this process before it exits.
+
+    New sockets are refused from here on. The open ones are closed in waves
+    (GATEWAY_DRAIN_*), each client first getting a reconnect frame with a
+    random delay so they do not all come back at the same moment, and the
+    receipts still buffered are written last."""
+    manager.draining = True
+    await manager.presence.stop()
+    connection_ids = list(manager.connections)
+    log.info('ws.drain_started', active=len(connection_ids))
+
+    waves = max(1, settings.GATEWAY_DRAIN_WAVES)
+    wave_size = -(-len(connection_ids) // waves) or 1
+    for start in range(0, len(connection_ids), wave_size):
+        if start:
+            await asyncio.sleep(settings.GATEWAY_DRAIN_SECONDS / waves)
+        await asyncio.gather(*(
+            manager.close_for_restart(connection_id)
+            for connection_id in connection_ids[start:start + wave_size]
+        ))
+
+    await receipts.flush()
+    log.info('ws.drain_finished', closed=len(connection_ids))
+
+
+def log_startup():
+    try:
+        import resource
+        # Kilobytes on Linux.
+        max_rss_mb = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    except ImportError:
+        max_rss_mb = None
+    log.info(
+        'gateway.startup',
+        settings=settings.SETTINGS_MODULE,
+        apps=len(django_apps.get_app_configs()),
+        modules=len(sys.modules),
+        django_setup_seconds=round(django_ready - import_started, 3),
+        import_seconds=round(imported - import_started, 3),
+        max_rss_mb=max_rss_mb,
+    )
+
+
+def install_drain_handler():
+    """Drain on SIGTERM, then pass the signal on to the server's own handler
+    so it shuts down as usual. A second SIGTERM skips the drain."""
+    # Signal handlers can only be installed from the main thread.
+    if threading.current_thread() is not threading.main_thread():
+        return
+    loop = asyncio.get_running_loop()
+    previous = signal.getsignal(signal.SIGTERM)
+
+    def shut_down(signum, frame):
+        if callable(previous):
+            previous(signum, frame)
+        else:
+            signal.signal(signum, previous)
+            signal.raise_signal(signum)
+
+    def on_sigterm(signum, frame):
+        if drain_task is not None:
+            shut_down(signum, frame)
+            return
+
+        def start():
+            global drain_task
+            drain_task = loop.create_task(drain())
+            drain_task.add_done_callback(lambda task: shut_down(signum, frame))
+
+        loop.call_soon_threadsafe(start)
+
+    signal.signal(signal.SIGTERM, on_sigterm)
 
 
 async def send_error(websocket: WebSocket, error_message: str):
@@ -79,9 +307,11 @@ async def send_error(websocket: WebSocket, error_message: str):
         "type": "error",
         "message": error_message
     }))
+    telemetry.frames_sent.inc('error')
 
 
-async def handle_send_message(websocket: WebSocket, connection_id: str, user_id: Optional[int], data: dict):
+async def handle_send_message(websocket: WebSocket, connection_id: int, user_id: Optional[int], data: dict):
+    received = time.perf_counter()
     chat_room_id = data.get('chat_room_id')
     content = data.get('content', '').strip()
     anonymous_name = data.get('anonymous_name', '').strip()
@@ -91,17 +321,23 @@ async def handle_send_message(websocket: WebSocket, connection_id: str, user_id:
         return
 
     try:
-        chatroom = await sync_to_async(ChatRoom.objects.get)(id=chat_room_id)
+        with span('room_lookup'):
+            room = await manager.rooms.get(chat_room_id)
 
-        if chatroom.room_type == 'anonymous':
+        if room.room_type == 'anonymous':
             if not anonymous_name:
-                anonymous_name = f"Anonymous_{connection_id[:8]}"
+                anonymous_name = f"Anonymous_{connection_id}"
+            if not limiter.allow_room('send_message', room.id):
+                await send_error(websocket, "Rate limit exceeded")
+                return
             
-            message = await sync_to_async(Message.objects.create)(
-                content=content,
-                anonymous_name=anonymous_name,
-                chat_room=chatroom
-            )
+            with span('persist'):
+                message = await db_call(Message.objects.create)(
+                    content=content,
+                    anonymous_name=anonymous_name,
+                    chat_room_id=room.id
+                )
+            telemetry.message_latency.observe(time.perf_counter() - received, 'persist')
 
             broadcast_data = {
                 "type": "new_message",
@@ -117,19 +353,24 @@ async def handle_send_message(websocket: WebSocket, connection_id: str, user_id:
                 await send_error(websocket, "Authentication required for this room")
                 return
 
-            user = await sync_to_async(User.objects.get)(id=user_id)
-            
-            # Check if user is participant
-            participants = await sync_to_async(list)(chatroom.participants.all())
-            if user not in participants:
+            if not room.has_member(user_id):
                 await send_error(websocket, "You're not a participant")
                 return
-
-            message = await sync_to_async(Message.objects.create)(
-                content=content,
-                sender=user,
-                chat_room=chatroom
-            )
+            if not limiter.allow_room('send_message', room.id):
+                await send_error(websocket, "Rate limit exceeded")
+                return
+            with span('sender_lookup'):
+                user = await db_call(User.objects.get)(id=user_id)
+
+            with span('persist'):
+                message = await db_call(Message.objects.create)(
+                    content=content,
+                    sender=user,
+                    chat_room_id=room.id
+                )
+            telemetry.message_latency.observe(time.perf_counter() - received, 'persist')
+            # Senders have read everything up to their own message.
+            receipts.mark(user_id, room.id, read=message.id)
 
             broadcast_data = {
                 "type": "new_message",
@@ -142,19 +383,28 @@ async def handle_send_message(websocket: WebSocket, connection_id: str, user_id:
                 "timestamp": message.timestamp.isoformat()
             }
 
-        await manager.broadcast_to_room(chat_room_id, broadcast_data)
-        print(f'Message saved and broadcasted in room {chat_room_id}')
+        trace_id = current_trace().trace_id
+        if trace_id:
+            broadcast_data['trace_id'] = trace_id
+
+        with span('broadcast'):
+            await manager.broadcast_to_room(chat_room_id, broadcast_data)
+        telemetry.message_latency.observe(time.perf_counter() - received, 'deliver')
+        await versioning.abump(versioning.room_key(room.id, 'messages'))
+        with span('index'):
+            await db_call(index_message)(message)
+        log.debug('ws.message_sent', sample=True, chat_room_id=chat_room_id, message_id=message.id)
 
     except ChatRoom.DoesNotExist:
         await send_error(websocket, "Chat room not found")
     except User.DoesNotExist:
         await send_error(websocket, "User not found")
-    except Exception as e:
-        print(f"Error handling message: {e}")
+    except Exception:
+        log.exception('ws.send_message_failed', connection_id=connection_id, chat_room_id=chat_room_id)
         await send_error(websocket, "Failed to send message")
 
 
-async def handle_typing_indicator(websocket: WebSocket, connection_id: str, user_id: Optional[int], data: dict):
+async def handle_typing_indicator(websocket: WebSocket, connection_id: int, user_id: Optional[int], data: dict):
     chat_room_id = data.get('chat_room_id')
     is_typing = data.get('is_typing', False)
     anonymous_name = data.get('anonymous_name', '').strip()
@@ -163,11 +413,14 @@ async def handle_typing_indicator(websocket: WebSocket, connection_id: str, user
         return
 
     try:
-        chatroom = await sync_to_async(ChatRoom.objects.get)(id=chat_room_id)
+        room = await manager.rooms.get(chat_room_id)
 
-        if chatroom.room_type == 'anonymous':
+        if room.room_type == 'anonymous':
             if not anonymous_name:
-                anonymous_name = f"Anonymous_{connection_id[:8]}"
+                anonymous_name = f"Anonymous_{connection_id}"
+
+            if not limiter.allow_room('typing', room.id):
+                return
 
             typing_data = {
                 "type": "user_typing",
@@ -177,16 +430,13 @@ async def handle_typing_indicator(websocket: WebSocket, connection_id: str, user
                 "is_anonymous": True
             }
         else:
-            if not user_id:
+            if not user_id or not room.has_member(user_id):
                 return
-
-            user = await sync_to_async(User.objects.get)(id=user_id)
-            
-            # Check if user is participant
-            participants = await sync_to_async(list)(chatroom.participants.all())
-            if user not in participants:
+            if not limiter.allow_room('typing', room.id):
                 return
 
+            user = await db_call(User.objects.get)(id=user_id)
+
             typing_data = {
                 "type": "user_typing",
                 "chat_room_id": chat_room_id,
@@ -200,11 +450,11 @@ async def handle_typing_indicator(websocket: WebSocket, connection_id: str, user
 
     except (ChatRoom.DoesNotExist, User.DoesNotExist):
         pass
-    except Exception as e:
-        print(f"Error in typing indicator: {e}")
+    except Exception:
+        log.exception('ws.typing_failed', connection_id=connection_id, chat_room_id=chat_room_id)
 
 
-async def handle_join_room(websocket: WebSocket, connection_id: str, user_id: Optional[int], data: dict):
+async def handle_join_room(websocket: WebSocket, connection_id: int, user_id: Optional[int], data: dict):
     chat_room_id = data.get('chat_room_id')
     anonymous_name = data.get('anonymous_name', '').strip()
 
@@ -212,11 +462,15 @@ async def handle_join_room(websocket: WebSocket, connection_id: str, user_id: Op
         return
 
     try:
-        chatroom = await sync_to_async(ChatRoom.objects.get)(id=chat_room_id)
+        room = await manager.rooms.get(chat_room_id)
 
-        if chatroom.room_type == 'anonymous':
+        if room.room_type == 'anonymous':
             if not anonymous_name:
-                anonymous_name = f"Anonymous_{connection_id[:8]}"
+                anonymous_name = f"Anonymous_{connection_id}"
+
+            if not limiter.allow_room('join_room', room.id):
+                await send_error(websocket, "Rate limit exceeded")
+                return
 
             join_data = {
                 "type": "user_joined",
@@ -225,16 +479,14 @@ async def handle_join_room(websocket: WebSocket, connection_id: str, user_id: Op
                 "is_anonymous": True
             }
         else:
-            if not user_id:
+            if not user_id or not room.has_member(user_id):
                 return
-
-            user = await sync_to_async(User.objects.get)(id=user_id)
-            
-            # Check if user is participant
-            participants = await sync_to_async(list)(chatroom.participants.all())
-            if user not in participants:
+            if not limiter.allow_room('join_room', room.id):
+                await send_error(websocket, "Rate limit exceeded")
                 return
 
+            user = await db_call(User.objects.get)(id=user_id)
+
             join_data = {
                 "type": "user_joined",
                 "chat_room_id": chat_room_id,
@@ -247,29 +499,138 @@ async def handle_join_room(websocket: WebSocket, connection_id: str, user_id: Op
 
     except (ChatRoom.DoesNotExist, User.DoesNotExist):
         pass
-    except Exception as e:
-        print(f"Error in join room: {e}")
+    except Exception:
+        log.exception('ws.join_room_failed', connection_id=connection_id, chat_room_id=chat_room_id)
 
 
-async def handle_message(websocket: WebSocket, connection_id: str, user_id: Optional[int], raw_data: str):
+async def handle_message_change(websocket: WebSocket, user_id: Optional[int], data: dict, edit: bool):
+    if not user_id:
+        await send_error(websocket, "Authentication required")
+        return
+
     try:
-        data = json.loads(raw_data)
-        message_type = data.get('type')
-
-        if message_type == 'send_message':
-            await handle_send_message(websocket, connection_id, user_id, data)
-        elif message_type == 'typing':
-            await handle_typing_indicator(websocket, connection_id, user_id, data)
-        elif message_type == 'join_room':
-            await handle_join_room(websocket, connection_id, user_id, data)
+        message_id = int(data.get('message_id'))
+    except (TypeError, ValueError):
+        await send_error(websocket, "message_id must be an integer")
+        return
+
+    try:
+        if edit:
+            content = (data.get('content') or '').strip()
+            if not content:
+                await send_error(websocket, "Missing content")
+                return
+            with span('persist'):
+                frame = await db_call(edit_message)(user_id, message_id, content)
         else:
-            await send_error(websocket, f"Unknown message type: {message_type}")
+            with span('persist'):
+                frame = await db_call(delete_message)(user_id, message_id)
+    except MessageActionError as e:
+        await send_error(websocket, str(e))
+        return
+
+    with span('broadcast'):
+        await manager.broadcast_to_room(frame['chat_room_id'], frame)
+    await publish(frame, origin=relay_channel)
+
+
+async def handle_receipt(websocket: WebSocket, user_id: Optional[int], data: dict, read: bool):
+    try:
+        chat_room_id = int(data.get('chat_room_id'))
+        message_id = int(data.get('message_id'))
+    except (TypeError, ValueError):
+        await send_error(websocket, "chat_room_id and message_id must be integers")
+        return
+
+    # Anonymous connections have no read state.
+    if not user_id:
+        return
+
+    if read:
+        receipts.mark(user_id, chat_room_id, read=message_id)
+    else:
+        receipts.mark(user_id, chat_room_id, delivered=message_id)
+
 
-    except json.JSONDecodeError:
-        await send_error(websocket, "Invalid JSON format")
-    except Exception as e:
-        print(f'Error handling message: {e}')
-        await send_error(websocket, "Internal server error")
+async def handle_message(websocket: WebSocket, connection_id: int, user_id: Optional[int], raw_data: str):
+    with trace_frame('fastapi.frame', connection_id=connection_id) as trace:
+        try:
+            with trace.span('parse'):
+                data = json.loads(raw_data)
+            message_type = data.get('type')
+            telemetry.frames_received.inc(telemetry.frame_type(message_type))
+            trace.set(type=telemetry.frame_type(message_type))
+
+            if not limiter.allow(message_type, connection_id, user_id):
+                trace.set(rate_limited=True)
+                # A dropped typing indicator needs no answer.
+                if message_type != 'typing':
+                    await send_error(websocket, "Rate limit exceeded")
+                return
+
+            if message_type == 'send_message':
+                await handle_send_message(websocket, connection_id, user_id, data)
+            elif message_type == 'typing':
+                await handle_typing_indicator(websocket, connection_id, user_id, data)
+            elif message_type == 'join_room':
+                await handle_join_room(websocket, connection_id, user_id, data)
+            elif message_type in ('delete_message', 'edit_message'):
+                await handle_message_change(websocket, user_id, data, edit=message_type == 'edit_message')
+            elif message_type in ('mark_read', 'mark_delivered'):
+                await handle_receipt(websocket, user_id, data, read=message_type == 'mark_read')
+            else:
+                await send_error(websocket, f"Unknown message type: {message_type}")
+
+        except json.JSONDecodeError:
+            telemetry.frames_received.inc('invalid')
+            await send_error(websocket, "Invalid JSON format")
+        except Exception:
+            log.exception('ws.frame_failed', connection_id=connection_id, trace_id=trace.trace_id)
+            await send_error(websocket, "Internal server error")
+
+
+@app.get("/ready")
+async def ready():
+    """200 once the room directory is preloaded, 503 before that and while
+    draining, for load balancer readiness checks."""
+    if manager.draining or not manager.rooms.ready:
+        status = 'draining' if manager.draining else 'starting'
+        return JSONResponse({'status': status}, status_code=503)
+    return JSONResponse({'status': 'ready', 'rooms': len(manager.rooms.rooms)})
+
+
+async def staff_only(request: Request) -> Optional[JSONResponse]:
+    """An error response unless the request carries a staff user's token."""
+    token = request.headers.get('Authorization', '').replace('Bearer ', '')
+    try:
+        payload = jwt.decode(token, settings.SECRET_KEY, algorithms=['HS256'])
+        user = await db_call(User.objects.get)(id=payload['user_id'])
+    except Exception:
+        return JSONResponse({'error': 'Authentication required'}, status_code=401)
+    if not user.is_staff:
+        return JSONResponse({'error': 'Staff only'}, status_code=403)
+    return None
+
+
+@app.get("/metrics")
+async def metrics(request: Request):
+    if not telemetry.has_metrics_token(request.headers.get('Authorization', '')):
+        denied = await staff_only(request)
+        if denied:
+            return denied
+    return Response(telemetry.render_metrics(), media_type=telemetry.CONTENT_TYPE)
+
+
+@app.get("/traces")
+async def slowest_traces(request: Request, limit: int = Query(20, ge=1, le=200)):
+    denied = await staff_only(request)
+    if denied:
+        return denied
+
+    exporter = get_exporter()
+    if not isinstance(exporter, MemoryExporter):
+        return JSONResponse({'error': 'In-memory tracing is not enabled'}, status_code=404)
+    return JSONResponse({'traces': exporter.slowest(limit)})
 
 
 @app.websocket("/ws")
@@ -278,43 +639,29 @@ async def websocket_endpoint(
     token: Optional[str] = Query(None),
     anonymous: bool = Query(False)
 ):
-    print("=" * 50)
-    print("🔍 WebSocket connection attempt")
-    print(f"🔍 Token: {token}")
-    print(f"🔍 Anonymous: {anonymous}")
-    print(f"🔍 Headers: {websocket.headers}")
-    print("=" * 50)
-    
+    if manager.draining:
+        # Shutting down; the client retries and reaches another node.
+        await websocket.close(code=SERVICE_RESTART)
+        return
+
     await websocket.accept()
-    print("✅ ACCEPTED!")
-    connection_id = str(uuid.uuid4())
+    connection_id = manager.new_id()
     user_id = None
 
     if not anonymous and token:
-        import jwt
-        from django.conf import settings
-        
-        print(f"🔍 Attempting to decode token...")
-        print(f"🔍 Token: {token[:30]}...")
-        print(f"🔍 SECRET_KEY exists: {bool(settings.SECRET_KEY)}")
-    
-    
         try:
             payload = jwt.decode(token, settings.SECRET_KEY, algorithms=['HS256'])
             user_id = int(payload.get('user_id'))
-            print(f"✅ Authenticated user_id: {user_id}")
         except jwt.ExpiredSignatureError:
-            print("❌ Token expired")
+            log.info('ws.auth_rejected', connection_id=connection_id, reason='expired')
             await websocket.close(code=4001, reason="Token expired")
             return
         except jwt.InvalidTokenError as e:
-            print(f"❌ Invalid token: {e}")
+            log.info('ws.auth_rejected', connection_id=connection_id, reason='invalid', detail=str(e))
             await websocket.close(code=4001, reason="Invalid token")
             return
-        except Exception as e:
-            print(f"❌ Auth error: {e}")
-            import traceback
-            traceback.print_exc()  # Print full error
+        except Exception:
+            log.exception('ws.auth_failed', connection_id=connection_id)
             await websocket.close(code=4001, reason="Authentication failed")
             return
 
@@ -325,12 +672,13 @@ async def websocket_endpoint(
             raw_data = await websocket.receive_text()
             await handle_message(websocket, connection_id, user_id, raw_data)
     except WebSocketDisconnect:
-        manager.disconnect(connection_id, user_id)
-        print(f"Connection {connection_id} disconnected normally")
-    except Exception as e:
-        print(f'WebSocket error for connection {connection_id}: {e}')
-        manager.disconnect(connection_id, user_id)
+        manager.disconnect(connection_id)
+    except Exception:
+        log.exception('ws.connection_failed', connection_id=connection_id)
+        manager.disconnect(connection_id)
+
 
+imported = time.perf_counter()
 
 if __name__ == "__main__":
     import uvicorn
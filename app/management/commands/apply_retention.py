@@ -0,0 +1,69 @@
+import time
+
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management.base import BaseCommand, CommandError
+
+from app.retention import deactivate_idle_anonymous_rooms, purge_expired_archives, purge_expired_messages
+
+
+class Command(BaseCommand):
+    help = (
+        "Purge messages past their room type's retention period, from the message "
+        "table and from the archive, and deactivate idle anonymous rooms. "
+        "Runs once, or forever with --every."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, help='Rows per delete batch')
+        parser.add_argument('--pause', type=float, default=0.0,
+                            help='Seconds to sleep between delete batches')
+        parser.add_argument('--every', type=float,
+                            help='Keep running, sweeping every N seconds')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Report what would be reclaimed without deleting')
+
+    def handle(self, *args, **options):
+        while True:
+            self.sweep(options)
+            if not options['every']:
+                break
+            time.sleep(options['every'])
+
+    def sweep(self, options):
+        started = time.monotonic()
+        messages = 0
+        for report in purge_expired_messages(
+            batch_size=options['batch_size'],
+            pause=options['pause'],
+            dry_run=options['dry_run'],
+        ):
+            messages += report['rows']
+            self.stdout.write(
+                f"messages[{report['room_type']}]: {report['rows']} rows in {report['seconds'] * 1000:.1f}ms"
+            )
+
+        try:
+            for report in purge_expired_archives(dry_run=options['dry_run']):
+                messages += report['rows']
+                self.stdout.write(
+                    f"archived[{report['room_type']}] room {report['chat_room_id']}: "
+                    f"{report['rows']} rows in {report['seconds'] * 1000:.1f}ms"
+                )
+        except ImproperlyConfigured as e:
+            raise CommandError(str(e))
+
+        rooms = 0
+        for report in deactivate_idle_anonymous_rooms(
+            batch_size=options['batch_size'],
+            dry_run=options['dry_run'],
+        ):
+            rooms += report['rows']
+            self.stdout.write(
+                f"idle anonymous rooms: {report['rows']} rows in {report['seconds'] * 1000:.1f}ms"
+            )
+
+        prefix = 'Dry run: would reclaim' if options['dry_run'] else 'Reclaimed'
+        self.stdout.write(self.style.SUCCESS(
+            f"{prefix} {messages} messages and {rooms} idle anonymous rooms "
+            f"in {time.monotonic() - started:.2f}s"
+        ))
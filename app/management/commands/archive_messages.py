@@ -0,0 +1,48 @@
+import time
+from datetime import timedelta
+
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management.base import BaseCommand, CommandError
+
+from app.archive import archive_messages, check_archive_root
+
+
+class Command(BaseCommand):
+    help = (
+        "Move old messages from the message table into compressed per-room archive segments. "
+        "Only current content is archived: earlier versions of edited messages and "
+        "tombstones of deleted ones are dropped."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than-days', type=int,
+                            help='Archive messages older than this (default MESSAGE_ARCHIVE_AFTER_DAYS)')
+        parser.add_argument('--room', type=int, action='append', dest='rooms',
+                            help='Only archive this room; repeat for several rooms')
+        parser.add_argument('--block-size', type=int, help='Messages per compressed block')
+
+    def handle(self, *args, **options):
+        try:
+            check_archive_root()
+        except ImproperlyConfigured as e:
+            raise CommandError(str(e))
+
+        older_than = None
+        if options['older_than_days'] is not None:
+            older_than = timedelta(days=options['older_than_days'])
+
+        started = time.monotonic()
+        total = 0
+        for report in archive_messages(
+            older_than=older_than,
+            room_ids=options['rooms'],
+            block_size=options['block_size'],
+        ):
+            total += report['rows']
+            self.stdout.write(
+                f"room {report['chat_room_id']}: {report['rows']} messages in {report['seconds'] * 1000:.1f}ms"
+            )
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Archived {total} messages in {time.monotonic() - started:.2f}s"
+        ))
@@ -0,0 +1,95 @@
+from datetime import datetime, timedelta, timezone
+
+import jwt
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count
+from django.test import Client
+
+from app.benchmarks import (
+    QUERY_BUDGETS, api_scenarios, environment, percentiles, run_scenario, write_report,
+)
+
+
+def bearer_headers(user):
+    """An Authorization header for `user`, signed the way the login view signs it."""
+    token = jwt.encode(
+        {'user_id': user.id, 'username': user.username, 'exp': datetime.now(timezone.utc) + timedelta(hours=1)},
+        settings.SECRET_KEY, algorithm='HS256',
+    )
+    return {'HTTP_AUTHORIZATION': f'Bearer {token}'}
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark every REST endpoint in-process against the current database "
+        "(see generate_chat_data): latency percentiles and query counts per "
+        "endpoint, checked against QUERY_BUDGETS. Each request runs in a "
+        "rolled-back transaction, so the data is left unchanged."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', help='Username to act as (default: the member of the most rooms)')
+        parser.add_argument('--password', default='benchpass', help="That user's password, for login")
+        parser.add_argument('--iterations', type=int, default=20)
+        parser.add_argument('--warmup', type=int, default=2)
+        parser.add_argument('--endpoint', action='append', dest='endpoints',
+                            help='Only benchmark this URL name (repeatable)')
+        parser.add_argument('--fail-over-budget', action='store_true',
+                            help='Exit with an error if any endpoint exceeds its query budget')
+        parser.add_argument('-o', '--output', help='Write the JSON report here instead of stdout')
+
+    def handle(self, *args, **options):
+        if options['user']:
+            user = User.objects.filter(username=options['user']).first()
+        else:
+            user = User.objects.annotate(rooms=Count('chat_rooms')).order_by('-rooms', 'id').first()
+        if not user:
+            raise CommandError('No such user; generate data with generate_chat_data first')
+
+        scenarios = api_scenarios(user, options['password'])
+        if options['endpoints']:
+            scenarios = [s for s in scenarios if s.name in options['endpoints']]
+
+        client = Client(SERVER_NAME='localhost')
+        headers = bearer_headers(user)
+        endpoints = {}
+        for scenario in scenarios:
+            for _ in range(options['warmup']):
+                run_scenario(client, scenario, headers)
+            latencies, query_counts, statuses = [], [], set()
+            for _ in range(options['iterations']):
+                status, queries, elapsed = run_scenario(client, scenario, headers)
+                latencies.append(elapsed)
+                query_counts.append(queries)
+                statuses.add(status)
+
+            budget = QUERY_BUDGETS.get(scenario.name)
+            endpoints[scenario.name] = {
+                'method': scenario.method.upper(),
+                'path': scenario.path,
+                'status': sorted(statuses),
+                'queries': max(query_counts),
+                'query_budget': budget,
+                'over_budget': budget is not None and max(query_counts) > budget,
+                'latency_ms': percentiles(latencies),
+            }
+
+        over_budget = sorted(name for name, result in endpoints.items() if result['over_budget'])
+        skipped = sorted(set(QUERY_BUDGETS) - set(endpoints)) if not options['endpoints'] else []
+        write_report({
+            'benchmark': 'api',
+            'environment': environment(),
+            'config': {
+                'user': user.username,
+                'iterations': options['iterations'],
+                'warmup': options['warmup'],
+            },
+            'endpoints': endpoints,
+            'over_budget': over_budget,
+            'skipped': skipped,
+        }, options['output'], self.stdout)
+
+        if options['fail_over_budget'] and over_budget:
+            raise CommandError(f"Over query budget: {', '.join(over_budget)}")
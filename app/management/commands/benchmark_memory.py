@@ -0,0 +1,109 @@
+import gc
+import random
+import tracemalloc
+import uuid
+from array import array
+
+from django.core.management.base import BaseCommand
+
+from app.benchmarks import environment, write_report
+from app.rooms import RoomEntry
+
+# Stands in for every WebSocket: sockets cost the same in any layout.
+SOCKET = object()
+STAMP = '0' * 16
+
+
+def measure(build):
+    """Bytes allocated by build() and still held by what it returns."""
+    gc.collect()
+    tracemalloc.start()
+    try:
+        held = build()
+        gc.collect()
+        used = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    del held
+    return used
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure the FastAPI gateway's in-memory bookkeeping with tracemalloc: "
+        "bytes per open connection in app.main.ConnectionManager and per room "
+        "membership in app.rooms.RoomDirectory, next to the plain dict and set "
+        "layouts they replaced. Sockets and the user id ints themselves are not "
+        "counted. Needs no database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--connections', type=int, default=100000)
+        parser.add_argument('--users', type=int,
+                            help='Distinct users among the connections (default: 80%% of them)')
+        parser.add_argument('--rooms', type=int, default=20000)
+        parser.add_argument('--rooms-per-user', type=int, default=10)
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('-o', '--output', help='Write the JSON report here instead of stdout')
+
+    def handle(self, *args, **options):
+        from app.main import Connection, ConnectionManager
+
+        rng = random.Random(options['seed'])
+        count = options['connections']
+        users = list(range(1, (options['users'] or count * 4 // 5) + 1))
+        # Every user has a tab open, the rest are second tabs.
+        owners = users + [rng.choice(users) for _ in range(count - len(users))]
+
+        def slotted():
+            manager = ConnectionManager()
+            for user_id in owners:
+                manager.add(Connection(manager.new_id(), SOCKET, user_id))
+            return manager
+
+        def dicts():
+            active_connections, connection_user, user_connections = {}, {}, {}
+            for user_id in owners:
+                connection_id = str(uuid.UUID(int=rng.getrandbits(128), version=4))
+                active_connections[connection_id] = SOCKET
+                connection_user[connection_id] = user_id
+                user_connections.setdefault(user_id, set()).add(connection_id)
+            return active_connections, connection_user, user_connections
+
+        room_ids = list(range(1, options['rooms'] + 1))
+        members = {room_id: [] for room_id in room_ids}
+        for user_id in users:
+            for room_id in rng.sample(room_ids, min(options['rooms_per_user'], len(room_ids))):
+                members[room_id].append(user_id)
+        memberships = sum(len(ids) for ids in members.values())
+
+        def arrays():
+            return {
+                room_id: RoomEntry(room_id, 'group', array('q', sorted(ids)), STAMP)
+                for room_id, ids in members.items()
+            }
+
+        def sets():
+            return {room_id: ('group', set(ids), STAMP) for room_id, ids in members.items()}
+
+        def result(used, per, unit):
+            return {'bytes': used, f'bytes_per_{unit}': round(used / per, 1) if per else None}
+
+        write_report({
+            'benchmark': 'memory',
+            'environment': environment(),
+            'config': {
+                'connections': count,
+                'users': len(users),
+                'rooms': len(room_ids),
+                'memberships': memberships,
+            },
+            'connections': {
+                'slotted_records': result(measure(slotted), count, 'connection'),
+                'uuid_dicts': result(measure(dicts), count, 'connection'),
+            },
+            'room_memberships': {
+                'sorted_arrays': result(measure(arrays), memberships, 'membership'),
+                'sets': result(measure(sets), memberships, 'membership'),
+            },
+        }, options['output'], self.stdout)
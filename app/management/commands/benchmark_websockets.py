@@ -0,0 +1,284 @@
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta
+
+import jwt
+import websockets
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from app.benchmarks import environment, percentiles, write_report
+from app.models import ChatRoom
+
+GATEWAYS = {
+    'fastapi': ('app.main:app', '/ws'),
+    'channels': ('chat_app.asgi:application', '/ws/'),
+}
+CONTENT_PREFIX = 'bench:'
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def raise_open_file_limit():
+    try:
+        import resource
+    except ImportError:
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+
+class Stats:
+    def __init__(self):
+        self.connect_ms = []
+        self.connect_errors = 0
+        self.sent = 0
+        self.sent_by_room = {}
+        self.send_errors = 0
+        self.delivered = 0
+        self.error_frames = 0
+        self.latency_ms = []
+        self.disconnects = 0
+
+
+class Command(BaseCommand):
+    help = (
+        "Load-test a websocket gateway: spawns app.main (fastapi) or the Channels "
+        "stack under uvicorn against the configured database, connects simulated "
+        "clients in group rooms, and reports throughput and delivery latency as JSON. "
+        "Set DATABASE_URL to benchmark against Postgres."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--gateway', choices=sorted(GATEWAYS), default='fastapi')
+        parser.add_argument('--url', help='Benchmark an already running gateway at this ws:// base URL '
+                                          'instead of spawning one (it must share this database)')
+        parser.add_argument('--clients', type=int, default=500, help='Simulated connections')
+        parser.add_argument('--room-size', type=int, default=10, help='Clients per group room')
+        parser.add_argument('--senders-per-room', type=int, default=1,
+                            help='Clients in each room that send messages')
+        parser.add_argument('--rate', type=float, default=1.0,
+                            help='Messages per second per sender (Poisson arrivals)')
+        parser.add_argument('--duration', type=float, default=30.0, help='Measured seconds')
+        parser.add_argument('--warmup', type=float, default=3.0, help='Unmeasured seconds before the run')
+        parser.add_argument('--drain', type=float, default=3.0,
+                            help='Seconds to wait for in-flight deliveries after senders stop')
+        parser.add_argument('--connect-concurrency', type=int, default=100,
+                            help='Handshakes in flight at once while connecting')
+        parser.add_argument('--workers', type=int, default=1, help='uvicorn workers for the spawned gateway')
+        parser.add_argument('--keep-data', action='store_true', help='Do not delete the benchmark users and rooms')
+        parser.add_argument('-o', '--output', help='Write the JSON report here instead of stdout')
+
+    def handle(self, *args, **options):
+        if options['clients'] < 1 or options['room_size'] < 1:
+            raise CommandError('--clients and --room-size must be positive')
+        if options['gateway'] == 'channels' and options['workers'] > 1 and 'REDIS_URL' not in os.environ:
+            raise CommandError('Channels with several workers needs REDIS_URL for a shared channel layer')
+        raise_open_file_limit()
+
+        run_id = uuid.uuid4().hex[:8]
+        users, rooms = self.create_fixtures(run_id, options['clients'], options['room_size'])
+        server = None
+        try:
+            if options['url']:
+                base_url = options['url'].rstrip('/')
+            else:
+                port = free_port()
+                server = self.spawn_gateway(options['gateway'], port, options['workers'])
+                base_url = f'ws://127.0.0.1:{port}'
+
+            stats = asyncio.run(self.run_load(base_url + GATEWAYS[options['gateway']][1], users, rooms, options))
+        finally:
+            if server:
+                server.terminate()
+                try:
+                    server.wait(timeout=10)
+                except subprocess.TimeoutExpired:
+                    server.kill()
+            if not options['keep_data']:
+                ChatRoom.objects.filter(id__in=[room_id for room_id, _ in rooms]).delete()
+                User.objects.filter(id__in=[user_id for user_id, _ in users]).delete()
+
+        write_report(self.report(stats, rooms, options), options['output'], self.stdout)
+
+    def create_fixtures(self, run_id, clients, room_size):
+        """Bench users (one per client) in group rooms of room_size; returns
+        [(user_id, token)] and [(room_id, [member indexes])]."""
+        User.objects.bulk_create(
+            [User(username=f'bench-{run_id}-{i}', password='!') for i in range(clients)],
+            batch_size=1000,
+        )
+        user_ids = list(
+            User.objects.filter(username__startswith=f'bench-{run_id}-').order_by('id').values_list('id', flat=True)
+        )
+        expires = datetime.utcnow() + timedelta(hours=24)
+        users = [
+            (user_id, jwt.encode({'user_id': user_id, 'exp': expires}, settings.SECRET_KEY, algorithm='HS256'))
+            for user_id in user_ids
+        ]
+
+        groups = [list(range(start, min(start + room_size, clients))) for start in range(0, clients, room_size)]
+        ChatRoom.objects.bulk_create(
+            [ChatRoom(name=f'bench-{run_id}-{r}', room_type='group') for r in range(len(groups))],
+            batch_size=1000,
+        )
+        room_ids = list(
+            ChatRoom.objects.filter(name__startswith=f'bench-{run_id}-').order_by('id').values_list('id', flat=True)
+        )
+        Membership = ChatRoom.participants.through
+        Membership.objects.bulk_create(
+            [
+                Membership(chatroom_id=room_id, user_id=user_ids[i])
+                for room_id, members in zip(room_ids, groups)
+                for i in members
+            ],
+            batch_size=5000,
+        )
+        return users, list(zip(room_ids, groups))
+
+    def spawn_gateway(self, gateway, port, workers):
+        env = dict(os.environ, LOG_LEVEL=os.environ.get('LOG_LEVEL', 'WARNING'))
+        server = subprocess.Popen(
+            [
+                sys.executable, '-m', 'uvicorn', GATEWAYS[gateway][0],
+                '--host', '127.0.0.1', '--port', str(port),
+                '--workers', str(workers), '--log-level', 'warning',
+            ],
+            cwd=settings.BASE_DIR, env=env,
+        )
+        deadline = time.monotonic() + 60
+        while time.monotonic() < deadline:
+            if server.poll() is not None:
+                raise CommandError(f'{gateway} gateway exited with status {server.returncode}')
+            try:
+                with socket.create_connection(('127.0.0.1', port), timeout=0.5):
+                    return server
+            except OSError:
+                time.sleep(0.2)
+        server.kill()
+        raise CommandError(f'{gateway} gateway did not start listening on port {port}')
+
+    async def run_load(self, url, users, rooms, options):
+        stats = Stats()
+        measuring = {'from': None, 'until': None}
+        gate = asyncio.Semaphore(options['connect_concurrency'])
+
+        async def connect(token):
+            async with gate:
+                started = time.perf_counter()
+                try:
+                    ws = await websockets.connect(f'{url}?token={token}', max_queue=None, open_timeout=30)
+                except Exception:
+                    stats.connect_errors += 1
+                    return None
+                stats.connect_ms.append((time.perf_counter() - started) * 1000)
+                return ws
+
+        async def receive(ws):
+            try:
+                async for raw in ws:
+                    frame = json.loads(raw)
+                    if frame.get('type') == 'error':
+                        stats.error_frames += 1
+                        continue
+                    content = frame.get('content')
+                    if frame.get('type') != 'new_message' or not content or not content.startswith(CONTENT_PREFIX):
+                        continue
+                    sent_at = float(content[len(CONTENT_PREFIX):])
+                    if measuring['from'] and measuring['from'] <= sent_at <= measuring['until']:
+                        stats.delivered += 1
+                        stats.latency_ms.append((time.perf_counter() - sent_at) * 1000)
+            except websockets.ConnectionClosed:
+                stats.disconnects += 1
+
+        async def send(ws, room_id, stop_at):
+            rate = options['rate']
+            await asyncio.sleep(random.random() / rate)
+            while time.perf_counter() < stop_at:
+                sent_at = time.perf_counter()
+                try:
+                    await ws.send(json.dumps({
+                        'type': 'send_message',
+                        'chat_room_id': room_id,
+                        'content': f'{CONTENT_PREFIX}{sent_at:.6f}',
+                    }))
+                except websockets.ConnectionClosed:
+                    stats.send_errors += 1
+                    return
+                if measuring['from'] and measuring['from'] <= sent_at <= measuring['until']:
+                    stats.sent += 1
+                    stats.sent_by_room[room_id] = stats.sent_by_room.get(room_id, 0) + 1
+                await asyncio.sleep(random.expovariate(rate))
+
+        sockets = await asyncio.gather(*(connect(token) for _, token in users))
+        for (room_id, members) in rooms:
+            for i in members:
+                if sockets[i] is not None:
+                    await sockets[i].send(json.dumps({'type': 'join_room', 'chat_room_id': room_id}))
+        receivers = [asyncio.create_task(receive(ws)) for ws in sockets if ws is not None]
+
+        started = time.perf_counter()
+        measuring['from'] = started + options['warmup']
+        measuring['until'] = measuring['from'] + options['duration']
+        senders = [
+            asyncio.create_task(send(sockets[i], room_id, measuring['until']))
+            for room_id, members in rooms
+            for i in members[:options['senders_per_room']]
+            if sockets[i] is not None
+        ]
+        await asyncio.gather(*senders)
+        await asyncio.sleep(options['drain'])
+
+        await asyncio.gather(*(ws.close() for ws in sockets if ws is not None), return_exceptions=True)
+        await asyncio.gather(*receivers, return_exceptions=True)
+        return stats
+
+    def report(self, stats, rooms, options):
+        duration = options['duration']
+        room_sizes = {room_id: len(members) for room_id, members in rooms}
+        senders = sum(min(options['senders_per_room'], size) for size in room_sizes.values())
+        expected = sum(count * room_sizes[room_id] for room_id, count in stats.sent_by_room.items())
+        return {
+            'benchmark': 'websockets',
+            'gateway': options['gateway'],
+            'environment': environment(),
+            'config': {
+                'clients': options['clients'],
+                'rooms': len(rooms),
+                'room_size': options['room_size'],
+                'senders': senders,
+                'rate_per_sender': options['rate'],
+                'duration': duration,
+                'warmup': options['warmup'],
+                'workers': options['workers'],
+            },
+            'connections': {
+                'opened': len(stats.connect_ms),
+                'errors': stats.connect_errors,
+                'dropped': stats.disconnects,
+                'connect_ms': percentiles(stats.connect_ms),
+            },
+            'messages': {
+                'sent': stats.sent,
+                'send_errors': stats.send_errors,
+                'error_frames': stats.error_frames,
+                'delivered': stats.delivered,
+                'expected_deliveries': expected,
+                'sent_per_second': round(stats.sent / duration, 2),
+                'delivered_per_second': round(stats.delivered / duration, 2),
+            },
+            'delivery_latency_ms': percentiles(stats.latency_ms),
+        }
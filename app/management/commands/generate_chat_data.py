@@ -0,0 +1,217 @@
+import itertools
+import random
+import time
+from datetime import timedelta
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Max
+from django.utils import timezone
+
+from app.management.commands.import_chat_data import preserve_timestamps
+from app.models import ChatRoom, FriendRequest, Friendship, Message
+from app.search import get_message_search_index, get_user_search_index
+
+FIRST_NAMES = [
+    'alex', 'sam', 'jordan', 'taylor', 'casey', 'riley', 'morgan', 'jamie', 'avery', 'quinn',
+    'maria', 'li', 'arjun', 'fatima', 'kenji', 'olga', 'diego', 'amara', 'noah', 'zoe',
+]
+LAST_NAMES = [
+    'smith', 'garcia', 'chen', 'patel', 'kim', 'nguyen', 'muller', 'rossi', 'silva', 'khan',
+    'ivanova', 'okafor', 'tanaka', 'haddad', 'novak', 'larsen', 'costa', 'singh', 'wong', 'brown',
+]
+WORDS = (
+    'hey hello thanks sure maybe tomorrow tonight meeting lunch coffee project deadline '
+    'review deploy release bug fix test build server database query latency cache '
+    'weekend movie game music photo trip flight hotel dinner party birthday call later '
+    'ok yes no great awesome sounds good see you soon lol haha what why when where how'
+).split()
+
+
+def zipf_cum_weights(n, exponent):
+    """Cumulative Zipf weights for random.choices(cum_weights=...)."""
+    return list(itertools.accumulate(1 / (rank ** exponent) for rank in range(1, n + 1)))
+
+
+class Command(BaseCommand):
+    help = (
+        "Generate synthetic chat data at scale for benchmarks: users, a skewed "
+        "friendship graph with pending requests, private/group/anonymous rooms "
+        "and Zipf-distributed message volumes. Adds to whatever is already in "
+        "the database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--friends', type=float, default=10,
+                            help='Average friendships per user (popular users get more)')
+        parser.add_argument('--pending-requests', type=float, default=1,
+                            help='Average pending friend requests per user')
+        parser.add_argument('--private-ratio', type=float, default=0.3,
+                            help='Fraction of friendships that have a private room')
+        parser.add_argument('--groups', type=int, default=100)
+        parser.add_argument('--group-size', type=int, default=8, help='Typical group size')
+        parser.add_argument('--max-group-size', type=int, default=500)
+        parser.add_argument('--anonymous-rooms', type=int, default=10)
+        parser.add_argument('--messages', type=int, default=100000)
+        parser.add_argument('--skew', type=float, default=1.1,
+                            help='Zipf exponent of messages per room (0 = uniform)')
+        parser.add_argument('--days', type=int, default=30, help='Spread message timestamps over this many days')
+        parser.add_argument('--password', default='benchpass',
+                            help='Password of every generated user (hashed once)')
+        parser.add_argument('--seed', type=int, help='Random seed, for reproducible data sets')
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--skip-search-index', action='store_true',
+                            help='Do not rebuild the user and message search indexes afterwards')
+
+    def handle(self, *args, **options):
+        if options['users'] < 2:
+            raise CommandError('--users must be at least 2')
+        self.random = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        started = time.monotonic()
+
+        user_ids = self.phase('users', self.create_users, options['users'], options['password'])
+        friendships = self.phase('friendships', self.create_friendships, user_ids, options['friends'])
+        self.phase('friend requests', self.create_friend_requests,
+                   user_ids, friendships, options['pending_requests'])
+        members = self.phase('private rooms', self.create_private_rooms, friendships, options['private_ratio'])
+        members.update(self.phase('group rooms', self.create_groups, user_ids, options['groups'],
+                                  options['group_size'], options['max_group_size']))
+        members.update(self.phase('anonymous rooms', self.create_anonymous_rooms, options['anonymous_rooms']))
+        self.phase('messages', self.create_messages, members, options['messages'],
+                   options['skew'], options['days'])
+
+        if not options['skip_search_index']:
+            self.phase('user search index', get_user_search_index().rebuild, self.batch_size)
+            self.phase('message search index', get_message_search_index().rebuild, self.batch_size)
+
+        self.stdout.write(self.style.SUCCESS(f"Generated data in {time.monotonic() - started:.1f}s"))
+
+    def phase(self, name, func, *args):
+        started = time.monotonic()
+        result = func(*args)
+        size = result if isinstance(result, int) else len(result)
+        self.stdout.write(f"{name}: {size} in {time.monotonic() - started:.1f}s")
+        return result
+
+    def create_users(self, count, password):
+        start = (User.objects.aggregate(last=Max('id'))['last'] or 0) + 1
+        hashed = make_password(password)
+        users = []
+        for i in range(start, start + count):
+            first, last = self.random.choice(FIRST_NAMES), self.random.choice(LAST_NAMES)
+            users.append(User(
+                username=f'{first}_{last}{i}',
+                email=f'{first}.{last}{i}@example.com',
+                password=hashed,
+            ))
+        User.objects.bulk_create(users, batch_size=self.batch_size)
+        return list(User.objects.filter(id__gte=start).order_by('id').values_list('id', flat=True))
+
+    def create_friendships(self, user_ids, average):
+        """Pairs (a, b), a < b. Partners are drawn with Zipf weights so a few
+        users are very popular, as in real social graphs."""
+        popularity = user_ids[:]
+        self.random.shuffle(popularity)
+        cum_weights = zipf_cum_weights(len(popularity), 0.8)
+        target = int(len(user_ids) * average / 2)
+
+        pairs = set()
+        attempts = 0
+        while len(pairs) < target and attempts < target * 5:
+            attempts += 1
+            a = self.random.choice(user_ids)
+            b = self.random.choices(popularity, cum_weights=cum_weights)[0]
+            if a != b:
+                pairs.add((min(a, b), max(a, b)))
+
+        Friendship.objects.bulk_create(
+            [Friendship(user1_id=a, user2_id=b) for a, b in pairs],
+            batch_size=self.batch_size, ignore_conflicts=True,
+        )
+        return pairs
+
+    def create_friend_requests(self, user_ids, friendships, average):
+        requests = set()
+        for _ in range(int(len(user_ids) * average)):
+            sender, receiver = self.random.sample(user_ids, 2)
+            if (min(sender, receiver), max(sender, receiver)) not in friendships:
+                requests.add((sender, receiver))
+        FriendRequest.objects.bulk_create(
+            [FriendRequest(sender_id=s, receiver_id=r) for s, r in requests],
+            batch_size=self.batch_size, ignore_conflicts=True,
+        )
+        return requests
+
+    def create_rooms(self, rooms, memberships):
+        """bulk_create rooms and their participant rows; returns {room_id: [user_ids]}."""
+        created = ChatRoom.objects.bulk_create(rooms, batch_size=self.batch_size)
+        Membership = ChatRoom.participants.through
+        Membership.objects.bulk_create(
+            [
+                Membership(chatroom_id=room.id, user_id=user_id)
+                for room, user_ids in zip(created, memberships)
+                for user_id in user_ids
+            ],
+            batch_size=self.batch_size,
+        )
+        return {room.id: user_ids for room, user_ids in zip(created, memberships)}
+
+    def create_private_rooms(self, friendships, ratio):
+        pairs = [pair for pair in friendships if self.random.random() < ratio]
+        return self.create_rooms(
+            [ChatRoom(room_type='private') for _ in pairs],
+            [list(pair) for pair in pairs],
+        )
+
+    def create_groups(self, user_ids, count, typical_size, max_size):
+        rooms, memberships = [], []
+        for i in range(count):
+            # Pareto-distributed sizes: mostly small groups, a long tail of huge ones.
+            size = int(typical_size * self.random.paretovariate(1.5) / 1.5)
+            size = max(3, min(size, max_size, len(user_ids)))
+            rooms.append(ChatRoom(room_type='group', name=f'{self.random.choice(WORDS)} group {i}'))
+            memberships.append(self.random.sample(user_ids, size))
+        return self.create_rooms(rooms, memberships)
+
+    def create_anonymous_rooms(self, count):
+        return self.create_rooms(
+            [ChatRoom(room_type='anonymous', name=f'{self.random.choice(WORDS)} lounge {i}') for i in range(count)],
+            [[] for _ in range(count)],
+        )
+
+    def create_messages(self, members, count, skew, days):
+        """Messages spread over `days` with increasing timestamps (so ids
+        and time agree), assigned to rooms with Zipf-skewed volumes."""
+        if not members or not count:
+            return 0
+        room_ids = list(members)
+        self.random.shuffle(room_ids)
+        cum_weights = zipf_cum_weights(len(room_ids), skew)
+        start = timezone.now() - timedelta(days=days)
+        step = timedelta(days=days) / count
+        field = Message._meta.get_field('timestamp')
+
+        created = 0
+        with preserve_timestamps(field):
+            while created < count:
+                batch = []
+                size = min(self.batch_size, count - created)
+                for room_id in self.random.choices(room_ids, cum_weights=cum_weights, k=size):
+                    participants = members[room_id]
+                    words = self.random.choices(WORDS, k=self.random.randint(1, 12))
+                    message = Message(
+                        chat_room_id=room_id,
+                        content=' '.join(words),
+                        timestamp=start + step * (created + len(batch)),
+                    )
+                    if participants:
+                        message.sender_id = self.random.choice(participants)
+                    else:
+                        message.anonymous_name = f'{self.random.choice(FIRST_NAMES)}{self.random.randint(1, 99)}'
+                    batch.append(message)
+                Message.objects.bulk_create(batch)
+                created += len(batch)
+        return created
@@ -0,0 +1,344 @@
+import json
+import os
+import time
+from contextlib import contextmanager
+from datetime import timezone as dt_timezone
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from app.models import ChatRoom, Friendship, ImportBatch, Message
+from app.versioning import bump, member_keys, room_key
+
+RECORD_TYPES = ('user', 'room', 'friendship', 'message')
+# Fields a record cannot be imported without.
+REQUIRED_FIELDS = {
+    'user': ('id', 'username'),
+    'room': ('id',),
+    'friendship': ('user1', 'user2'),
+    'message': ('room',),
+}
+# The record's timestamp field; missing ones are set to the import time.
+TIME_FIELDS = {
+    'user': 'date_joined',
+    'room': 'created_at',
+    'friendship': 'created_at',
+    'message': 'timestamp',
+}
+ROOM_TYPES = dict(ChatRoom.ROOM_TYPES)
+
+
+@contextmanager
+def preserve_timestamps(*fields):
+    """Let bulk_create keep imported created_at/timestamp values."""
+    previous = [field.auto_now_add for field in fields]
+    for field in fields:
+        field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, value in zip(fields, previous):
+            field.auto_now_add = value
+
+
+class Command(BaseCommand):
+    help = (
+        "Bulk import users, friendships, rooms and messages from NDJSON. "
+        "Each line is an object with a 'type' of user, room, friendship or message; "
+        "foreign keys refer to the source ids of earlier user/room lines. "
+        "Imported users never take over local accounts: a username that is already "
+        "taken gets a numeric suffix, and each rename is reported."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='NDJSON input file')
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--source', help='Checkpoint name (defaults to the absolute input path)')
+        parser.add_argument('--resume', action='store_true',
+                            help='Skip lines committed by an earlier run of the same source')
+        parser.add_argument('--skip-invalid', action='store_true',
+                            help='Skip and count malformed lines instead of stopping at the first one')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        self.batch_size = options['batch_size']
+        self.source = options['source'] or os.path.abspath(path)
+        self.skip_invalid = options['skip_invalid']
+
+        self.user_ids = {}
+        self.room_ids = {}
+        self.pending = {record_type: [] for record_type in RECORD_TYPES}
+        self.pending_count = 0
+        self.changed_keys = set()
+        self.new_user_ids = {}
+        self.new_room_ids = {}
+        self.skipped = 0
+        self.invalid = 0
+        self.renamed = 0
+        self.imported = 0
+
+        start_line = 0
+        if options['resume']:
+            start_line = self.load_checkpoint()
+            self.stdout.write(f"Resuming after line {start_line}")
+        elif ImportBatch.objects.filter(source=self.source).exists():
+            raise CommandError(
+                f"{self.source} was already (partially) imported; pass --resume to continue"
+            )
+
+        self.started = time.monotonic()
+        line_number = 0
+        with open(path, encoding='utf-8') as source, preserve_timestamps(
+            ChatRoom._meta.get_field('created_at'),
+            Friendship._meta.get_field('created_at'),
+            Message._meta.get_field('timestamp'),
+        ):
+            for line_number, line in enumerate(source, start=1):
+                if line_number <= start_line or not line.strip():
+                    continue
+                try:
+                    record = self.parse_record(line)
+                except CommandError as e:
+                    if not self.skip_invalid:
+                        raise CommandError(f"Line {line_number}: {e}")
+                    self.stderr.write(f"Line {line_number}: {e}, skipped")
+                    self.invalid += 1
+                    continue
+
+                self.pending[record['type']].append(record)
+                self.pending_count += 1
+                if self.pending_count >= self.batch_size:
+                    self.flush(line_number)
+
+            self.flush(line_number)
+
+        elapsed = time.monotonic() - self.started
+        rate = self.imported / elapsed if elapsed else 0
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {self.imported} rows ({self.skipped} skipped, {self.invalid} invalid lines, "
+            f"{self.renamed} users renamed) "
+            f"in {elapsed:.1f}s, {rate:.0f} rows/s"
+        ))
+        self.stdout.write(
+            "Run rebuild_user_search_index and rebuild_message_search_index "
+            "if the database search index backends are in use."
+        )
+
+    def parse_record(self, line):
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError as e:
+            raise CommandError(f"invalid JSON ({e})")
+        if not isinstance(record, dict):
+            raise CommandError("expected a JSON object")
+
+        record_type = record.get('type')
+        if record_type not in self.pending:
+            raise CommandError(f"unknown record type {record_type!r}")
+        missing = [field for field in REQUIRED_FIELDS[record_type] if record.get(field) in (None, '')]
+        if missing:
+            raise CommandError(f"{record_type} record is missing {', '.join(missing)}")
+        if record_type == 'room' and record.setdefault('room_type', 'group') not in ROOM_TYPES:
+            raise CommandError(f"unknown room type {record['room_type']!r}")
+        field = TIME_FIELDS[record_type]
+        record[field] = self.parse_time(field, record.get(field))
+        return record
+
+    def flush(self, line_number):
+        if not self.pending_count:
+            return
+
+        batch_started = time.monotonic()
+        with transaction.atomic():
+            count = self.flush_users(self.pending['user'])
+            count += self.flush_rooms(self.pending['room'])
+            count += self.flush_friendships(self.pending['friendship'])
+            count += self.flush_messages(self.pending['message'])
+            self.write_checkpoint(line_number, count)
+        # Imported rows may land in existing users' lists.
+        bump(*self.changed_keys)
+        self.changed_keys.clear()
+
+        self.imported += count
+        for records in self.pending.values():
+            records.clear()
+        self.pending_count = 0
+
+        elapsed = time.monotonic() - batch_started
+        total_elapsed = time.monotonic() - self.started
+        self.stdout.write(
+            f"line {line_number}: {count} rows in {elapsed:.2f}s "
+            f"({count / elapsed if elapsed else 0:.0f} rows/s, "
+            f"{self.imported / total_elapsed if total_elapsed else 0:.0f} rows/s overall)"
+        )
+
+    def flush_users(self, records):
+        if not records:
+            return 0
+
+        taken = set(User.objects.filter(
+            username__in=[record['username'] for record in records]
+        ).values_list('username', flat=True))
+
+        users = []
+        for record in records:
+            username = record['username']
+            if username in taken:
+                username = self.free_username(username, taken)
+                self.stderr.write(f"User {record['id']}: {record['username']!r} is taken, imported as {username!r}")
+                self.renamed += 1
+            taken.add(username)
+            users.append(User(
+                username=username,
+                email=record.get('email', ''),
+                password=record.get('password') or make_password(None),
+                date_joined=record['date_joined'],
+            ))
+
+        User.objects.bulk_create(users, batch_size=self.batch_size)
+        for record, user in zip(records, users):
+            self.map_user(record['id'], user.id)
+        return len(users)
+
+    def free_username(self, username, taken):
+        """username with the lowest numeric suffix no account or earlier
+        record of this batch uses."""
+        prefix = f"{username[:User._meta.get_field('username').max_length - 8]}-"
+        used = taken | set(User.objects.filter(username__startswith=prefix).values_list('username', flat=True))
+        suffix = 1
+        while f'{prefix}{suffix}' in used:
+            suffix += 1
+        return f'{prefix}{suffix}'
+
+    def flush_rooms(self, records):
+        if not records:
+            return 0
+
+        rooms = [ChatRoom(
+            name=record.get('name', ''),
+            room_type=record['room_type'],
+            description=record.get('description', ''),
+            is_active=record.get('is_active', True),
+            created_at=record['created_at'],
+        ) for record in records]
+        ChatRoom.objects.bulk_create(rooms, batch_size=self.batch_size)
+
+        Membership = ChatRoom.participants.through
+        memberships = []
+        for record, room in zip(records, rooms):
+            self.map_room(record['id'], room.id)
+            for source_user_id in record.get('participants', []):
+                user_id = self.user_ids.get(str(source_user_id))
+                if user_id is None:
+                    self.skipped += 1
+                    continue
+                memberships.append(Membership(chatroom_id=room.id, user_id=user_id))
+        self.changed_keys.update(member_keys({m.user_id for m in memberships}))
+        Membership.objects.bulk_create(memberships, batch_size=self.batch_size, ignore_conflicts=True)
+        return len(rooms) + len(memberships)
+
+    def flush_friendships(self, records):
+        pairs = {}
+        for record in records:
+            user1_id = self.user_ids.get(str(record['user1']))
+            user2_id = self.user_ids.get(str(record['user2']))
+            if user1_id is None or user2_id is None or user1_id == user2_id:
+                self.skipped += 1
+                continue
+            # (a, b) and (b, a) are the same friendship.
+            pair = (min(user1_id, user2_id), max(user1_id, user2_id))
+            if pair in pairs:
+                self.skipped += 1
+                continue
+            pairs[pair] = record
+
+        if pairs:
+            # Friendships made in the app keep the order the request was
+            # sent in, so look for existing rows either way round.
+            user_ids = {user_id for pair in pairs for user_id in pair}
+            existing = Friendship.objects.filter(
+                user1_id__in=user_ids, user2_id__in=user_ids
+            ).values_list('user1_id', 'user2_id')
+            for user1_id, user2_id in existing:
+                if pairs.pop((min(user1_id, user2_id), max(user1_id, user2_id)), None) is not None:
+                    self.skipped += 1
+
+        friendships = [Friendship(
+            user1_id=user1_id,
+            user2_id=user2_id,
+            created_at=record['created_at'],
+        ) for (user1_id, user2_id), record in pairs.items()]
+        Friendship.objects.bulk_create(friendships, batch_size=self.batch_size, ignore_conflicts=True)
+        self.changed_keys.update(member_keys(
+            {f.user1_id for f in friendships} | {f.user2_id for f in friendships}, 'friends'
+        ))
+        return len(friendships)
+
+    def flush_messages(self, records):
+        messages = []
+        for record in records:
+            room_id = self.room_ids.get(str(record['room']))
+            sender = record.get('sender')
+            sender_id = self.user_ids.get(str(sender)) if sender is not None else None
+            if room_id is None or (sender is not None and sender_id is None):
+                self.skipped += 1
+                continue
+            messages.append(Message(
+                chat_room_id=room_id,
+                sender_id=sender_id,
+                anonymous_name=record.get('anonymous_name', ''),
+                content=record.get('content', ''),
+                timestamp=record['timestamp'],
+            ))
+        Message.objects.bulk_create(messages, batch_size=self.batch_size)
+        self.changed_keys.update(room_key(room_id, 'messages') for room_id in {m.chat_room_id for m in messages})
+        return len(messages)
+
+    def parse_time(self, field, value):
+        if not value:
+            return timezone.now()
+        try:
+            parsed = parse_datetime(value)
+        except (TypeError, ValueError):
+            # Well formed but not a real date, such as February 30th.
+            parsed = None
+        if parsed is None:
+            raise CommandError(f"invalid {field} {value!r}")
+        if timezone.is_naive(parsed):
+            parsed = timezone.make_aware(parsed, dt_timezone.utc)
+        return parsed
+
+    def map_user(self, source_id, user_id):
+        self.user_ids[str(source_id)] = user_id
+        self.new_user_ids[str(source_id)] = user_id
+
+    def map_room(self, source_id, room_id):
+        self.room_ids[str(source_id)] = room_id
+        self.new_room_ids[str(source_id)] = room_id
+
+    def write_checkpoint(self, line_number, count):
+        # Written in the batch's transaction, so a batch and its checkpoint
+        # commit or roll back together. Each row only carries the id mappings
+        # created by its batch, so the cost does not grow with the import.
+        ImportBatch.objects.create(
+            source=self.source,
+            line=line_number,
+            rows=count,
+            user_ids=self.new_user_ids,
+            room_ids=self.new_room_ids,
+        )
+        self.new_user_ids = {}
+        self.new_room_ids = {}
+
+    def load_checkpoint(self):
+        line_number = 0
+        batches = ImportBatch.objects.filter(source=self.source).order_by('line')
+        for batch in batches.iterator():
+            self.user_ids.update(batch.user_ids)
+            self.room_ids.update(batch.room_ids)
+            line_number = batch.line
+        return line_number
@@ -0,0 +1,98 @@
+# Generated by Django 5.2.5 on 2026-10-19 08:43
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_user_search_index(apps, schema_editor):
+    from app.search import normalize, trigrams
+
+    User = apps.get_model("auth", "User")
+    UserSearchEntry = apps.get_model("app", "UserSearchEntry")
+    UserSearchTrigram = apps.get_model("app", "UserSearchTrigram")
+    include_email = getattr(settings, "USER_SEARCH_INCLUDE_EMAIL", True)
+
+    entries, grams = [], []
+    users = User.objects.order_by("id").values_list("id", "username", "email")
+    for user_id, username, email in users.iterator(chunk_size=2000):
+        entries.append(
+            UserSearchEntry(
+                user_id=user_id,
+                username_key=normalize(username),
+                email_key=normalize(email) if include_email else "",
+            )
+        )
+        grams.extend(
+            UserSearchTrigram(trigram=tri, user_id=user_id)
+            for tri in trigrams(username)
+        )
+        if len(entries) >= 2000:
+            UserSearchEntry.objects.bulk_create(entries)
+            UserSearchTrigram.objects.bulk_create(grams)
+            entries, grams = [], []
+    UserSearchEntry.objects.bulk_create(entries)
+    UserSearchTrigram.objects.bulk_create(grams)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("app", "0004_chatroom_description"),
+        ("auth", "0012_alter_user_first_name_max_length"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="UserSearchEntry",
+            fields=[
+                (
+                    "user",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="search_entry",
+                        serialize=False,
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+                ("username_key", models.CharField(db_index=True, max_length=150)),
+                (
+                    "email_key",
+                    models.CharField(blank=True, db_index=True, max_length=254),
+                ),
+            ],
+        ),
+        migrations.CreateModel(
+            name="UserSearchTrigram",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("trigram", models.CharField(max_length=3)),
+                (
+                    "user",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="search_trigrams",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["trigram", "user"], name="app_usertrigram_lookup"
+                    )
+                ],
+            },
+        ),
+        migrations.RunPython(backfill_user_search_index, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,73 @@
+# Generated by Django 5.2.5 on 2026-10-19 08:44
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def backfill_message_search_index(apps, schema_editor):
+    from app.search import tokenize
+
+    Message = apps.get_model("app", "Message")
+    MessageSearchToken = apps.get_model("app", "MessageSearchToken")
+
+    rows = []
+    messages = Message.objects.order_by("id").values_list("id", "chat_room_id", "content")
+    for message_id, chat_room_id, content in messages.iterator(chunk_size=2000):
+        rows.extend(
+            MessageSearchToken(token=token, message_id=message_id, chat_room_id=chat_room_id)
+            for token in tokenize(content)
+        )
+        if len(rows) >= 5000:
+            MessageSearchToken.objects.bulk_create(rows)
+            rows = []
+    MessageSearchToken.objects.bulk_create(rows)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("app", "0005_user_search_index"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="MessageSearchToken",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("token", models.CharField(max_length=32)),
+                (
+                    "chat_room",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to="app.chatroom",
+                    ),
+                ),
+                (
+                    "message",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="search_tokens",
+                        to="app.message",
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["token", "chat_room", "message"],
+                        name="app_msgtoken_lookup",
+                    )
+                ],
+            },
+        ),
+        migrations.RunPython(backfill_message_search_index, migrations.RunPython.noop),
+    ]
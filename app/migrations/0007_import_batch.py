@@ -0,0 +1,36 @@
+# Generated by Django 5.2.5 on 2026-10-19 08:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("app", "0006_message_search_index"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ImportBatch",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("source", models.CharField(db_index=True, max_length=255)),
+                ("line", models.PositiveBigIntegerField()),
+                ("rows", models.PositiveIntegerField(default=0)),
+                ("user_ids", models.JSONField(default=dict)),
+                ("room_ids", models.JSONField(default=dict)),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                "ordering": ["source", "line"],
+            },
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.2.5 on 2026-10-19 08:47
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("app", "0007_import_batch"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="message",
+            index=models.Index(
+                fields=["chat_room", "timestamp"], name="app_message_room_time"
+            ),
+        ),
+    ]
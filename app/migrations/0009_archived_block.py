@@ -0,0 +1,54 @@
+# Generated by Django 5.2.5 on 2026-10-19 08:48
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("app", "0008_message_room_time_index"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ArchivedBlock",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("segment", models.CharField(max_length=255)),
+                ("offset", models.PositiveBigIntegerField()),
+                ("length", models.PositiveIntegerField()),
+                ("message_count", models.PositiveIntegerField()),
+                ("first_message_id", models.BigIntegerField()),
+                ("last_message_id", models.BigIntegerField()),
+                ("first_timestamp", models.DateTimeField()),
+                ("last_timestamp", models.DateTimeField()),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                (
+                    "chat_room",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="archived_blocks",
+                        to="app.chatroom",
+                    ),
+                ),
+            ],
+            options={
+                "ordering": ["chat_room", "first_message_id"],
+                "indexes": [
+                    models.Index(
+                        fields=["chat_room", "last_message_id"],
+                        name="app_archblock_room_last",
+                    )
+                ],
+            },
+        ),
+    ]
@@ -1,4 +1,9 @@
+from functools import reduce
+from operator import or_
+
 from django.db import models
+from django.db.models.functions import Coalesce, Greatest
+from django.utils import timezone
 from django.contrib.auth.models import User
 
 class ChatRoom(models.Model):
@@ -13,12 +18,19 @@ class ChatRoom(models.Model):
     participants = models.ManyToManyField(User, related_name='chat_rooms', blank=True)
     is_active = models.BooleanField(default=True)
     description = models.TextField(blank=True)
+    # Only the creator may remove other members of a group.
+    created_by = models.ForeignKey(
+        User, on_delete=models.SET_NULL, null=True, blank=True, related_name='created_rooms'
+    )
 
     def __str__(self):
         if self.room_type == 'anonymous':
             return f"Anonymous Chat Room {self.id}"
         if self.room_type == 'private':
-            users = [user.username for user in self.participants.all()]
+            # A preview only: never load every member to name a room.
+            users = list(self.participants.order_by('id').values_list('username', flat=True)[:3])
+            if len(users) > 2:
+                users[2:] = ['...']
             return f"Private Chat: {', '.join(users)}"
         return self.name or f"Group {self.id}"
 
@@ -36,6 +48,84 @@ class ChatRoom(models.Model):
         chat.participants.add(user1, user2)
         return chat
 
+    def add_participants(self, inviter, participant_ids, include_inviter=False):
+        """Bulk-add the inviter's friends among participant_ids.
+
+        Validates every id with one user query and one friendship query and
+        inserts the membership rows with a single bulk insert. Returns
+        (added_ids, skipped) where skipped is a list of
+        {'user_id': ..., 'reason': ...} dicts.
+        """
+        requested, skipped = _normalize_user_ids(participant_ids)
+        requested.discard(inviter.id)
+
+        existing_users = set(
+            User.objects.filter(id__in=requested).values_list('id', flat=True)
+        )
+        friend_ids = Friendship.get_friend_ids(inviter, among=existing_users)
+        Membership = ChatRoom.participants.through
+        current_members = set()
+        if self.pk and not include_inviter:
+            current_members = set(
+                Membership.objects.filter(
+                    chatroom_id=self.id, user_id__in=friend_ids
+                ).values_list('user_id', flat=True)
+            )
+
+        added = []
+        for user_id in sorted(requested):
+            if user_id not in existing_users:
+                skipped.append({'user_id': user_id, 'reason': 'not_found'})
+            elif user_id not in friend_ids:
+                skipped.append({'user_id': user_id, 'reason': 'not_friends'})
+            elif user_id in current_members:
+                skipped.append({'user_id': user_id, 'reason': 'already_member'})
+            else:
+                added.append(user_id)
+
+        new_member_ids = ([inviter.id] if include_inviter else []) + added
+        Membership.objects.bulk_create(
+            [Membership(chatroom_id=self.id, user_id=user_id) for user_id in new_member_ids],
+            ignore_conflicts=True
+        )
+        return added, skipped
+
+    def remove_participants(self, remover, participant_ids):
+        """Bulk-remove participant_ids; returns (removed_ids, skipped).
+
+        Members may always leave; only the room's creator may remove others.
+        """
+        requested, skipped = _normalize_user_ids(participant_ids)
+        if remover.id != self.created_by_id:
+            for user_id in sorted(requested - {remover.id}):
+                skipped.append({'user_id': user_id, 'reason': 'not_allowed'})
+            requested &= {remover.id}
+        Membership = ChatRoom.participants.through
+        members = Membership.objects.filter(chatroom_id=self.id, user_id__in=requested)
+        member_ids = set(members.values_list('user_id', flat=True))
+
+        removed = []
+        for user_id in sorted(requested):
+            if user_id in member_ids:
+                removed.append(user_id)
+            else:
+                skipped.append({'user_id': user_id, 'reason': 'not_member'})
+
+        if removed:
+            Membership.objects.filter(chatroom_id=self.id, user_id__in=removed).delete()
+        return removed, skipped
+
+
+def _normalize_user_ids(user_ids):
+    ids = set()
+    skipped = []
+    for user_id in user_ids or []:
+        try:
+            ids.add(int(user_id))
+        except (TypeError, ValueError):
+            skipped.append({'user_id': user_id, 'reason': 'invalid_id'})
+    return ids, skipped
+
 
 class FriendRequest(models.Model):
     STATUS_CHOICES = (
@@ -72,14 +162,28 @@ class Friendship(models.Model):
             models.Q(user1=user1, user2=user2) | models.Q(user1=user2, user2=user1)
         ).exists()
 
+    @classmethod
+    def get_friend_ids(cls, user, among=None):
+        """Return the set of friend ids for user in one query.
+
+        Pass `among` to restrict the lookup to a known set of candidate ids.
+        """
+        q1 = models.Q(user1=user)
+        q2 = models.Q(user2=user)
+        if among is not None:
+            q1 &= models.Q(user2_id__in=among)
+            q2 &= models.Q(user1_id__in=among)
+        pairs = cls.objects.filter(q1 | q2).values_list('user1_id', 'user2_id')
+        return {u2 if u1 == user.id else u1 for u1, u2 in pairs}
+
     @classmethod
     def get_friends(cls, user):
         friendships = cls.objects.filter(
             models.Q(user1=user) | models.Q(user2=user)
-        )
+        ).select_related('user1', 'user2')
         friends = []
         for friendship in friendships:
-            friend = friendship.user2 if friendship.user1 == user else friendship.user1
+            friend = friendship.user2 if friendship.user1_id == user.id else friendship.user1
             friends.append(friend)
         return friends
 
@@ -90,10 +194,213 @@ class Message(models.Model):
     anonymous_name = models.CharField(max_length=50, blank=True)
     chat_room = models.ForeignKey(ChatRoom, on_delete=models.CASCADE, related_name='messages')
     timestamp = models.DateTimeField(auto_now_add=True)
+    # Set by app.edits: a deleted message stays as a tombstone with its
+    # content blanked, so history pages and live clients agree.
+    edited_at = models.DateTimeField(null=True, blank=True)
+    deleted_at = models.DateTimeField(null=True, blank=True)
 
     class Meta:
         ordering = ['timestamp']
+        indexes = [
+            models.Index(fields=['chat_room', 'timestamp'], name='app_message_room_time'),
+            models.Index(fields=['chat_room', 'id'], name='app_message_room_id'),
+        ]
 
     def __str__(self):
         sender_name = self.anonymous_name or (self.sender.username if self.sender else 'Unknown')
-        return f"{sender_name}: {self.content[:50]}"
\ No newline at end of file
+        return f"{sender_name}: {self.content[:50]}"
+
+
+class MessageRevision(models.Model):
+    """A message's content before one of its edits."""
+    message = models.ForeignKey(Message, on_delete=models.CASCADE, related_name='revisions')
+    content = models.TextField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['message', 'id']
+
+    def __str__(self):
+        return f"Revision of {self.message_id}: {self.content[:50]}"
+
+class UserSearchEntry(models.Model):
+    """Lower-cased search keys for a user, maintained by app.search."""
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='search_entry')
+    username_key = models.CharField(max_length=150, db_index=True)
+    email_key = models.CharField(max_length=254, blank=True, db_index=True)
+
+    def __str__(self):
+        return self.username_key
+
+
+class UserSearchTrigram(models.Model):
+    trigram = models.CharField(max_length=3)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='search_trigrams')
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['trigram', 'user'], name='app_usertrigram_lookup'),
+        ]
+
+    def __str__(self):
+        return f"{self.trigram!r} -> {self.user_id}"
+
+
+class MessageSearchToken(models.Model):
+    """Inverted index row: one per distinct token in a message."""
+    token = models.CharField(max_length=32)
+    message = models.ForeignKey(Message, on_delete=models.CASCADE, related_name='search_tokens')
+    chat_room = models.ForeignKey(ChatRoom, on_delete=models.CASCADE, related_name='+')
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['token', 'chat_room', 'message'], name='app_msgtoken_lookup'),
+        ]
+
+    def __str__(self):
+        return f"{self.token!r} -> {self.message_id}"
+
+
+class ImportBatch(models.Model):
+    """Checkpoint for import_chat_data, committed with the batch it describes."""
+    source = models.CharField(max_length=255, db_index=True)
+    line = models.PositiveBigIntegerField()
+    rows = models.PositiveIntegerField(default=0)
+    user_ids = models.JSONField(default=dict)
+    room_ids = models.JSONField(default=dict)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['source', 'line']
+
+    def __str__(self):
+        return f"{self.source} @ line {self.line}"
+
+
+class ArchivedBlock(models.Model):
+    """Index entry for a compressed block of messages moved out of Message.
+
+    The block lives at [offset, offset + length) of `segment` under
+    MESSAGE_ARCHIVE_ROOT and holds messages first_message_id..last_message_id.
+    """
+    chat_room = models.ForeignKey(ChatRoom, on_delete=models.CASCADE, related_name='archived_blocks')
+    segment = models.CharField(max_length=255)
+    offset = models.PositiveBigIntegerField()
+    length = models.PositiveIntegerField()
+    message_count = models.PositiveIntegerField()
+    first_message_id = models.BigIntegerField()
+    last_message_id = models.BigIntegerField()
+    first_timestamp = models.DateTimeField()
+    last_timestamp = models.DateTimeField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['chat_room', 'first_message_id']
+        indexes = [
+            models.Index(fields=['chat_room', 'last_message_id'], name='app_archblock_room_last'),
+        ]
+
+    def __str__(self):
+        return f"Room {self.chat_room_id}: messages {self.first_message_id}-{self.last_message_id}"
+
+
+def _raised(field, rows):
+    """field, raised to each row's value of it but never lowered."""
+    return Greatest(models.F(field), models.Case(
+        *(models.When(user_id=row.user_id, chat_room_id=row.chat_room_id, then=getattr(row, field)) for row in rows),
+        default=models.F(field),
+        output_field=models.BigIntegerField(),
+    ))
+
+
+class RoomReadState(models.Model):
+    """How far a user has read and received a room, as message id watermarks.
+
+    Written in coalesced batches by app.receipts; unread counts are the
+    room's messages above last_read_message_id.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='read_states')
+    chat_room = models.ForeignKey(ChatRoom, on_delete=models.CASCADE, related_name='read_states')
+    last_read_message_id = models.BigIntegerField(default=0)
+    last_delivered_message_id = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ['user', 'chat_room']
+
+    # Pairs per conditional UPDATE in advance().
+    ADVANCE_BATCH_SIZE = 500
+
+    def __str__(self):
+        return f"{self.user_id} in {self.chat_room_id}: read {self.last_read_message_id}"
+
+    @classmethod
+    def advance(cls, watermarks):
+        """Upsert {(user_id, room_id): (read_id, delivered_id)} in a few batched
+        queries.
+
+        Watermarks never move backwards, reading implies delivery, and pairs
+        whose user is not in the room are dropped. Returns the rows that move
+        forward from what this call read.
+
+        Several processes flush at once, so the maximum is taken in SQL: new
+        pairs are inserted if still missing, then every pair is raised with
+        GREATEST, and a flush holding older values changes nothing.
+        """
+        user_ids = {user_id for user_id, _ in watermarks}
+        room_ids = {room_id for _, room_id in watermarks}
+        members = set(ChatRoom.participants.through.objects.filter(
+            user_id__in=user_ids, chatroom_id__in=room_ids
+        ).values_list('user_id', 'chatroom_id'))
+        existing = {
+            (user_id, room_id): (read_id, delivered_id)
+            for user_id, room_id, read_id, delivered_id in cls.objects.filter(
+                user_id__in=user_ids, chat_room_id__in=room_ids
+            ).values_list('user_id', 'chat_room_id', 'last_read_message_id', 'last_delivered_message_id')
+        }
+
+        rows = []
+        for pair, (read_id, delivered_id) in watermarks.items():
+            if pair not in members:
+                continue
+            old_read, old_delivered = existing.get(pair, (0, 0))
+            read_id = max(read_id, old_read)
+            delivered_id = max(delivered_id, old_delivered, read_id)
+            if (read_id, delivered_id) != (old_read, old_delivered):
+                rows.append(cls(
+                    user_id=pair[0], chat_room_id=pair[1],
+                    last_read_message_id=read_id, last_delivered_message_id=delivered_id,
+                ))
+        if rows:
+            # Another flush may insert the same pair first; the update raises it.
+            cls.objects.bulk_create(
+                [row for row in rows if (row.user_id, row.chat_room_id) not in existing], ignore_conflicts=True,
+            )
+            now = timezone.now()
+            for start in range(0, len(rows), cls.ADVANCE_BATCH_SIZE):
+                batch = rows[start:start + cls.ADVANCE_BATCH_SIZE]
+                cls.objects.filter(reduce(or_, (
+                    models.Q(user_id=row.user_id, chat_room_id=row.chat_room_id) for row in batch
+                ))).update(
+                    last_read_message_id=_raised('last_read_message_id', batch),
+                    last_delivered_message_id=_raised('last_delivered_message_id', batch),
+                    updated_at=now,
+                )
+        return rows
+
+    @classmethod
+    def unread_counts(cls, user):
+        """{room_id: (unread, last_read_message_id)} for the user's active rooms,
+        in one query. Only messages above the watermark are counted."""
+        last_read = cls.objects.filter(user=user, chat_room=models.OuterRef('pk')).values('last_read_message_id')[:1]
+        unread = Message.objects.filter(
+            chat_room=models.OuterRef('pk'), id__gt=models.OuterRef('last_read'), deleted_at__isnull=True
+        ).exclude(sender=user).order_by().values('chat_room').annotate(
+            count=models.Count('id')
+        ).values('count')
+        rooms = ChatRoom.objects.filter(participants=user, is_active=True).annotate(
+            last_read=Coalesce(models.Subquery(last_read), 0),
+        ).annotate(
+            unread=Coalesce(models.Subquery(unread), 0),
+        ).values_list('id', 'unread', 'last_read')
+        return {room_id: (count, read_id) for room_id, count, read_id in rooms}
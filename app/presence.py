@@ -0,0 +1,220 @@
+"""Who is online, maintained by the websocket gateways.
+
+Each gateway process has one PresenceTracker counting its open connections
+per user, and the cache counts, per user, the processes holding at least
+one of them (connections_key). A user goes online when that shared count
+leaves zero and offline when it drops back to it, so a user with sockets on
+several workers or on both gateways stays online until the last one closes.
+A process gives up its share only if the user has not reconnected to it
+within PRESENCE_DEBOUNCE seconds, so page reloads and network blips produce
+no events. Online users are kept in the Django cache with a PRESENCE_TTL
+that the tracker's heartbeat keeps refreshing, together with the counts, so
+users of a gateway that dies expire on their own; the bulk REST endpoint
+reads them from there. That only works with a cache shared by every
+process, so nothing is tracked unless PRESENCE_ENABLED is on.
+
+A state change is pushed only to the user's friends who are online, found
+through a friend-id set cached under the user's 'friends' version stamp
+(app.versioning), so it needs no query until the friendships change; any
+saved or deleted Friendship bumps that stamp. publish() delivers the frame
+on both gateways: to the friends' Channels user groups, and through
+GATEWAY_GROUP to every FastAPI gateway process.
+"""
+import asyncio
+import time
+
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+
+from . import versioning
+from .edits import GATEWAY_GROUP
+from .logs import get_logger
+from .models import Friendship
+from .telemetry import db_call
+
+log = get_logger('app.presence')
+
+FRIEND_SET_TIMEOUT = 3600
+
+
+def presence_key(user_id):
+    return f'presence:{user_id}'
+
+
+def connections_key(user_id):
+    return f'presence:processes:{user_id}'
+
+
+def user_group(user_id):
+    return f'user_{user_id}'
+
+
+async def publish(frame, user_ids, origin=None):
+    """Send a presence frame to those users' sockets on both gateways.
+
+    origin is the sending FastAPI gateway's relay channel: that process has
+    already delivered the frame to its own sockets and skips its copy."""
+    channel_layer = get_channel_layer()
+    for user_id in user_ids:
+        await channel_layer.group_send(user_group(user_id), {'type': 'presence_update', 'frame': frame})
+    await channel_layer.group_send(GATEWAY_GROUP, {
+        'type': 'presence_update', 'frame': frame, 'user_ids': list(user_ids), 'origin': origin,
+    })
+
+
+async def _incr(key):
+    """Atomically add one to a shared count, creating it if it is missing."""
+    while True:
+        if await cache.aadd(key, 1, settings.PRESENCE_TTL):
+            return 1
+        try:
+            return await cache.aincr(key)
+        except ValueError:
+            # Expired between the two calls.
+            continue
+
+
+async def _decr(key):
+    try:
+        return await cache.adecr(key)
+    except ValueError:
+        return 0
+
+
+async def afriend_ids(user_id):
+    """Friend ids of user_id, cached until their friendships change."""
+    stamp, = await versioning.aversions([versioning.user_key(user_id, 'friends')])
+    key = f'friendset:{user_id}:{stamp}'
+    friend_ids = await cache.aget(key)
+    if friend_ids is None:
+        friend_ids = await db_call(Friendship.get_friend_ids)(User(id=user_id))
+        await cache.aset(key, friend_ids, FRIEND_SET_TIMEOUT)
+    return friend_ids
+
+
+async def abulk_status(user_ids):
+    """{user_id: 'online' | 'offline'} in one cache round trip."""
+    found = await cache.aget_many([presence_key(user_id) for user_id in user_ids])
+    return {
+        user_id: 'online' if presence_key(user_id) in found else 'offline'
+        for user_id in user_ids
+    }
+
+
+class PresenceTracker:
+    """Connection counts for one gateway process.
+
+    `notify(frame, user_ids)` is the gateway's coroutine delivering a frame
+    to those users' connections. connected()/disconnected() only schedule
+    work, so they never delay the handshake or the close.
+    """
+
+    def __init__(self, notify):
+        self.notify = notify
+        self.connections = {}
+        # Users this process holds a share of connections_key for.
+        self.shared = set()
+        self.pending_offline = {}
+        self.heartbeat_task = None
+        self.tasks = set()
+        self.stopped = False
+
+    def connected(self, user_id):
+        if self.stopped or not settings.PRESENCE_ENABLED:
+            return
+        self.connections[user_id] = self.connections.get(user_id, 0) + 1
+        pending = self.pending_offline.pop(user_id, None)
+        if pending:
+            # Back within the debounce window: still online, nothing to say.
+            pending.cancel()
+        elif self.connections[user_id] == 1:
+            self._spawn(self._change(user_id, 'online'))
+        if self.heartbeat_task is None:
+            self.heartbeat_task = self._spawn(self._heartbeat())
+
+    def disconnected(self, user_id):
+        if self.stopped or not settings.PRESENCE_ENABLED:
+            return
+        count = self.connections.get(user_id, 0) - 1
+        if count > 0:
+            self.connections[user_id] = count
+            return
+        self.connections.pop(user_id, None)
+        if user_id not in self.pending_offline:
+            self.pending_offline[user_id] = self._spawn(self._offline_after_debounce(user_id))
+
+    async def stop(self):
+        """Announce nothing more, for a gateway that is draining: its users
+        are reconnecting elsewhere, and the entries of any that do not
+        come back expire within PRESENCE_TTL. This process's shares of
+        their counts are given up."""
+        self.stopped = True
+        for task in tuple(self.tasks):
+            task.cancel()
+        self.pending_offline.clear()
+        user_ids, self.shared = self.shared, set()
+        for user_id in user_ids:
+            try:
+                await _decr(connections_key(user_id))
+            except Exception:
+                log.exception('presence.release_failed', user_id=user_id)
+
+    def _spawn(self, coro):
+        task = asyncio.get_running_loop().create_task(coro)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return task
+
+    async def _offline_after_debounce(self, user_id):
+        await asyncio.sleep(settings.PRESENCE_DEBOUNCE)
+        del self.pending_offline[user_id]
+        await self._change(user_id, 'offline')
+
+    async def _change(self, user_id, status):
+        try:
+            key = presence_key(user_id)
+            if status == 'online':
+                first = await _incr(connections_key(user_id)) == 1
+                self.shared.add(user_id)
+                await cache.aset(key, time.time(), settings.PRESENCE_TTL)
+                if not first:
+                    # Already online through another process.
+                    return
+            else:
+                if user_id not in self.shared:
+                    return
+                self.shared.discard(user_id)
+                if await _decr(connections_key(user_id)) > 0:
+                    # Still connected to another process.
+                    return
+                await cache.adelete(key)
+                # Another process may have taken the user back online meanwhile.
+                if (await cache.aget(connections_key(user_id)) or 0) > 0:
+                    await cache.aset(key, time.time(), settings.PRESENCE_TTL)
+                    return
+
+            friend_ids = await afriend_ids(user_id)
+            statuses = await abulk_status(list(friend_ids)) if friend_ids else {}
+            online = [friend_id for friend_id, state in statuses.items() if state == 'online']
+            if online:
+                await self.notify({'type': 'presence', 'user_id': user_id, 'status': status}, online)
+            log.debug('presence.changed', sample=True, user_id=user_id, status=status, notified=len(online))
+        except Exception:
+            log.exception('presence.change_failed', user_id=user_id, status=status)
+
+    async def _heartbeat(self):
+        """Refresh every locally connected user's entry while any remain."""
+        while self.connections:
+            await asyncio.sleep(settings.PRESENCE_TTL / 3)
+            now = time.time()
+            try:
+                await cache.aset_many(
+                    {presence_key(user_id): now for user_id in self.connections}, settings.PRESENCE_TTL
+                )
+                for user_id in tuple(self.connections):
+                    await cache.atouch(connections_key(user_id), settings.PRESENCE_TTL)
+            except Exception:
+                log.exception('presence.heartbeat_failed', users=len(self.connections))
+        self.heartbeat_task = None
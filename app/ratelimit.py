@@ -0,0 +1,104 @@
+"""Token-bucket limits on client websocket frames.
+
+Both gateways check every frame here right after parsing it, before any
+database work. Frames are grouped into kinds, each with its own budgets
+(WS_RATE_LIMITS): 'message' for frames that write and fan out a message,
+'typing' for typing indicators, 'join' for room joins, which subscribe the
+socket and look the room up, and 'receipt' for read and delivery acks.
+Every kind has a bucket per connection, per user and per room, so one tab,
+one account spread over many tabs, or a crowd in one room can each only go
+so fast. A rejected frame costs a few dict lookups and is counted in
+chat_gateway_rate_limited_total.
+
+allow() charges the connection and user buckets as soon as the frame is
+parsed. The room named in a frame is only the client's claim, so its bucket
+is charged by allow_room() once the handler has checked that the sender
+may use the room; otherwise anyone could spend a private room's budget and
+lock its members out.
+
+Buckets live in the gateway process, so the limits apply per node. Idle
+buckets are swept once they have refilled, as a full bucket is the same as a
+missing one.
+"""
+import time
+
+from django.conf import settings
+
+from . import telemetry
+
+FRAME_KINDS = {
+    'send_message': 'message',
+    'edit_message': 'message',
+    'delete_message': 'message',
+    'typing': 'typing',
+    'join_room': 'join',
+    'mark_read': 'receipt',
+    'mark_delivered': 'receipt',
+}
+SWEEP_INTERVAL = 60
+
+
+class TokenBucket:
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated')
+
+    def __init__(self, rate, capacity, now):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+
+    def refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return self.tokens
+
+
+class FrameLimiter:
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self.buckets = {}
+        self.next_sweep = clock() + SWEEP_INTERVAL
+
+    def allow(self, message_type, connection_id, user_id):
+        """False when the frame is over its connection or user limit and must
+        be dropped."""
+        return self._take(message_type, (('connection', connection_id), ('user', user_id)))
+
+    def allow_room(self, message_type, room_id):
+        """False when the room is over its limit for this kind of frame. Call
+        only once the sender is known to be allowed in the room."""
+        return self._take(message_type, (('room', room_id),))
+
+    def _take(self, message_type, scopes):
+        kind = FRAME_KINDS.get(message_type)
+        if kind is None:
+            return True
+        limits = settings.WS_RATE_LIMITS[kind]
+        now = self.clock()
+
+        taken = []
+        for scope, key in scopes:
+            limit = limits.get(scope)
+            if key is None or limit is None:
+                continue
+            bucket = self.buckets.get((kind, scope, key))
+            if bucket is None:
+                bucket = self.buckets[(kind, scope, key)] = TokenBucket(*limit, now)
+            if bucket.refill(now) < 1:
+                telemetry.rate_limited.inc(kind, scope)
+                return False
+            taken.append(bucket)
+        # Only charge the buckets once the frame has passed all of them.
+        for bucket in taken:
+            bucket.tokens -= 1
+
+        if now >= self.next_sweep:
+            self.sweep(now)
+        return True
+
+    def sweep(self, now):
+        self.buckets = {
+            key: bucket for key, bucket in self.buckets.items() if bucket.refill(now) < bucket.capacity
+        }
+        self.next_sweep = now + SWEEP_INTERVAL
+
@@ -0,0 +1,79 @@
+"""Read and delivered watermarks reported over the websocket.
+
+Clients send mark_read / mark_delivered frames with the newest message id
+they have seen in a room. Each gateway process coalesces them in a
+ReceiptBuffer, keeping only the highest id per (user, room), and flushes
+every RECEIPT_FLUSH_INTERVAL seconds (sooner once RECEIPT_FLUSH_SIZE pairs
+are pending) as one RoomReadState.advance() batch. The rows written are
+then announced as one aggregated receipts frame per room, so the other
+participants get at most one update per room per interval however many
+acks arrived.
+"""
+import asyncio
+
+from django.conf import settings
+
+from .logs import get_logger
+from .models import RoomReadState
+from .telemetry import db_call
+
+log = get_logger('app.receipts')
+
+
+class ReceiptBuffer:
+    """`notify(room_id, frame)` is the gateway's coroutine delivering a frame
+    to a room's participants."""
+
+    def __init__(self, notify):
+        self.notify = notify
+        self.pending = {}
+        self.flush_task = None
+        self.early_flush = None
+
+    def mark(self, user_id, room_id, read=0, delivered=0):
+        pair = (user_id, room_id)
+        old_read, old_delivered = self.pending.get(pair, (0, 0))
+        self.pending[pair] = (max(read, old_read), max(delivered, old_delivered))
+        if self.flush_task is None:
+            self.flush_task = asyncio.get_running_loop().create_task(self._flush_periodically())
+        elif len(self.pending) >= settings.RECEIPT_FLUSH_SIZE and self.early_flush is None:
+            # One early flush at a time; acks arriving meanwhile wait for the next.
+            self.early_flush = asyncio.get_running_loop().create_task(self._flush_early())
+
+    async def _flush_early(self):
+        try:
+            await self.flush()
+        finally:
+            self.early_flush = None
+
+    async def _flush_periodically(self):
+        try:
+            while self.pending:
+                await asyncio.sleep(settings.RECEIPT_FLUSH_INTERVAL)
+                await self.flush()
+        finally:
+            self.flush_task = None
+
+    async def flush(self):
+        watermarks, self.pending = self.pending, {}
+        if not watermarks:
+            return
+        try:
+            rows = await db_call(RoomReadState.advance)(watermarks)
+        except Exception:
+            log.exception('receipts.flush_failed', pairs=len(watermarks))
+            return
+
+        frames = {}
+        for row in rows:
+            frame = frames.setdefault(row.chat_room_id, {
+                'type': 'receipts', 'chat_room_id': row.chat_room_id, 'read': {}, 'delivered': {},
+            })
+            frame['read'][row.user_id] = row.last_read_message_id
+            frame['delivered'][row.user_id] = row.last_delivered_message_id
+        for room_id, frame in frames.items():
+            try:
+                await self.notify(room_id, frame)
+            except Exception:
+                log.exception('receipts.notify_failed', chat_room_id=room_id)
+        log.debug('receipts.flushed', sample=True, pairs=len(watermarks), written=len(rows), rooms=len(frames))
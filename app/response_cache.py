@@ -0,0 +1,53 @@
+"""Serialized JSON bodies of per-user list endpoints, kept in the Django cache.
+
+Entries are keyed by the endpoint's version fingerprint (app.versioning), so
+the writes that bump a user's stamps invalidate exactly that user's entries
+and stale bodies simply age out. When an entry is missing, one request
+rebuilds it under a cache.add lock while concurrent requests for the same
+entry wait for its result instead of all querying at once.
+"""
+import asyncio
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+
+from .instrumentation import JsonResponse
+
+POLL_INTERVAL = 0.05
+
+
+async def cached_json(fingerprint, build):
+    """Response for the payload `await build()` returns, served from the cache
+    under `fingerprint` when possible. Caching is skipped when fingerprint
+    is None or RESPONSE_CACHE_TIMEOUT is 0."""
+    if not fingerprint or not settings.RESPONSE_CACHE_TIMEOUT:
+        return JsonResponse(await build())
+
+    key = f'resp:{fingerprint}'
+    body = await cache.aget(key)
+    if body is None:
+        lock = f'{key}:lock'
+        if await cache.aadd(lock, 1, settings.RESPONSE_CACHE_LOCK_TIMEOUT):
+            try:
+                response = JsonResponse(await build())
+                await cache.aset(key, response.content, settings.RESPONSE_CACHE_TIMEOUT)
+            finally:
+                await cache.adelete(lock)
+            return response
+        body = await _wait_for(key)
+        if body is None:
+            # The rebuilding request failed or is too slow; do it ourselves.
+            return JsonResponse(await build())
+    return HttpResponse(body, content_type='application/json')
+
+
+async def _wait_for(key):
+    deadline = time.monotonic() + settings.RESPONSE_CACHE_LOCK_TIMEOUT
+    while time.monotonic() < deadline:
+        await asyncio.sleep(POLL_INTERVAL)
+        body = await cache.aget(key)
+        if body is not None:
+            return body
+    return None
@@ -0,0 +1,128 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max, Q
+from django.utils import timezone
+
+from .archive import purge_archived
+from .models import ArchivedBlock, ChatRoom, Message
+from .search import get_message_search_index
+from .versioning import bump, index_key, room_key
+
+
+def retention_policies():
+    """{room_type: timedelta} for every room type with a retention limit."""
+    days = getattr(settings, 'MESSAGE_RETENTION_DAYS', {})
+    return {
+        room_type: timedelta(days=value)
+        for room_type, value in days.items()
+        if value
+    }
+
+
+def purge_expired_messages(now=None, batch_size=None, pause=0.0, dry_run=False):
+    """Delete messages older than their room type's TTL in small keyed batches.
+
+    Each batch selects at most batch_size ids above the previous batch's
+    last id and deletes exactly those rows in its own short transaction, so
+    no long-running lock is held on the message table. Yields one report
+    dict per batch: {'room_type', 'rows', 'seconds'}.
+    """
+    now = now or timezone.now()
+    batch_size = batch_size or settings.RETENTION_BATCH_SIZE
+
+    for room_type, ttl in retention_policies().items():
+        expired = Message.objects.filter(
+            chat_room__room_type=room_type,
+            timestamp__lt=now - ttl
+        )
+        last_id = 0
+        while True:
+            started = time.monotonic()
+            rows = list(
+                expired.filter(id__gt=last_id).order_by('id').values_list('id', 'chat_room_id')[:batch_size]
+            )
+            if not rows:
+                break
+            ids = [message_id for message_id, _ in rows]
+            last_id = ids[-1]
+
+            if not dry_run:
+                with transaction.atomic():
+                    get_message_search_index().remove_messages(ids)
+                    Message.objects.filter(id__in=ids).delete()
+                # The index key makes other processes' in-process search
+                # indexes drop the purged rows too.
+                bump(index_key('messages'), *{room_key(chat_room_id, 'messages') for _, chat_room_id in rows})
+
+            yield {
+                'room_type': room_type,
+                'rows': len(ids),
+                'seconds': time.monotonic() - started,
+            }
+            if len(ids) < batch_size:
+                break
+            if pause:
+                time.sleep(pause)
+
+
+def purge_expired_archives(now=None, dry_run=False):
+    """Drop archived messages older than their room type's TTL, room by room
+    (app.archive.purge_archived), so they do not outlive the ones purged
+    from the message table.
+
+    Yields one report dict per room: {'room_type', 'chat_room_id', 'rows', 'seconds'}.
+    """
+    now = now or timezone.now()
+
+    for room_type, ttl in retention_policies().items():
+        cutoff = now - ttl
+        rooms = ArchivedBlock.objects.filter(
+            chat_room__room_type=room_type,
+            first_timestamp__lt=cutoff
+        ).order_by('chat_room_id').values_list('chat_room_id', flat=True).distinct()
+        for chat_room_id in list(rooms):
+            started = time.monotonic()
+            rows = purge_archived(chat_room_id, cutoff, dry_run=dry_run)
+            yield {
+                'room_type': room_type,
+                'chat_room_id': chat_room_id,
+                'rows': rows,
+                'seconds': time.monotonic() - started,
+            }
+
+
+def deactivate_idle_anonymous_rooms(now=None, idle=None, batch_size=None, dry_run=False):
+    """Set is_active=False on anonymous rooms with no messages within `idle`.
+
+    Yields one report dict per batch: {'rows', 'seconds'}.
+    """
+    now = now or timezone.now()
+    idle = idle or timedelta(hours=settings.ANONYMOUS_ROOM_IDLE_HOURS)
+    batch_size = batch_size or settings.RETENTION_BATCH_SIZE
+    cutoff = now - idle
+
+    started = time.monotonic()
+    idle_ids = list(
+        ChatRoom.objects.filter(
+            room_type='anonymous',
+            is_active=True,
+            created_at__lt=cutoff
+        ).annotate(
+            last_message_at=Max('messages__timestamp')
+        ).filter(
+            Q(last_message_at__lt=cutoff) | Q(last_message_at__isnull=True)
+        ).order_by('id').values_list('id', flat=True)
+    )
+
+    for i in range(0, len(idle_ids), batch_size):
+        ids = idle_ids[i:i + batch_size]
+        if not dry_run:
+            ChatRoom.objects.filter(id__in=ids, is_active=True).update(is_active=False)
+        yield {
+            'rows': len(ids),
+            'seconds': time.monotonic() - started,
+        }
+        started = time.monotonic()
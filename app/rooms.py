@@ -0,0 +1,125 @@
+"""Room types and member ids for the websocket gateways, kept in memory.
+
+Every message a gateway handles needs its room's type and, outside anonymous
+rooms, its member ids: to check the sender and, in the FastAPI gateway, to
+fan out. The directory keeps both per room as a RoomEntry whose members are
+a sorted array of ids, tagged with the room's 'members' version stamp
+(app.versioning) read before the entry was loaded. An entry is used only
+while that stamp is current, so membership changes made through the REST
+API reach the gateway on the next frame, for one cache read per lookup
+instead of two queries.
+
+The stamps must be shared with the API processes, so the directory only
+keeps entries when GATEWAY_ROOM_DIRECTORY is on (by default, with Redis);
+otherwise each lookup loads the room afresh. At startup the FastAPI gateway
+preloads the rooms that had messages in the last GATEWAY_PRELOAD_DAYS days
+in two bulk queries, so clients reconnecting after a restart do not all
+miss at once; /ready reports the gateway ready only once that is done.
+"""
+import bisect
+import sys
+import time
+from array import array
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+
+from . import versioning
+from .logs import get_logger
+from .models import ChatRoom, Message
+from .telemetry import db_call
+
+log = get_logger('app.rooms')
+
+Membership = ChatRoom.participants.through
+
+
+def members_key(room_id):
+    return versioning.room_key(room_id, 'members')
+
+
+class RoomEntry:
+    __slots__ = ('id', 'room_type', 'members', 'stamp')
+
+    def __init__(self, room_id, room_type, members, stamp):
+        self.id = room_id
+        self.room_type = room_type
+        self.members = members
+        self.stamp = stamp
+
+    def has_member(self, user_id):
+        index = bisect.bisect_left(self.members, user_id)
+        return index < len(self.members) and self.members[index] == user_id
+
+
+class RoomDirectory:
+    def __init__(self):
+        self.rooms = {}
+        self.ready = False
+
+    async def get(self, room_id):
+        """The room's entry; raises ChatRoom.DoesNotExist like a lookup would."""
+        room_id = int(room_id)
+        if not settings.GATEWAY_ROOM_DIRECTORY:
+            return await db_call(self.load)(room_id, None)
+        stamp, = await versioning.aversions([members_key(room_id)])
+        entry = self.rooms.get(room_id)
+        if entry is None or entry.stamp != stamp:
+            try:
+                entry = self.rooms[room_id] = await db_call(self.load)(room_id, stamp)
+            except ChatRoom.DoesNotExist:
+                self.rooms.pop(room_id, None)
+                raise
+        return entry
+
+    @staticmethod
+    def load(room_id, stamp):
+        room_type = ChatRoom.objects.values_list('room_type', flat=True).get(id=room_id)
+        members = Membership.objects.filter(chatroom_id=room_id).order_by('user_id')
+        return RoomEntry(room_id, room_type, array('q', members.values_list('user_id', flat=True)), stamp)
+
+    @staticmethod
+    def load_active(since):
+        """Entries for the active rooms with messages since `since`."""
+        recent = Message.objects.filter(chat_room=OuterRef('pk'), timestamp__gte=since)
+        active = ChatRoom.objects.filter(Exists(recent), is_active=True)
+        room_types = dict(active.values_list('id', 'room_type'))
+        # Stamps first: a membership change after this point is either in
+        # the rows below or shows up as a newer stamp on the next lookup.
+        stamps = versioning.versions([members_key(room_id) for room_id in room_types])
+
+        members = {room_id: array('q') for room_id in room_types}
+        rows = Membership.objects.filter(chatroom__in=active).order_by('chatroom_id', 'user_id')
+        for room_id, user_id in rows.values_list('chatroom_id', 'user_id').iterator(chunk_size=10000):
+            if room_id in members:
+                members[room_id].append(user_id)
+        return {
+            room_id: RoomEntry(room_id, room_type, members[room_id], stamp)
+            for (room_id, room_type), stamp in zip(room_types.items(), stamps)
+        }
+
+    async def preload(self):
+        days = settings.GATEWAY_PRELOAD_DAYS
+        try:
+            if settings.GATEWAY_ROOM_DIRECTORY and days:
+                started = time.perf_counter()
+                loaded = await db_call(self.load_active)(timezone.now() - timedelta(days=days))
+                # Lookups made while preloading are at least as fresh.
+                self.rooms = {**loaded, **self.rooms}
+                log.info(
+                    'rooms.preloaded', rooms=len(self.rooms),
+                    members=sum(len(entry.members) for entry in self.rooms.values()),
+                    bytes=self.footprint(), seconds=round(time.perf_counter() - started, 3),
+                )
+        except Exception:
+            # Lookups still work, one room at a time.
+            log.exception('rooms.preload_failed')
+        self.ready = True
+
+    def footprint(self):
+        """Approximate bytes held by the directory."""
+        return sys.getsizeof(self.rooms) + sum(
+            sys.getsizeof(entry) + sys.getsizeof(entry.members) for entry in self.rooms.values()
+        )
@@ -0,0 +1,551 @@
+import bisect
+import re
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db.models import Count
+from django.utils.module_loading import import_string
+
+from .models import Message, MessageSearchToken, UserSearchEntry, UserSearchTrigram
+from .versioning import index_key, versions
+
+# Highest code point, used to turn a prefix into a [prefix, prefix + MAX) range
+# so the lookup is an index range scan on every backend.
+PREFIX_UPPER_BOUND = '\U0010ffff'
+
+
+TOKEN_RE = re.compile(r'\w+')
+MAX_TOKEN_LENGTH = 32
+MAX_QUERY_TERMS = 8
+
+
+def normalize(text):
+    return (text or '').strip().lower()
+
+
+def trigrams(text):
+    """Padded character trigrams of text, in the style of pg_trgm."""
+    text = normalize(text)
+    if not text:
+        return set()
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def tokenize(text):
+    """Distinct lower-cased word tokens of a message, truncated for indexing."""
+    return {token[:MAX_TOKEN_LENGTH] for token in TOKEN_RE.findall(normalize(text))}
+
+
+def query_terms(query):
+    return sorted(tokenize(query))[:MAX_QUERY_TERMS]
+
+
+def matches(query, content):
+    """Whether content contains every term a search for query matches on."""
+    terms = query_terms(query)
+    return bool(terms) and set(terms) <= tokenize(content)
+
+
+def min_trigram_hits(query_trigrams):
+    # Require about a third of the query trigrams to match: a single typo or
+    # transposition in a username-length query destroys up to three trigrams.
+    return max(2, len(query_trigrams) // 3)
+
+
+class UserSearchIndex:
+    """Prefix and typo-tolerant username search.
+
+    search() returns user ids ranked: exact username, username prefix,
+    email prefix, then trigram similarity.
+    """
+
+    def __init__(self, include_email=True, min_fuzzy_length=3):
+        self.include_email = include_email
+        self.min_fuzzy_length = min_fuzzy_length
+
+    def add_user(self, user):
+        raise NotImplementedError
+
+    def remove_user(self, user_id):
+        raise NotImplementedError
+
+    def rebuild(self, batch_size=5000):
+        raise NotImplementedError
+
+    def search(self, query, limit=20, exclude_ids=()):
+        raise NotImplementedError
+
+
+class DatabaseUserSearchIndex(UserSearchIndex):
+    """Index kept in UserSearchEntry / UserSearchTrigram tables."""
+
+    def add_user(self, user):
+        username = normalize(user.username)
+        UserSearchEntry.objects.update_or_create(
+            user_id=user.id,
+            defaults={
+                'username_key': username,
+                'email_key': normalize(user.email) if self.include_email else '',
+            }
+        )
+        UserSearchTrigram.objects.filter(user_id=user.id).delete()
+        UserSearchTrigram.objects.bulk_create([
+            UserSearchTrigram(trigram=tri, user_id=user.id) for tri in trigrams(username)
+        ])
+
+    def remove_user(self, user_id):
+        UserSearchEntry.objects.filter(user_id=user_id).delete()
+        UserSearchTrigram.objects.filter(user_id=user_id).delete()
+
+    def rebuild(self, batch_size=5000):
+        UserSearchTrigram.objects.all().delete()
+        UserSearchEntry.objects.all().delete()
+
+        total = 0
+        entries, grams = [], []
+        users = User.objects.order_by('id').values_list('id', 'username', 'email')
+        for user_id, username, email in users.iterator(chunk_size=batch_size):
+            username = normalize(username)
+            entries.append(UserSearchEntry(
+                user_id=user_id,
+                username_key=username,
+                email_key=normalize(email) if self.include_email else '',
+            ))
+            grams.extend(UserSearchTrigram(trigram=tri, user_id=user_id) for tri in trigrams(username))
+            if len(entries) >= batch_size:
+                total += self._flush(entries, grams, batch_size)
+        total += self._flush(entries, grams, batch_size)
+        return total
+
+    def _flush(self, entries, grams, batch_size):
+        count = len(entries)
+        UserSearchEntry.objects.bulk_create(entries, batch_size=batch_size)
+        UserSearchTrigram.objects.bulk_create(grams, batch_size=batch_size)
+        entries.clear()
+        grams.clear()
+        return count
+
+    def search(self, query, limit=20, exclude_ids=()):
+        query = normalize(query)
+        if not query:
+            return []
+
+        exclude_ids = set(exclude_ids)
+        results = []
+        seen = set(exclude_ids)
+
+        def take(user_ids):
+            for user_id in user_ids:
+                if user_id not in seen:
+                    seen.add(user_id)
+                    results.append(user_id)
+            return len(results) >= limit
+
+        fetch = limit + len(exclude_ids)
+        prefix = UserSearchEntry.objects.filter(
+            username_key__gte=query,
+            username_key__lt=query + PREFIX_UPPER_BOUND
+        ).order_by('username_key').values_list('user_id', flat=True)[:fetch]
+        if take(prefix):
+            return results
+
+        if self.include_email:
+            email_prefix = UserSearchEntry.objects.filter(
+                email_key__gte=query,
+                email_key__lt=query + PREFIX_UPPER_BOUND
+            ).order_by('email_key').values_list('user_id', flat=True)[:fetch]
+            if take(email_prefix):
+                return results
+
+        if len(query) < self.min_fuzzy_length:
+            return results
+
+        query_trigrams = trigrams(query)
+        fuzzy = UserSearchTrigram.objects.filter(
+            trigram__in=query_trigrams
+        ).values('user_id').annotate(
+            hits=Count('id')
+        ).filter(
+            hits__gte=min_trigram_hits(query_trigrams)
+        ).order_by('-hits', 'user_id').values_list('user_id', flat=True)[:fetch]
+        take(fuzzy)
+        return results[:limit]
+
+
+class InProcessUserSearchIndex(UserSearchIndex):
+    """Index held in process memory: a sorted key list plus trigram postings.
+
+    Built lazily from the database on first use. Users registered through
+    other worker processes are picked up incrementally (by id) at most once
+    per refresh_interval seconds.
+    """
+
+    def __init__(self, include_email=True, min_fuzzy_length=3, refresh_interval=5.0):
+        super().__init__(include_email, min_fuzzy_length)
+        self.refresh_interval = refresh_interval
+        self._lock = threading.RLock()
+        self._loaded = False
+        self._last_refresh = 0.0
+        self._max_user_id = 0
+        self._usernames = []  # sorted (key, user_id)
+        self._emails = []  # sorted (key, user_id)
+        self._keys = {}  # user_id -> (username_key, email_key)
+        self._postings = {}  # trigram -> set(user_id)
+
+    def add_user(self, user):
+        with self._lock:
+            self._add(user.id, user.username, user.email)
+
+    def remove_user(self, user_id):
+        with self._lock:
+            self._remove(user_id)
+
+    def rebuild(self, batch_size=5000):
+        with self._lock:
+            self._usernames, self._emails = [], []
+            self._keys, self._postings = {}, {}
+            self._max_user_id = 0
+            self._load_since(0, batch_size)
+            self._loaded = True
+            return len(self._keys)
+
+    def search(self, query, limit=20, exclude_ids=()):
+        query = normalize(query)
+        if not query:
+            return []
+
+        with self._lock:
+            self._ensure_fresh()
+
+            exclude_ids = set(exclude_ids)
+            results = []
+            seen = set(exclude_ids)
+
+            def take(user_ids):
+                for user_id in user_ids:
+                    if user_id not in seen:
+                        seen.add(user_id)
+                        results.append(user_id)
+                        if len(results) >= limit:
+                            return True
+                return False
+
+            if take(self._prefix(self._usernames, query)):
+                return results
+            if self.include_email and take(self._prefix(self._emails, query)):
+                return results
+            if len(query) < self.min_fuzzy_length:
+                return results
+
+            query_trigrams = trigrams(query)
+            hits = Counter()
+            for tri in query_trigrams:
+                hits.update(self._postings.get(tri, ()))
+            threshold = min_trigram_hits(query_trigrams)
+            ranked = sorted(
+                (user_id for user_id, count in hits.items() if count >= threshold),
+                key=lambda user_id: (-hits[user_id], user_id)
+            )
+            take(ranked)
+            return results
+
+    def _prefix(self, keys, query):
+        i = bisect.bisect_left(keys, (query,))
+        while i < len(keys) and keys[i][0].startswith(query):
+            yield keys[i][1]
+            i += 1
+
+    def _ensure_fresh(self):
+        now = time.monotonic()
+        if not self._loaded:
+            self.rebuild()
+            self._last_refresh = now
+        elif now - self._last_refresh >= self.refresh_interval:
+            self._load_since(self._max_user_id)
+            self._last_refresh = now
+
+    def _load_since(self, user_id, batch_size=5000):
+        users = User.objects.filter(id__gt=user_id).order_by('id').values_list('id', 'username', 'email')
+        rows = list(users.iterator(chunk_size=batch_size))
+        for row in rows:
+            self._remove(row[0])
+        # Append everything, then sort each key list once: inserting users
+        # one by one in id order would shift the lists on every insert.
+        for row in rows:
+            self._add(*row, keep_sorted=False)
+        self._usernames.sort()
+        self._emails.sort()
+
+    def _add(self, user_id, username, email, keep_sorted=True):
+        if keep_sorted:
+            self._remove(user_id)
+        username_key = normalize(username)
+        email_key = normalize(email) if self.include_email else ''
+        self._keys[user_id] = (username_key, email_key)
+        insert = bisect.insort if keep_sorted else list.append
+        insert(self._usernames, (username_key, user_id))
+        if email_key:
+            insert(self._emails, (email_key, user_id))
+        for tri in trigrams(username_key):
+            self._postings.setdefault(tri, set()).add(user_id)
+        self._max_user_id = max(self._max_user_id, user_id)
+
+    def _remove(self, user_id):
+        keys = self._keys.pop(user_id, None)
+        if not keys:
+            return
+        username_key, email_key = keys
+        self._discard(self._usernames, (username_key, user_id))
+        if email_key:
+            self._discard(self._emails, (email_key, user_id))
+        for tri in trigrams(username_key):
+            posting = self._postings.get(tri)
+            if posting:
+                posting.discard(user_id)
+                if not posting:
+                    del self._postings[tri]
+
+    def _discard(self, keys, item):
+        i = bisect.bisect_left(keys, item)
+        if i < len(keys) and keys[i] == item:
+            del keys[i]
+
+
+class MessageSearchIndex:
+    """Incrementally maintained inverted index over message content.
+
+    search() returns message ids containing every query term, newest first,
+    restricted to room_ids and keyset-paginated with before_id.
+    """
+
+    def add_message(self, message_id, chat_room_id, content):
+        raise NotImplementedError
+
+    def remove_message(self, message_id):
+        raise NotImplementedError
+
+    def remove_messages(self, message_ids):
+        for message_id in message_ids:
+            self.remove_message(message_id)
+
+    def rebuild(self, batch_size=5000):
+        raise NotImplementedError
+
+    def search(self, query, room_ids, before_id=None, limit=20):
+        raise NotImplementedError
+
+
+class DatabaseMessageSearchIndex(MessageSearchIndex):
+    """Index kept in the MessageSearchToken table (works on SQLite and Postgres)."""
+
+    def add_message(self, message_id, chat_room_id, content):
+        MessageSearchToken.objects.bulk_create([
+            MessageSearchToken(token=token, message_id=message_id, chat_room_id=chat_room_id)
+            for token in tokenize(content)
+        ])
+
+    def remove_message(self, message_id):
+        MessageSearchToken.objects.filter(message_id=message_id).delete()
+
+    def remove_messages(self, message_ids):
+        MessageSearchToken.objects.filter(message_id__in=message_ids).delete()
+
+    def rebuild(self, batch_size=5000):
+        MessageSearchToken.objects.all().delete()
+
+        total = 0
+        rows = []
+        messages = Message.objects.order_by('id').values_list('id', 'chat_room_id', 'content')
+        for message_id, chat_room_id, content in messages.iterator(chunk_size=batch_size):
+            rows.extend(
+                MessageSearchToken(token=token, message_id=message_id, chat_room_id=chat_room_id)
+                for token in tokenize(content)
+            )
+            total += 1
+            if len(rows) >= batch_size:
+                MessageSearchToken.objects.bulk_create(rows, batch_size=batch_size)
+                rows = []
+        MessageSearchToken.objects.bulk_create(rows, batch_size=batch_size)
+        return total
+
+    def search(self, query, room_ids, before_id=None, limit=20):
+        terms = query_terms(query)
+        if not terms or not room_ids:
+            return []
+
+        tokens = MessageSearchToken.objects.filter(token__in=terms, chat_room_id__in=room_ids)
+        if before_id:
+            tokens = tokens.filter(message_id__lt=before_id)
+
+        if len(terms) == 1:
+            message_ids = tokens.order_by('-message_id').values_list('message_id', flat=True)
+        else:
+            message_ids = tokens.values('message_id').annotate(
+                hits=Count('id')
+            ).filter(
+                hits=len(terms)
+            ).order_by('-message_id').values_list('message_id', flat=True)
+        return list(message_ids[:limit])
+
+
+class InProcessMessageSearchIndex(MessageSearchIndex):
+    """Index held in process memory: token -> room id -> ascending message ids.
+
+    Built from the database on first use; afterwards messages written by
+    other processes (the gateways) are picked up incrementally by id at most
+    once per refresh_interval seconds. Edits, deletes, purges and archiving
+    done elsewhere cannot be seen that way, so they bump the 'messages'
+    index version (app.versioning) and the index rebuilds once it notices,
+    at most once per rebuild_interval seconds. Until then it may return
+    stale hits, which callers drop by re-checking them with matches().
+    """
+
+    def __init__(self, refresh_interval=2.0, rebuild_interval=60.0):
+        self.refresh_interval = refresh_interval
+        self.rebuild_interval = rebuild_interval
+        self._lock = threading.RLock()
+        self._loaded = False
+        self._last_refresh = 0.0
+        self._last_rebuild = 0.0
+        self._version = None
+        self._max_message_id = 0
+        self._postings = {}  # token -> {room_id: [message_id, ...]}
+        self._tokens = {}  # message_id -> (room_id, tokens)
+
+    def add_message(self, message_id, chat_room_id, content):
+        with self._lock:
+            self._add(message_id, chat_room_id, content)
+
+    def remove_message(self, message_id):
+        with self._lock:
+            self._remove(message_id)
+
+    def remove_messages(self, message_ids):
+        with self._lock:
+            for message_id in message_ids:
+                self._remove(message_id)
+
+    def rebuild(self, batch_size=5000):
+        with self._lock:
+            # Read the version first: a change made while loading shows up
+            # as a newer version on the next refresh.
+            self._version, = versions([index_key('messages')])
+            self._last_rebuild = time.monotonic()
+            self._postings, self._tokens = {}, {}
+            self._max_message_id = 0
+            self._load_since(0, batch_size)
+            self._loaded = True
+            return len(self._tokens)
+
+    def search(self, query, room_ids, before_id=None, limit=20):
+        terms = query_terms(query)
+        if not terms or not room_ids:
+            return []
+
+        with self._lock:
+            self._ensure_fresh()
+
+            results = []
+            for room_id in room_ids:
+                postings = [self._postings.get(term, {}).get(room_id) for term in terms]
+                if not all(postings):
+                    continue
+                postings.sort(key=len)
+                end = bisect.bisect_left(postings[0], before_id) if before_id else len(postings[0])
+                others = [set(p) for p in postings[1:]]
+                found = 0
+                for message_id in reversed(postings[0][:end]):
+                    if all(message_id in other for other in others):
+                        results.append(message_id)
+                        found += 1
+                        if found >= limit:
+                            break
+            results.sort(reverse=True)
+            return results[:limit]
+
+    def _ensure_fresh(self):
+        now = time.monotonic()
+        if not self._loaded:
+            self.rebuild()
+            self._last_refresh = now
+        elif now - self._last_refresh >= self.refresh_interval:
+            if (
+                now - self._last_rebuild >= self.rebuild_interval
+                and versions([index_key('messages')])[0] != self._version
+            ):
+                self.rebuild()
+            else:
+                self._load_since(self._max_message_id)
+            self._last_refresh = now
+
+    def _load_since(self, message_id, batch_size=5000):
+        messages = Message.objects.filter(id__gt=message_id).order_by('id').values_list(
+            'id', 'chat_room_id', 'content'
+        )
+        for row in messages.iterator(chunk_size=batch_size):
+            self._add(*row)
+
+    def _add(self, message_id, chat_room_id, content):
+        if message_id in self._tokens:
+            return
+        tokens = tokenize(content)
+        self._tokens[message_id] = (chat_room_id, tokens)
+        for token in tokens:
+            ids = self._postings.setdefault(token, {}).setdefault(chat_room_id, [])
+            if not ids or ids[-1] < message_id:
+                ids.append(message_id)
+            else:
+                bisect.insort(ids, message_id)
+        self._max_message_id = max(self._max_message_id, message_id)
+
+    def _remove(self, message_id):
+        entry = self._tokens.pop(message_id, None)
+        if not entry:
+            return
+        chat_room_id, tokens = entry
+        for token in tokens:
+            by_room = self._postings.get(token, {})
+            ids = by_room.get(chat_room_id)
+            if not ids:
+                continue
+            i = bisect.bisect_left(ids, message_id)
+            if i < len(ids) and ids[i] == message_id:
+                del ids[i]
+            if not ids:
+                del by_room[chat_room_id]
+            if not by_room:
+                self._postings.pop(token, None)
+
+
+_user_search_index = None
+_message_search_index = None
+
+
+def get_user_search_index():
+    global _user_search_index
+    if _user_search_index is None:
+        backend = import_string(getattr(
+            settings, 'USER_SEARCH_INDEX', 'app.search.DatabaseUserSearchIndex'
+        ))
+        _user_search_index = backend(
+            include_email=getattr(settings, 'USER_SEARCH_INCLUDE_EMAIL', True)
+        )
+    return _user_search_index
+
+
+def get_message_search_index():
+    global _message_search_index
+    if _message_search_index is None:
+        backend = import_string(getattr(
+            settings, 'MESSAGE_SEARCH_INDEX', 'app.search.DatabaseMessageSearchIndex'
+        ))
+        _message_search_index = backend()
+    return _message_search_index
+
+
+def index_message(message):
+    get_message_search_index().add_message(message.id, message.chat_room_id, message.content)
@@ -0,0 +1,176 @@
+import functools
+import hmac
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from .instrumentation import COUNT_BUCKETS, Histogram
+
+# Latency buckets in seconds, the Prometheus convention.
+LATENCY_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10,
+)
+FANOUT_BUCKETS = COUNT_BUCKETS + (610, 987, 1597, 2584, 4181, 10000)
+
+# Client-supplied frame types are mapped onto this set so a misbehaving
+# client cannot create unbounded label values.
+FRAME_TYPES = frozenset({
+    'send_message', 'typing', 'join_room', 'delete_message', 'edit_message', 'mark_read', 'mark_delivered',
+    'new_message', 'message_deleted', 'message_edited', 'user_typing', 'user_joined', 'presence', 'receipts',
+    'connection_established', 'reconnect', 'error',
+})
+
+
+def has_metrics_token(authorization):
+    """True when an Authorization header carries METRICS_TOKEN, which lets a
+    Prometheus scraper without a user account read the metrics."""
+    token = settings.METRICS_TOKEN
+    return bool(token) and hmac.compare_digest(authorization.encode(), f'Bearer {token}'.encode())
+
+
+def frame_type(value):
+    return value if value in FRAME_TYPES else 'unknown'
+
+
+def _format_labels(names, values):
+    if not names:
+        return ''
+    pairs = ','.join(f'{name}="{value}"' for name, value in zip(names, values))
+    return '{' + pairs + '}'
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(labels)
+
+    def header(self):
+        return [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} {self.kind}']
+
+
+class Counter(Metric):
+    """Monotonic counter. Updated from the event loop only, so no locking."""
+
+    kind = 'counter'
+
+    def __init__(self, name, help_text, labels=()):
+        super().__init__(name, help_text, labels)
+        self.values = {}
+
+    def inc(self, *labels, amount=1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render(self):
+        lines = self.header()
+        for labels, value in sorted(self.values.items()):
+            lines.append(f'{self.name}{_format_labels(self.label_names, labels)} {value}')
+        return lines
+
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def dec(self, *labels, amount=1):
+        self.inc(*labels, amount=-amount)
+
+    def set(self, value, *labels):
+        self.values[labels] = value
+
+
+class HistogramMetric(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = buckets
+        self.histograms = {}
+
+    def observe(self, value, *labels):
+        histogram = self.histograms.get(labels)
+        if histogram is None:
+            histogram = self.histograms[labels] = Histogram(self.buckets)
+        histogram.observe(value)
+
+    def render(self):
+        lines = self.header()
+        for labels, histogram in sorted(self.histograms.items()):
+            cumulative = 0
+            for bound, count in zip(histogram.buckets + ('+Inf',), histogram.counts):
+                cumulative += count
+                bucket_labels = _format_labels(self.label_names + ('le',), labels + (bound,))
+                lines.append(f'{self.name}_bucket{bucket_labels} {cumulative}')
+            label_text = _format_labels(self.label_names, labels)
+            lines.append(f'{self.name}_sum{label_text} {histogram.sum}')
+            lines.append(f'{self.name}_count{label_text} {histogram.count}')
+        return lines
+
+
+active_connections = Gauge(
+    'chat_gateway_active_connections', 'Open websocket connections.'
+)
+frames_received = Counter(
+    'chat_gateway_frames_received_total', 'Websocket frames received, by type.', ['type']
+)
+frames_sent = Counter(
+    'chat_gateway_frames_sent_total', 'Websocket frames sent, by type.', ['type']
+)
+send_drops = Counter(
+    'chat_gateway_send_drops_total', 'Frames that could not be delivered to a connection.', ['type']
+)
+broadcast_fanout = HistogramMetric(
+    'chat_gateway_broadcast_fanout', 'Connections reached per room broadcast.', buckets=FANOUT_BUCKETS
+)
+message_latency = HistogramMetric(
+    'chat_gateway_message_latency_seconds',
+    'Time from receiving a send_message frame to the message being persisted '
+    '(stage="persist") and delivered (stage="deliver").',
+    ['stage'],
+)
+rate_limited = Counter(
+    'chat_gateway_rate_limited_total',
+    'Frames rejected by a rate limit, by frame kind and the bucket that ran out.',
+    ['kind', 'scope'],
+)
+db_in_flight = Gauge(
+    'chat_gateway_db_in_flight', 'Database calls queued or running on the sync executor.'
+)
+
+active_connections.set(0)
+db_in_flight.set(0)
+
+REGISTRY = (
+    active_connections, frames_received, frames_sent, send_drops,
+    broadcast_fanout, message_latency, db_in_flight, rate_limited,
+)
+
+
+def render_metrics():
+    """The registry in the Prometheus text exposition format."""
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def track_db(func):
+    """Wrap an async DB call so queued and running calls show in db_in_flight."""
+    @functools.wraps(func)
+    async def call(*args, **kwargs):
+        db_in_flight.inc()
+        try:
+            return await func(*args, **kwargs)
+        finally:
+            db_in_flight.dec()
+
+    return call
+
+
+def db_call(func):
+    """sync_to_async(func), tracked in db_in_flight."""
+    return track_db(sync_to_async(func))
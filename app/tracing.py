@@ -0,0 +1,152 @@
+import collections
+import contextlib
+import contextvars
+import json
+import queue
+import random
+import secrets
+import threading
+import time
+
+from django.conf import settings
+
+_current_trace = contextvars.ContextVar('trace', default=None)
+
+
+class Trace:
+    """Timings for one inbound frame: a list of named spans relative to its start."""
+
+    __slots__ = ('trace_id', 'name', 'wall_start', 'started', 'spans', 'attrs', '_token')
+
+    def __init__(self, name, **attrs):
+        self.trace_id = secrets.token_hex(8)
+        self.name = name
+        self.wall_start = time.time()
+        self.started = time.perf_counter()
+        self.spans = []
+        self.attrs = attrs
+        self._token = None
+
+    @contextlib.contextmanager
+    def span(self, name, **attrs):
+        started = time.perf_counter()
+        try:
+            yield self
+        finally:
+            self.spans.append({
+                'name': name,
+                'start_ms': round((started - self.started) * 1000, 3),
+                'duration_ms': round((time.perf_counter() - started) * 1000, 3),
+                **attrs,
+            })
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def record(self):
+        return {
+            'trace_id': self.trace_id,
+            'name': self.name,
+            'start': self.wall_start,
+            'duration_ms': round((time.perf_counter() - self.started) * 1000, 3),
+            **self.attrs,
+            'spans': self.spans,
+        }
+
+
+class _NoTrace:
+    """Stand-in for unsampled frames; every operation is a no-op."""
+
+    trace_id = None
+
+    def span(self, name, **attrs):
+        return contextlib.nullcontext(self)
+
+    def set(self, **attrs):
+        pass
+
+
+NO_TRACE = _NoTrace()
+
+
+class MemoryExporter:
+    """Keeps the most recent traces in a ring buffer."""
+
+    def __init__(self, size):
+        self.traces = collections.deque(maxlen=size)
+
+    def export(self, record):
+        self.traces.append(record)
+
+    def slowest(self, limit=20):
+        return sorted(self.traces, key=lambda record: record['duration_ms'], reverse=True)[:limit]
+
+
+class FileExporter:
+    """Appends traces as JSON lines from a background thread.
+
+    Traces are dropped rather than queued without bound if the disk falls
+    behind.
+    """
+
+    def __init__(self, path, queue_size=10000):
+        self.path = path
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.dropped = 0
+        threading.Thread(target=self._write, name='trace-writer', daemon=True).start()
+
+    def export(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def _write(self):
+        with open(self.path, 'a', encoding='utf-8') as f:
+            while True:
+                record = self.queue.get()
+                f.write(json.dumps(record, ensure_ascii=False) + '\n')
+                if self.queue.empty():
+                    f.flush()
+
+
+_exporter = None
+_exporter_lock = threading.Lock()
+
+
+def get_exporter():
+    """The configured exporter (TRACE_EXPORT: 'memory' or 'file'), or None."""
+    global _exporter
+    if _exporter is None and settings.TRACE_EXPORT:
+        with _exporter_lock:
+            if _exporter is None:
+                if settings.TRACE_EXPORT == 'file':
+                    _exporter = FileExporter(settings.TRACE_FILE)
+                else:
+                    _exporter = MemoryExporter(settings.TRACE_MEMORY_SIZE)
+    return _exporter
+
+
+def current_trace():
+    return _current_trace.get() or NO_TRACE
+
+
+def span(name, **attrs):
+    """Time a stage of the current frame's trace (no-op when not traced)."""
+    return current_trace().span(name, **attrs)
+
+
+@contextlib.contextmanager
+def trace_frame(name, **attrs):
+    """Trace the handling of one inbound frame, if tracing is on and sampled."""
+    if not settings.TRACE_EXPORT or random.random() >= settings.TRACE_SAMPLE_RATE:
+        yield NO_TRACE
+        return
+
+    trace = Trace(name, **attrs)
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _current_trace.reset(token)
+        get_exporter().export(trace.record())
@@ -12,17 +12,27 @@ urlpatterns = [
     path('friends/request/', views.send_friend_request, name='send_friend_request_alias'),  
     path('friends/requests/<int:request_id>/respond/', views.respond_friend_request, name='respond_friend_request'),
     path('friends/respond/<int:request_id>/', views.respond_friend_request, name='respond_alias'),  
+    path('friends/presence/', views.get_presence, name='get_presence'),
 
     path('users/search/', views.search_users, name='search_users'),
     
     path('chatrooms/', views.get_chatrooms, name='get_chatrooms'),
     path('chatrooms/create/', views.create_chatroom, name='create_chatroom'),
+    path('chatrooms/unread/', views.get_unread_counts, name='get_unread_counts'),
     path('chatrooms/<int:room_id>/messages/', views.get_messages, name='get_messages'),
+    path('chatrooms/<int:room_id>/messages/export/', views.export_messages, name='export_messages'),
     path('chatrooms/<int:room_id>/join/', views.join_chatroom, name='join_chatroom'),
     path('chatrooms/<int:room_id>/leave/', views.leave_chatroom, name='leave_chatroom'),
+    path('chatrooms/<int:room_id>/members/', views.update_members, name='update_members'),
+    path('chatrooms/<int:room_id>/participants/', views.get_participants, name='get_participants'),
     
     path('chatrooms/anonymous/', views.get_anonymous_rooms, name='get_anonymous_rooms'),
     path('chatrooms/anonymous/<int:room_id>/join/', views.join_anonymous_room, name='join_anonymous_room'),
     
+    path('messages/search/', views.search_messages, name='search_messages'),
     path('messages/<int:message_id>/', views.delete_message, name='delete_message'),
+
+    path('metrics/', views.gateway_metrics, name='gateway_metrics'),
+    path('metrics/endpoints/', views.endpoint_metrics_view, name='endpoint_metrics'),
+    path('metrics/traces/', views.slowest_traces, name='slowest_traces'),
 ]
\ No newline at end of file
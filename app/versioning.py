@@ -0,0 +1,113 @@
+"""Per-user and per-room version stamps for conditional GETs.
+
+Each cacheable list has a version key in the Django cache, replaced with a
+fresh random stamp whenever something it shows changes (bump after the write
+has committed). A list's ETag is a hash of its path, the viewer and the
+stamps it depends on, so a client that already holds the current version
+gets a 304 without the list being queried or serialized.
+
+Stamps are random rather than incremented so an evicted key can never come
+back as an old version, and bumping many keys (every member of a room) is a
+single set_many round trip.
+"""
+import hashlib
+import secrets
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.http import HttpResponseNotModified
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.utils.http import parse_etags
+
+# No expiry: a key that is never bumped again stays valid forever.
+TIMEOUT = None
+
+
+def user_key(user_id, scope):
+    """Scopes: 'chatrooms', 'friends', 'requests'."""
+    return f'ver:user:{user_id}:{scope}'
+
+
+def room_key(room_id, scope):
+    """Scopes: 'messages', 'members'."""
+    return f'ver:room:{room_id}:{scope}'
+
+
+def index_key(name):
+    """Names: 'messages' (bumped when indexed messages change or go away)."""
+    return f'ver:index:{name}'
+
+
+def member_keys(user_ids, scope='chatrooms'):
+    return [user_key(user_id, scope) for user_id in user_ids]
+
+
+def friendship_changed(sender, instance, **kwargs):
+    """post_save/post_delete receiver for Friendship: both users' friend
+    lists, and the presence friend sets cached under them, are out of date."""
+    keys = member_keys([instance.user1_id, instance.user2_id], 'friends')
+    transaction.on_commit(lambda: bump(*keys))
+
+
+def _stamp():
+    return secrets.token_hex(8)
+
+
+def bump(*keys):
+    """Give every key a new version. Call once the write has committed."""
+    if keys:
+        cache.set_many({key: _stamp() for key in keys}, TIMEOUT)
+
+
+async def abump(*keys):
+    if keys:
+        await cache.aset_many({key: _stamp() for key in keys}, TIMEOUT)
+
+
+def versions(keys):
+    found = cache.get_many(keys)
+    for key in keys:
+        if key not in found:
+            # Never bumped, or evicted: start a new version (or take the one
+            # a concurrent request just started).
+            cache.add(key, _stamp(), TIMEOUT)
+            found[key] = cache.get(key)
+    return [found[key] for key in keys]
+
+
+async def aversions(keys):
+    found = await cache.aget_many(keys)
+    for key in keys:
+        if key not in found:
+            await cache.aadd(key, _stamp(), TIMEOUT)
+            found[key] = await cache.aget(key)
+    return [found[key] for key in keys]
+
+
+def make_etag(request, viewer_id, stamps):
+    source = '|'.join([request.get_full_path(), str(viewer_id), *map(str, stamps)])
+    return '"%s"' % hashlib.blake2b(source.encode(), digest_size=16).hexdigest()
+
+
+async def acheck(request, viewer_id, keys):
+    """ETag for a GET that depends on `keys`, and a 304 response when the
+    client's If-None-Match already matches it (else None). The ETag also
+    keys app.response_cache entries.
+
+    Returns (None, None) when neither ETags nor the response cache are on."""
+    if not settings.ETAGS_ENABLED and not settings.RESPONSE_CACHE_TIMEOUT:
+        return None, None
+    etag = make_etag(request, viewer_id, await aversions(keys))
+    if settings.ETAGS_ENABLED and etag in parse_etags(request.headers.get('If-None-Match', '')):
+        return etag, tag(HttpResponseNotModified(), etag)
+    return etag, None
+
+
+def tag(response, etag):
+    """Attach the ETag and make clients revalidate before reusing the body."""
+    if etag and settings.ETAGS_ENABLED:
+        response['ETag'] = etag
+        patch_cache_control(response, private=True, no_cache=True)
+        patch_vary_headers(response, ['Authorization'])
+    return response
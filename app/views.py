@@ -1,19 +1,44 @@
-from django.contrib.auth.models import User
-from django.contrib.auth import authenticate
-from django.http import JsonResponse
+from django.contrib.auth.models import User, UserManager
+from django.contrib.auth.hashers import make_password
+from django.http import HttpResponse, StreamingHttpResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
-from django.db.models import Q, Count
+from django.db import transaction
+from django.utils import timezone
+from django.db.models import Q, Count, Max, Prefetch
+from asgiref.sync import sync_to_async
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+import asyncio
 import json
 import jwt
 from datetime import datetime, timedelta
 from django.conf import settings
-from .models import ChatRoom, Message, FriendRequest, Friendship
+from .models import ChatRoom, Message, FriendRequest, Friendship, RoomReadState
+from .archive import archived_page, iter_archived_messages
+from .export import aexport_stream, export_filename
+from .instrumentation import JsonResponse, endpoint_metrics
+from .response_cache import cached_json
+from .search import get_message_search_index, get_user_search_index, matches
+from . import edits, presence, telemetry, versioning
+from .tracing import MemoryExporter, get_exporter
+
+# Password hashing is CPU-bound (and releases the GIL), so it runs on its own
+# bounded pool instead of the event loop or the single ORM thread.
+_password_executor = ThreadPoolExecutor(
+    max_workers=getattr(settings, 'PASSWORD_HASH_WORKERS', 4),
+    thread_name_prefix='password-hash'
+)
+
+
+async def run_password_hasher(func, *args):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_password_executor, partial(func, *args))
 
 
 @csrf_exempt
 @require_http_methods(["POST"])
-def register(request):
+async def register(request):
     try:
         data = json.loads(request.body)
         username = data.get('username')
@@ -23,14 +48,16 @@ def register(request):
         if not username or not password:
             return JsonResponse({'error': 'Username and password required'}, status=400)
 
-        if User.objects.filter(username=username).exists():
+        if await User.objects.filter(username=username).aexists():
             return JsonResponse({'error': 'Username already exists'}, status=400)
 
-        user = User.objects.create_user(
-            username=username,
-            email=email or '',
-            password=password
+        user = User(
+            username=User.normalize_username(username),
+            email=UserManager.normalize_email(email or '')
         )
+        await run_password_hasher(user.set_password, password)
+        await user.asave()
+        await sync_to_async(get_user_search_index().add_user)(user)
 
         return JsonResponse({
             'message': 'User created successfully',
@@ -44,13 +71,13 @@ def register(request):
 
 @csrf_exempt
 @require_http_methods(["POST"])
-def login(request):
+async def login(request):
     try:
         data = json.loads(request.body)
         username = data.get('username')
         password = data.get('password')
 
-        user = authenticate(username=username, password=password)
+        user = await authenticate_user(username, password)
 
         if user:
             payload = {
@@ -72,6 +99,24 @@ def login(request):
         return JsonResponse({'error': str(e)}, status=500)
 
 
+async def authenticate_user(username, password):
+    """Async equivalent of ModelBackend.authenticate with hashing off the loop."""
+    if not username or password is None:
+        return None
+
+    user = await User.objects.filter(username=username).afirst()
+    if user is None:
+        # Hash anyway so response time does not reveal whether the user exists.
+        await run_password_hasher(make_password, password)
+        return None
+
+    if not user.is_active:
+        return None
+
+    valid = await run_password_hasher(user.check_password, password)
+    return user if valid else None
+
+
 def get_user_from_token(request):
     token = request.headers.get('Authorization', '').replace('Bearer ', '')
     
@@ -86,9 +131,22 @@ def get_user_from_token(request):
         return None
 
 
+async def aget_user_from_token(request):
+    token = request.headers.get('Authorization', '').replace('Bearer ', '')
+
+    if not token:
+        return None
+
+    try:
+        payload = jwt.decode(token, settings.SECRET_KEY, algorithms=['HS256'])
+        return await User.objects.aget(id=payload['user_id'])
+    except:
+        return None
+
+
 @require_http_methods(["GET"])
-def profile(request):
-    user = get_user_from_token(request)
+async def profile(request):
+    user = await aget_user_from_token(request)
     
     if not user:
         return JsonResponse({'error': 'Authentication required'}, status=401)
@@ -102,8 +160,8 @@ def profile(request):
 
 @csrf_exempt
 @require_http_methods(["POST"])
-def send_friend_request(request):
-    user = get_user_from_token(request)
+async def send_friend_request(request):
+    user = await aget_user_from_token(request)
     
     if not user:
         return JsonResponse({'error': 'Authentication required'}, status=401)
@@ -117,26 +175,27 @@ def send_friend_request(request):
         if not receiver_id:
             return JsonResponse({'error': 'receiver_id or to_user_id required'}, status=400)
         
-        receiver = User.objects.get(id=receiver_id)
+        receiver = await User.objects.aget(id=receiver_id)
         
         if user.id == receiver.id:
             return JsonResponse({'error': 'Cannot send friend request to yourself'}, status=400)
 
-        if Friendship.are_friends(user, receiver):
+        if await sync_to_async(Friendship.are_friends)(user, receiver):
             return JsonResponse({'error': 'Already friends'}, status=400)
 
-        existing_request = FriendRequest.objects.filter(
+        existing_request = await FriendRequest.objects.filter(
             Q(sender=user, receiver=receiver) | Q(sender=receiver, receiver=user),
             status='pending'
-        ).first()
+        ).afirst()
 
         if existing_request:
             return JsonResponse({'error': 'Friend request already exists'}, status=400)
 
-        friend_request = FriendRequest.objects.create(
+        friend_request = await FriendRequest.objects.acreate(
             sender=user,
             receiver=receiver
         )
+        await versioning.abump(*versioning.member_keys([user.id, receiver.id], 'requests'))
 
         return JsonResponse({
             'message': 'Friend request sent',
@@ -151,8 +210,8 @@ def send_friend_request(request):
 
 @csrf_exempt
 @require_http_methods(["POST"])
-def respond_friend_request(request, request_id):
-    user = get_user_from_token(request)
+async def respond_friend_request(request, request_id):
+    user = await aget_user_from_token(request)
     
     if not user:
         return JsonResponse({'error': 'Authentication required'}, status=401)
@@ -164,23 +223,22 @@ def respond_friend_request(request, request_id):
         if action not in ['accept', 'reject']:
             return JsonResponse({'error': 'Invalid action'}, status=400)
 
-        friend_request = FriendRequest.objects.get(id=request_id, receiver=user, status='pending')
+        friend_request = await FriendRequest.objects.select_related('sender', 'receiver').aget(
+            id=request_id, receiver=user, status='pending'
+        )
 
+        pair = [friend_request.sender_id, friend_request.receiver_id]
         if action == 'accept':
-            friend_request.status = 'accepted'
-            friend_request.save()
-
-            Friendship.objects.create(
-                user1=friend_request.sender,
-                user2=friend_request.receiver
-            )
-
-            ChatRoom.get_private_chat(friend_request.sender, friend_request.receiver)
-
+            await sync_to_async(_accept_friend_request)(friend_request)
+            # The new Friendship bumps 'friends' itself (versioning.friendship_changed).
+            await versioning.abump(*(
+                versioning.member_keys(pair, 'requests') + versioning.member_keys(pair, 'chatrooms')
+            ))
             return JsonResponse({'message': 'Friend request accepted'})
         else:
             friend_request.status = 'rejected'
-            friend_request.save()
+            await friend_request.asave()
+            await versioning.abump(*versioning.member_keys(pair, 'requests'))
             return JsonResponse({'message': 'Friend request rejected'})
 
     except FriendRequest.DoesNotExist:
@@ -189,44 +247,73 @@ def respond_friend_request(request, request_id):
         return JsonResponse({'error': str(e)}, status=500)
 
 
+def _accept_friend_request(friend_request):
+    with transaction.atomic():
+        friend_request.status = 'accepted'
+        friend_request.save()
+
+        Friendship.objects.create(
+            user1=friend_request.sender,
+            user2=friend_request.receiver
+        )
+
+        ChatRoom.get_private_chat(friend_request.sender, friend_request.receiver)
+
+
 @require_http_methods(["GET"])
-def get_friend_requests(request):
-    user = get_user_from_token(request)
+async def get_friend_requests(request):
+    user = await aget_user_from_token(request)
     
     if not user:
         return JsonResponse({'error': 'Authentication required'}, status=401)
 
-    received = FriendRequest.objects.filter(receiver=user, status='pending')
-    sent = FriendRequest.objects.filter(sender=user, status='pending')
+    etag, not_modified = await versioning.acheck(request, user.id, [versioning.user_key(user.id, 'requests')])
+    if not_modified:
+        return not_modified
+
+    return versioning.tag(await cached_json(etag, partial(_friend_requests_payload, user)), etag)
+
+
+async def _friend_requests_payload(user):
+    received = FriendRequest.objects.filter(receiver=user, status='pending').select_related('sender')
+    sent = FriendRequest.objects.filter(sender=user, status='pending').select_related('receiver')
 
     received_data = [{
         'id': req.id,
         'sender_id': req.sender.id,
         'sender_username': req.sender.username,
         'created_at': req.created_at.isoformat()
-    } for req in received]
+    } async for req in received]
 
     sent_data = [{
         'id': req.id,
         'receiver_id': req.receiver.id,
         'receiver_username': req.receiver.username,
         'created_at': req.created_at.isoformat()
-    } for req in sent]
+    } async for req in sent]
 
-    return JsonResponse({
+    return {
         'received': received_data,
         'sent': sent_data
-    })
+    }
 
 
 @require_http_methods(["GET"])
-def get_friends(request):
-    user = get_user_from_token(request)
+async def get_friends(request):
+    user = await aget_user_from_token(request)
     
     if not user:
         return JsonResponse({'error': 'Authentication required'}, status=401)
 
-    friends = Friendship.get_friends(user)
+    etag, not_modified = await versioning.acheck(request, user.id, [versioning.user_key(user.id, 'friends')])
+    if not_modified:
+        return not_modified
+
+    return versioning.tag(await cached_json(etag, partial(_friends_payload, user)), etag)
+
+
+async def _friends_payload(user):
+    friends = await sync_to_async(Friendship.get_friends)(user)
 
     friends_data = [{
         'id': friend.id,
@@ -234,12 +321,40 @@ def get_friends(request):
         'email': friend.email
     } for friend in friends]
 
-    return JsonResponse({'friends': friends_data})
+    return {'friends': friends_data}
 
 
 @require_http_methods(["GET"])
-def search_users(request):
-    user = get_user_from_token(request)
+async def get_presence(request):
+    """Online/offline status of friends, in bulk: ?ids=1,2,3
+
+    Ids that are not the caller or one of their friends are left out.
+    """
+    user = await aget_user_from_token(request)
+
+    if not user:
+        return JsonResponse({'error': 'Authentication required'}, status=401)
+
+    if not settings.PRESENCE_ENABLED:
+        return JsonResponse({'error': 'Presence is not available'}, status=503)
+
+    try:
+        user_ids = list(dict.fromkeys(int(uid) for uid in request.GET.get('ids', '').split(',') if uid.strip()))
+    except ValueError:
+        return JsonResponse({'error': 'ids must be a comma-separated list of user ids'}, status=400)
+
+    if len(user_ids) > settings.PRESENCE_BULK_LIMIT:
+        return JsonResponse({'error': f'At most {settings.PRESENCE_BULK_LIMIT} ids per request'}, status=400)
+
+    visible = await presence.afriend_ids(user.id) | {user.id}
+    statuses = await presence.abulk_status([uid for uid in user_ids if uid in visible])
+
+    return JsonResponse({'presence': statuses})
+
+
+@require_http_methods(["GET"])
+async def search_users(request):
+    user = await aget_user_from_token(request)
     
     if not user:
         return JsonResponse({'error': 'Authentication required'}, status=401)
@@ -249,20 +364,19 @@ def search_users(request):
     if not query:
         return JsonResponse({'users': []})
 
-    users = User.objects.filter(
-        Q(username__icontains=query) | Q(email__icontains=query)
-    ).exclude(id=user.id)[:20]
+    user_ids = await sync_to_async(get_user_search_index().search)(query, limit=20, exclude_ids=[user.id])
+    users_by_id = await User.objects.ain_bulk(user_ids)
+    users = [users_by_id[uid] for uid in user_ids if uid in users_by_id]
 
-    friends = Friendship.get_friends(user)
-    friend_ids = [f.id for f in friends]
+    friend_ids = await sync_to_async(Friendship.get_friend_ids)(user, among=user_ids)
 
-    sent_request_ids = list(FriendRequest.objects.filter(
-        sender=user, status='pending'
-    ).values_list('receiver_id', flat=True))
+    sent_request_ids = {uid async for uid in FriendRequest.objects.filter(
+        sender=user, receiver_id__in=user_ids, status='pending'
+    ).values_list('receiver_id', flat=True)}
 
-    received_request_ids = list(FriendRequest.objects.filter(
-        receiver=user, status='pending'
-    ).values_list('sender_id', flat=True))
+    received_request_ids = {uid async for uid in FriendRequest.objects.filter(
+        receiver=user, sender_id__in=user_ids, status='pending'
+    ).values_list('sender_id', flat=True)}
 
     users_data = []
     for u in users:
@@ -286,7 +400,7 @@ def search_users(request):
 
 @csrf_exempt
 @require_http_methods(["POST"])
-def create_chatroom(request):
+async def create_chatroom(request):
     try:
         data = json.loads(request.body)
         
@@ -296,9 +410,9 @@ def create_chatroom(request):
 
         if room_type == 'anonymous':
             if not name:
-                name = f"Anonymous Room {ChatRoom.objects.filter(room_type='anonymous').count() + 1}"
+                name = f"Anonymous Room {await ChatRoom.objects.filter(room_type='anonymous').acount() + 1}"
             
-            chatroom = ChatRoom.objects.create(
+            chatroom = await ChatRoom.objects.acreate(
                 name=name,
                 room_type='anonymous'
             )
@@ -310,7 +424,7 @@ def create_chatroom(request):
                 'message': 'Anonymous chat room created successfully'
             }, status=201)
 
-        user = get_user_from_token(request)
+        user = await aget_user_from_token(request)
         if not user:
             return JsonResponse({'error': 'Authentication required'}, status=401)
 
@@ -319,15 +433,18 @@ def create_chatroom(request):
             if not other_user_id:
                 return JsonResponse({'error': 'other_user_id required for private chat'}, status=400)
             
-            other_user = User.objects.get(id=other_user_id)
+            other_user = await User.objects.aget(id=other_user_id)
 
-            if not Friendship.are_friends(user, other_user):
+            if not await sync_to_async(Friendship.are_friends)(user, other_user):
                 return JsonResponse({'error': 'You must be friends to chat'}, status=403)
 
-            chatroom = ChatRoom.get_private_chat(user, other_user)
+            chatroom = await sync_to_async(ChatRoom.get_private_chat)(user, other_user)
             
             if not chatroom:
                 return JsonResponse({'error': 'Failed to create private chat'}, status=500)
+            await versioning.abump(
+                *versioning.member_keys([user.id, other_user.id]), versioning.room_key(chatroom.id, 'members')
+            )
             
             return JsonResponse({
                 'room_id': chatroom.id,
@@ -341,29 +458,22 @@ def create_chatroom(request):
             if not name:
                 return JsonResponse({'error': 'Group name required'}, status=400)
             
+            if not isinstance(participant_ids, list):
+                return JsonResponse({'error': 'participant_ids must be a list of user ids'}, status=400)
+
             if not participant_ids:
                 return JsonResponse({'error': 'At least one participant required'}, status=400)
             
-            chatroom = ChatRoom.objects.create(
-                name=name,
-                room_type='group'
-            )
-            
-            chatroom.participants.add(user)
-            
-            for participant_id in participant_ids:
-                try:
-                    participant = User.objects.get(id=participant_id)
-                    if Friendship.are_friends(user, participant):
-                        chatroom.participants.add(participant)
-                except User.DoesNotExist:
-                    continue
+            chatroom, added, skipped = await sync_to_async(_create_group)(user, name, participant_ids)
+            await versioning.abump(*versioning.member_keys([user.id, *added]))
             
             return JsonResponse({
                 'room_id': chatroom.id,
                 'room_type': chatroom.room_type,
                 'name': chatroom.name,
-                'participant_count': chatroom.participants.count()
+                'participant_count': len(added) + 1,
+                'added': added,
+                'skipped': skipped
             }, status=201)
         else:
             return JsonResponse({'error': 'Invalid room type'}, status=400)
@@ -373,38 +483,53 @@ def create_chatroom(request):
     except Exception as e:
         return JsonResponse({'error': str(e)}, status=500)
 
+def _create_group(user, name, participant_ids):
+    with transaction.atomic():
+        chatroom = ChatRoom.objects.create(
+            name=name,
+            room_type='group',
+            created_by=user
+        )
+        added, skipped = chatroom.add_participants(
+            user, participant_ids, include_inviter=True
+        )
+    return chatroom, added, skipped
+
+
 @require_http_methods(["GET"])
-def get_anonymous_rooms(request):
+async def get_anonymous_rooms(request):
     try:
         rooms = ChatRoom.objects.filter(
             room_type='anonymous',
             is_active=True
+        ).annotate(
+            last_message_at=Max('messages__timestamp'),
+            message_count=Count('messages')
         ).order_by('-created_at')
+
+        # Distinct (name, sender) pairs that posted in the last hour, for
+        # every anonymous room in one query.
+        active_participants = {}
+        recent_posters = Message.objects.filter(
+            chat_room__room_type='anonymous',
+            chat_room__is_active=True,
+            timestamp__gte=timezone.now() - timedelta(hours=1)
+        ).order_by().values_list('chat_room_id', 'anonymous_name', 'sender_id').distinct()
+        async for room_id, _, _ in recent_posters:
+            active_participants[room_id] = active_participants.get(room_id, 0) + 1
         
         rooms_data = []
-        for room in rooms:
-            recent_messages = Message.objects.filter(
-                chat_room=room
-            ).order_by('-timestamp')[:1]
-            
-            last_activity = room.created_at
-            if recent_messages:
-                last_activity = recent_messages[0].timestamp
-            
-            active_participants = Message.objects.filter(
-                chat_room=room,
-                timestamp__gte=datetime.now() - timedelta(hours=1)
-            ).values('anonymous_name', 'sender').distinct().count()
-            
-            total_messages = Message.objects.filter(chat_room=room).count()
+        async for room in rooms:
+            last_activity = room.last_message_at or room.created_at
+            participant_count = active_participants.get(room.id, 0)
             
             rooms_data.append({
                 'id': room.id,
                 'name': room.name,
-                'participant_count': active_participants,
-                'message_count': total_messages,
+                'participant_count': participant_count,
+                'message_count': room.message_count,
                 'last_activity': last_activity.isoformat(),
-                'is_active': active_participants > 0
+                'is_active': participant_count > 0
             })
         
         return JsonResponse({'rooms': rooms_data})
@@ -414,9 +539,9 @@ def get_anonymous_rooms(request):
 
 @csrf_exempt
 @require_http_methods(["POST"])
-def join_anonymous_room(request, room_id):
+async def join_anonymous_room(request, room_id):
     try:
-        chatroom = ChatRoom.objects.get(id=room_id, room_type='anonymous')
+        chatroom = await ChatRoom.objects.aget(id=room_id, room_type='anonymous')
         
         data = json.loads(request.body) if request.body else {}
         anonymous_name = data.get('anonymous_name', 'Anonymous')
@@ -434,37 +559,122 @@ def join_anonymous_room(request, room_id):
     except Exception as e:
         return JsonResponse({'error': str(e)}, status=500)
 
+def _message_data(msg, user):
+    return {
+        'id': msg.id,
+        'content': msg.content,
+        'sender_name': msg.anonymous_name or (msg.sender.username if msg.sender else 'Unknown'),
+        'sender_id': msg.sender_id,
+        'anonymous_name': msg.anonymous_name,
+        'is_anonymous': bool(msg.anonymous_name),
+        'timestamp': msg.timestamp.isoformat(),
+        'can_delete': bool(user and msg.sender_id == user.id and not msg.deleted_at),
+        'edited_at': msg.edited_at.isoformat() if msg.edited_at else None,
+        'deleted': bool(msg.deleted_at)
+    }
+
+
+def _archived_message_data(record, user):
+    # Archived messages are read-only, so they can never be deleted.
+    return {
+        'id': record['id'],
+        'content': record['content'],
+        'sender_name': record['sender_name'],
+        'sender_id': record['sender_id'],
+        'anonymous_name': record['anonymous_name'],
+        'is_anonymous': bool(record['anonymous_name']),
+        'timestamp': record['timestamp'],
+        'can_delete': False,
+        'archived': True
+    }
+
+
 @require_http_methods(["GET"])
-def get_messages(request, room_id):
+async def get_messages(request, room_id):
     try:
-        chatroom = ChatRoom.objects.get(id=room_id)
+        chatroom = await ChatRoom.objects.aget(id=room_id)
         
         user = None
         if chatroom.room_type != 'anonymous':
-            user = get_user_from_token(request)
-            if not user or user not in chatroom.participants.all():
+            user = await aget_user_from_token(request)
+            if not user or not await chatroom.participants.filter(id=user.id).aexists():
                 return JsonResponse({'error': 'Access denied'}, status=403)
 
-        messages = Message.objects.filter(chat_room=chatroom).order_by('timestamp')
-        
-        messages_data = []
-        for msg in messages:
-            can_delete = False
-            if user:
-                can_delete = (msg.sender and msg.sender.id == user.id)
-            
-            messages_data.append({
-                'id': msg.id,
-                'content': msg.content,
-                'sender_name': msg.anonymous_name or (msg.sender.username if msg.sender else 'Unknown'),
-                'sender_id': msg.sender.id if msg.sender else None,
-                'anonymous_name': msg.anonymous_name,
-                'is_anonymous': bool(msg.anonymous_name),
-                'timestamp': msg.timestamp.isoformat(),
-                'can_delete': can_delete
-            })
+        etag, not_modified = await versioning.acheck(
+            request, user and user.id, [versioning.room_key(chatroom.id, 'messages')]
+        )
+        if not_modified:
+            return not_modified
+
+        # Optional keyset pagination: ?limit=N returns the newest N messages,
+        # &before=<id> continues with older ones. Older pages are read from
+        # the archive once the hot table is exhausted.
+        try:
+            limit = int(request.GET['limit']) if request.GET.get('limit') else None
+            before = int(request.GET['before']) if request.GET.get('before') else None
+        except ValueError:
+            return JsonResponse({'error': 'limit and before must be integers'}, status=400)
+
+        if limit:
+            limit = min(max(limit, 1), 500)
+            messages = Message.objects.filter(chat_room=chatroom).select_related('sender')
+            if before:
+                messages = messages.filter(id__lt=before)
+            messages = [msg async for msg in messages.order_by('-id')[:limit]]
+
+            messages_data = [_message_data(msg, user) for msg in messages]
+            if len(messages_data) < limit:
+                cursor = messages[-1].id if messages else before
+                archived = await sync_to_async(archived_page)(chatroom.id, cursor, limit - len(messages_data))
+                messages_data += [_archived_message_data(record, user) for record in archived]
+            messages_data.reverse()
+
+            next_before = messages_data[0]['id'] if len(messages_data) == limit else None
+            return versioning.tag(JsonResponse({'messages': messages_data, 'next_before': next_before}), etag)
+
+        messages = Message.objects.filter(chat_room=chatroom).select_related('sender').order_by('timestamp')
+
+        archived = await sync_to_async(list)(iter_archived_messages(chatroom.id))
+        messages_data = [_archived_message_data(record, user) for record in archived]
+        messages_data += [_message_data(msg, user) async for msg in messages]
+
+        return versioning.tag(JsonResponse({'messages': messages_data}), etag)
+
+    except ChatRoom.DoesNotExist:
+        return JsonResponse({'error': 'Chat room not found'}, status=404)
+    except Exception as e:
+        return JsonResponse({'error': str(e)}, status=500)
 
-        return JsonResponse({'messages': messages_data})
+
+@require_http_methods(["GET"])
+async def export_messages(request, room_id):
+    """Stream a room's history as NDJSON (default) or CSV, optionally gzipped."""
+    try:
+        chatroom = await ChatRoom.objects.aget(id=room_id)
+
+        if chatroom.room_type != 'anonymous':
+            user = await aget_user_from_token(request)
+            if not user or not await chatroom.participants.filter(id=user.id).aexists():
+                return JsonResponse({'error': 'Access denied'}, status=403)
+
+        fmt = request.GET.get('format', 'ndjson')
+        if fmt not in ('ndjson', 'csv'):
+            return JsonResponse({'error': 'format must be ndjson or csv'}, status=400)
+        compress = request.GET.get('gzip') in ('1', 'true')
+
+        # A gzipped export is a .gz file, not a compressed transfer: with
+        # Content-Encoding clients would decompress it and save plain text
+        # under the .gz name.
+        if compress:
+            content_type = 'application/gzip'
+        else:
+            content_type = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+        response = StreamingHttpResponse(
+            aexport_stream([chatroom.id], fmt=fmt, compress=compress), content_type=content_type
+        )
+        filename = export_filename(f"room-{chatroom.id}", fmt, compress)
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
 
     except ChatRoom.DoesNotExist:
         return JsonResponse({'error': 'Chat room not found'}, status=404)
@@ -473,17 +683,90 @@ def get_messages(request, room_id):
 
 
 @require_http_methods(["GET"])
-def get_chatrooms(request):
-    user = get_user_from_token(request)
+async def search_messages(request):
+    """Full-text search over messages in rooms the caller belongs to.
+
+    Query params: q, optional room_id, before (message id cursor), limit.
+    """
+    user = await aget_user_from_token(request)
+
+    if not user:
+        return JsonResponse({'error': 'Authentication required'}, status=401)
+
+    query = request.GET.get('q', '').strip()
+    if not query:
+        return JsonResponse({'messages': [], 'next_before': None})
+
+    try:
+        limit = min(max(int(request.GET.get('limit', 20)), 1), 100)
+        before = int(request.GET['before']) if request.GET.get('before') else None
+        room_id = int(request.GET['room_id']) if request.GET.get('room_id') else None
+    except ValueError:
+        return JsonResponse({'error': 'limit, before and room_id must be integers'}, status=400)
+
+    if room_id:
+        room_ids = [rid async for rid in ChatRoom.objects.filter(
+            Q(participants=user) | Q(room_type='anonymous'), id=room_id
+        ).values_list('id', flat=True).distinct()]
+        if not room_ids:
+            return JsonResponse({'error': 'Access denied'}, status=403)
+    else:
+        room_ids = [rid async for rid in user.chat_rooms.values_list('id', flat=True)]
+
+    message_ids = await sync_to_async(get_message_search_index().search)(
+        query, room_ids, before_id=before, limit=limit
+    )
+    messages = Message.objects.filter(
+        id__in=message_ids, deleted_at__isnull=True
+    ).select_related('sender').order_by('-id')
+
+    # A per-process index can lag edits, deletes and purges made elsewhere:
+    # only return hits whose current content still matches.
+    messages_data = [{
+        'id': msg.id,
+        'chat_room_id': msg.chat_room_id,
+        'content': msg.content,
+        'sender_name': msg.anonymous_name or (msg.sender.username if msg.sender else 'Unknown'),
+        'sender_id': msg.sender_id,
+        'anonymous_name': msg.anonymous_name,
+        'is_anonymous': bool(msg.anonymous_name),
+        'timestamp': msg.timestamp.isoformat()
+    } async for msg in messages if matches(query, msg.content)]
+
+    next_before = message_ids[-1] if len(message_ids) == limit else None
+
+    return JsonResponse({'messages': messages_data, 'next_before': next_before})
+
+
+@require_http_methods(["GET"])
+async def get_chatrooms(request):
+    user = await aget_user_from_token(request)
     
     if not user:
         return JsonResponse({'error': 'Authentication required'}, status=401)
 
-    chatrooms = ChatRoom.objects.filter(participants=user, is_active=True)
+    etag, not_modified = await versioning.acheck(request, user.id, [versioning.user_key(user.id, 'chatrooms')])
+    if not_modified:
+        return not_modified
+
+    return versioning.tag(await cached_json(etag, partial(_chatrooms_payload, user)), etag)
+
+
+async def _chatrooms_payload(user):
+    # Large groups come with the member count and a preview of the first
+    # members only; get_participants pages through the rest.
+    preview = max(settings.ROOM_PARTICIPANT_PREVIEW, 2)
+    memberships = ChatRoom.participants.through.objects.filter(user=user).values('chatroom_id')
+    chatrooms = ChatRoom.objects.filter(id__in=memberships, is_active=True).annotate(
+        participant_count=Count('participants')
+    ).prefetch_related(
+        Prefetch('participants', queryset=User.objects.only('id', 'username').order_by('id')[:preview],
+                 to_attr='preview')
+    )
     
     rooms_data = []
-    for room in chatrooms:
-        participants = room.participants.all()
+    async for room in chatrooms:
+        participants = room.preview
         participant_names = [p.username for p in participants]
         
         display_name = room.name
@@ -491,34 +774,99 @@ def get_chatrooms(request):
             other_users = [p.username for p in participants if p.id != user.id]
             display_name = other_users[0] if other_users else 'Private Chat'
         elif room.room_type == 'group' and not display_name:
-            display_name = f"Group Chat ({participants.count()} members)"
+            display_name = f"Group Chat ({room.participant_count} members)"
         
         rooms_data.append({
             'id': room.id,
             'name': display_name,
             'room_type': room.room_type,
-            'participant_count': participants.count(),
+            'participant_count': room.participant_count,
             'participants': participant_names,
+            'large_group': room.participant_count > preview,
             'created_at': room.created_at.isoformat()
         })
 
-    return JsonResponse({'chatrooms': rooms_data})
+    return {'chatrooms': rooms_data}
+
+
+@require_http_methods(["GET"])
+async def get_participants(request, room_id):
+    """A room's members in id order, a page at a time: ?limit=N (default
+    100, at most 500) and &after=<user id> to continue past the last page."""
+    try:
+        user = await aget_user_from_token(request)
+        if not user:
+            return JsonResponse({'error': 'Authentication required'}, status=401)
+
+        chatroom = await ChatRoom.objects.aget(id=room_id)
+        if not await chatroom.participants.filter(id=user.id).aexists():
+            return JsonResponse({'error': 'Access denied'}, status=403)
+
+        etag, not_modified = await versioning.acheck(
+            request, user.id, [versioning.room_key(chatroom.id, 'members')]
+        )
+        if not_modified:
+            return not_modified
+
+        try:
+            limit = int(request.GET.get('limit') or 100)
+            after = int(request.GET['after']) if request.GET.get('after') else None
+        except ValueError:
+            return JsonResponse({'error': 'limit and after must be integers'}, status=400)
+        limit = min(max(limit, 1), 500)
+
+        members = chatroom.participants.only('id', 'username').order_by('id')
+        if after:
+            members = members.filter(id__gt=after)
+        participants = [{'id': member.id, 'username': member.username} async for member in members[:limit]]
+
+        next_after = participants[-1]['id'] if len(participants) == limit else None
+        return versioning.tag(JsonResponse({
+            'room_id': chatroom.id,
+            'participants': participants,
+            'next_after': next_after
+        }), etag)
+
+    except ChatRoom.DoesNotExist:
+        return JsonResponse({'error': 'Chat room not found'}, status=404)
+    except Exception as e:
+        return JsonResponse({'error': str(e)}, status=500)
+
+
+@require_http_methods(["GET"])
+async def get_unread_counts(request):
+    """Unread messages in each of the caller's rooms, from their read watermarks."""
+    user = await aget_user_from_token(request)
+
+    if not user:
+        return JsonResponse({'error': 'Authentication required'}, status=401)
+
+    counts = await sync_to_async(RoomReadState.unread_counts)(user)
+
+    return JsonResponse({'rooms': [{
+        'room_id': room_id,
+        'unread': unread,
+        'last_read_message_id': last_read
+    } for room_id, (unread, last_read) in counts.items()]})
 
 
 @csrf_exempt
 @require_http_methods(["POST"])
-def join_chatroom(request, room_id):
+async def join_chatroom(request, room_id):
     """Allow users to join existing chat rooms (for groups)"""
     try:
-        user = get_user_from_token(request)
+        user = await aget_user_from_token(request)
         
         if not user:
             return JsonResponse({'error': 'Authentication required'}, status=401)
         
-        chatroom = ChatRoom.objects.get(id=room_id)
+        chatroom = await ChatRoom.objects.aget(id=room_id)
         
-        if user not in chatroom.participants.all():
-            chatroom.participants.add(user)
+        if not await chatroom.participants.filter(id=user.id).aexists():
+            await chatroom.participants.aadd(user)
+            await versioning.abump(
+                *versioning.member_keys(await _participant_ids(chatroom)), versioning.room_key(chatroom.id, 'members')
+            )
         
         return JsonResponse({
             'message': 'Joined chat room successfully',
@@ -532,59 +880,157 @@ def join_chatroom(request, room_id):
         return JsonResponse({'error': str(e)}, status=500)
 
 
+@csrf_exempt
+@require_http_methods(["POST"])
+async def update_members(request, room_id):
+    """Bulk add/remove group members: {"add": [ids], "remove": [ids]}"""
+    try:
+        user = await aget_user_from_token(request)
+        if not user:
+            return JsonResponse({'error': 'Authentication required'}, status=401)
+
+        chatroom = await ChatRoom.objects.aget(id=room_id)
+
+        if chatroom.room_type != 'group':
+            return JsonResponse({'error': 'Members can only be changed in group chats'}, status=400)
+
+        if not await chatroom.participants.filter(id=user.id).aexists():
+            return JsonResponse({'error': 'You are not in this chat room'}, status=403)
+
+        data = json.loads(request.body) if request.body else {}
+        add_ids = data.get('add', [])
+        remove_ids = data.get('remove', [])
+
+        if not isinstance(add_ids, list) or not isinstance(remove_ids, list):
+            return JsonResponse({'error': 'add and remove must be lists of user ids'}, status=400)
+
+        added, add_skipped, removed, remove_skipped = await sync_to_async(_update_members)(
+            chatroom, user, add_ids, remove_ids
+        )
+        if added or removed:
+            await versioning.abump(
+                *versioning.member_keys([*await _participant_ids(chatroom), *removed]),
+                versioning.room_key(chatroom.id, 'members'),
+            )
+
+        return JsonResponse({
+            'room_id': chatroom.id,
+            'added': added,
+            'removed': removed,
+            'skipped': add_skipped + remove_skipped
+        })
+
+    except ChatRoom.DoesNotExist:
+        return JsonResponse({'error': 'Chat room not found'}, status=404)
+    except Exception as e:
+        return JsonResponse({'error': str(e)}, status=500)
+
+
+def _update_members(chatroom, user, add_ids, remove_ids):
+    with transaction.atomic():
+        added, add_skipped = chatroom.add_participants(user, add_ids)
+        removed, remove_skipped = chatroom.remove_participants(user, remove_ids)
+    return added, add_skipped, removed, remove_skipped
+
+
+async def _participant_ids(chatroom):
+    return [uid async for uid in chatroom.participants.values_list('id', flat=True)]
+
+
 @csrf_exempt
 @require_http_methods(["DELETE", "POST"])
-def delete_message(request, message_id):
+async def delete_message(request, message_id):
     """Delete a message - only sender can delete their own messages"""
     try:
-        message = Message.objects.get(id=message_id)
-        
-        if message.anonymous_name:
-            return JsonResponse({'error': 'Cannot delete anonymous messages'}, status=403)
-        
-        user = get_user_from_token(request)
+        user = await aget_user_from_token(request)
         if not user:
             return JsonResponse({'error': 'Authentication required'}, status=401)
-        
-        if message.sender != user:
-            return JsonResponse({'error': 'You can only delete your own messages'}, status=403)
-        
-        chat_room_id = message.chat_room.id
-        
-        message.delete()
-        
+
+        frame = await sync_to_async(edits.delete_message)(user.id, message_id)
+        chat_room_id = frame['chat_room_id']
+
+        await edits.publish(frame)
+
         return JsonResponse({
             'message': 'Message deleted successfully',
             'message_id': message_id,
             'chat_room_id': chat_room_id
         })
-    
-    except Message.DoesNotExist:
-        return JsonResponse({'error': 'Message not found'}, status=404)
+
+    except edits.MessageActionError as e:
+        return JsonResponse({'error': str(e)}, status=e.status)
     except Exception as e:
         return JsonResponse({'error': str(e)}, status=500)
     
 @csrf_exempt
 @require_http_methods(["POST"])
-def leave_chatroom(request, room_id):
+async def leave_chatroom(request, room_id):
     try:
-        user = get_user_from_token(request)
+        user = await aget_user_from_token(request)
         if not user:
             return JsonResponse({'error': 'Authentication required'}, status=401)
         
-        chatroom = ChatRoom.objects.get(id=room_id)
+        chatroom = await ChatRoom.objects.aget(id=room_id)
         
-        if user not in chatroom.participants.all():
+        if not await chatroom.participants.filter(id=user.id).aexists():
             return JsonResponse({'error': 'You are not in this chat room'}, status=400)
         
         if chatroom.room_type == 'private':
             return JsonResponse({'error': 'Cannot leave private chats'}, status=400)
         
-        chatroom.participants.remove(user)
+        await chatroom.participants.aremove(user)
+        await versioning.abump(
+            *versioning.member_keys([user.id, *await _participant_ids(chatroom)]),
+            versioning.room_key(chatroom.id, 'members'),
+        )
         
         return JsonResponse({'message': 'Left chat room successfully'})
     
     except ChatRoom.DoesNotExist:
         return JsonResponse({'error': 'Chat room not found'}, status=404)
     except Exception as e:
-        return JsonResponse({'error': str(e)}, status=500)
\ No newline at end of file
+        return JsonResponse({'error': str(e)}, status=500)
+
+@require_http_methods(["GET"])
+async def endpoint_metrics_view(request):
+    user = await aget_user_from_token(request)
+    if not user:
+        return JsonResponse({'error': 'Authentication required'}, status=401)
+    if not user.is_staff:
+        return JsonResponse({'error': 'Staff only'}, status=403)
+
+    return JsonResponse({
+        'sample_rate': settings.PERF_SAMPLE_RATE,
+        'endpoints': endpoint_metrics(),
+    })
+
+
+@require_http_methods(["GET"])
+async def slowest_traces(request):
+    user = await aget_user_from_token(request)
+    if not user:
+        return JsonResponse({'error': 'Authentication required'}, status=401)
+    if not user.is_staff:
+        return JsonResponse({'error': 'Staff only'}, status=403)
+
+    exporter = get_exporter()
+    if not isinstance(exporter, MemoryExporter):
+        return JsonResponse({'error': 'In-memory tracing is not enabled'}, status=404)
+
+    try:
+        limit = min(max(int(request.GET.get('limit', 20)), 1), 200)
+    except ValueError:
+        return JsonResponse({'error': 'limit must be an integer'}, status=400)
+
+    return JsonResponse({'traces': exporter.slowest(limit)})
+
+
+@require_http_methods(["GET"])
+async def gateway_metrics(request):
+    if not telemetry.has_metrics_token(request.headers.get('Authorization', '')):
+        user = await aget_user_from_token(request)
+        if not user:
+            return JsonResponse({'error': 'Authentication required'}, status=401)
+        if not user.is_staff:
+            return JsonResponse({'error': 'Staff only'}, status=403)
+    return HttpResponse(telemetry.render_metrics(), content_type=telemetry.CONTENT_TYPE)
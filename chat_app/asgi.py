@@ -1,16 +1,28 @@
+"""
+ASGI config for chat_app project.
+
+Serves both the async REST API (app.views) and the Channels websocket
+consumer from one event loop per worker process.
+"""
+
 import os
+
 from django.core.asgi import get_asgi_application
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'chat_app.settings')
+
+# Initialize Django before importing anything that touches models.
+django_asgi_app = get_asgi_application()
+
 from channels.routing import ProtocolTypeRouter, URLRouter
 from channels.auth import AuthMiddlewareStack
-from app import routing  # Replace 'app' with your app name
-
-os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'your_project_name.settings')
+from app import routing
 
 application = ProtocolTypeRouter({
-    "http": get_asgi_application(),
+    "http": django_asgi_app,
     "websocket": AuthMiddlewareStack(
         URLRouter(
             routing.websocket_urlpatterns
         )
     ),
-})
\ No newline at end of file
+})
@@ -29,6 +29,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "app.instrumentation.PerformanceMiddleware",
     "corsheaders.middleware.CorsMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "whitenoise.middleware.WhiteNoiseMiddleware", 
@@ -136,6 +137,166 @@ SIMPLE_JWT = {
     "AUTH_HEADER_TYPES": ("Bearer",),
 }
 
+# Size of the thread pool the async views use for password hashing.
+PASSWORD_HASH_WORKERS = config('PASSWORD_HASH_WORKERS', cast=int, default=4)
+
+# User search index backend: app.search.DatabaseUserSearchIndex (shared by all
+# workers) or app.search.InProcessUserSearchIndex (per-process, in memory).
+USER_SEARCH_INDEX = config('USER_SEARCH_INDEX', default='app.search.DatabaseUserSearchIndex')
+USER_SEARCH_INCLUDE_EMAIL = config('USER_SEARCH_INCLUDE_EMAIL', cast=bool, default=True)
+
+# Message search index backend: app.search.DatabaseMessageSearchIndex or
+# app.search.InProcessMessageSearchIndex (per-process; it rebuilds when the
+# 'messages' index version changes, so it needs the shared cache too).
+MESSAGE_SEARCH_INDEX = config('MESSAGE_SEARCH_INDEX', default='app.search.DatabaseMessageSearchIndex')
+
+# Message retention in days per room type (unset = keep forever), and how
+# long an anonymous room may sit idle before it is deactivated.
+def _optional_int(value):
+    return int(value) if value else None
+
+MESSAGE_RETENTION_DAYS = {
+    'anonymous': config('ANONYMOUS_MESSAGE_RETENTION_DAYS', cast=_optional_int, default='7'),
+    'group': config('GROUP_MESSAGE_RETENTION_DAYS', cast=_optional_int, default=''),
+    'private': config('PRIVATE_MESSAGE_RETENTION_DAYS', cast=_optional_int, default=''),
+}
+ANONYMOUS_ROOM_IDLE_HOURS = config('ANONYMOUS_ROOM_IDLE_HOURS', cast=int, default=24)
+RETENTION_BATCH_SIZE = config('RETENTION_BATCH_SIZE', cast=int, default=1000)
+
+# Messages older than MESSAGE_ARCHIVE_AFTER_DAYS are moved by archive_messages
+# into compressed per-room segment files under MESSAGE_ARCHIVE_ROOT. Archiving
+# deletes the rows it moves, so it refuses to run until the root is set to an
+# existing directory on persistent storage outside the app (a volume, not the
+# container or dyno filesystem).
+MESSAGE_ARCHIVE_ROOT = config('MESSAGE_ARCHIVE_ROOT', default=None)
+MESSAGE_ARCHIVE_AFTER_DAYS = config('MESSAGE_ARCHIVE_AFTER_DAYS', cast=int, default=90)
+MESSAGE_ARCHIVE_BLOCK_SIZE = config('MESSAGE_ARCHIVE_BLOCK_SIZE', cast=int, default=500)
+
+# Fraction of API requests measured by app.instrumentation.PerformanceMiddleware,
+# and whether measured responses carry a Server-Timing header.
+PERF_SAMPLE_RATE = config('PERF_SAMPLE_RATE', cast=float, default=0.1)
+PERF_SERVER_TIMING = config('PERF_SERVER_TIMING', cast=bool, default=DEBUG)
+
+# Structured gateway logging (app.logs): level, the fraction of per-frame
+# events kept, and how many records may wait for the writer thread before
+# new ones are dropped.
+LOG_LEVEL = config('LOG_LEVEL', default='INFO')
+LOG_SAMPLE_RATE = config('LOG_SAMPLE_RATE', cast=float, default=0.01)
+LOG_QUEUE_SIZE = config('LOG_QUEUE_SIZE', cast=int, default=10000)
+
+# Bearer token for Prometheus scrapers of /api/metrics/ and the gateway's
+# /metrics; staff users may read them with their own token. Empty: staff only.
+METRICS_TOKEN = config('METRICS_TOKEN', default='')
+
+# Per-frame tracing of the websocket handlers (app.tracing). TRACE_EXPORT is
+# '' (off), 'memory' (last TRACE_MEMORY_SIZE traces, served to staff at
+# /api/metrics/traces/) or 'file' (JSON lines appended to TRACE_FILE).
+TRACE_EXPORT = config('TRACE_EXPORT', default='')
+TRACE_SAMPLE_RATE = config('TRACE_SAMPLE_RATE', cast=float, default=0.01)
+TRACE_MEMORY_SIZE = config('TRACE_MEMORY_SIZE', cast=int, default=1000)
+TRACE_FILE = config('TRACE_FILE', default=str(BASE_DIR / 'traces.jsonl'))
+
+if config('REDIS_URL', default=None):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': config('REDIS_URL'),
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+# ETags on list endpoints (app.versioning). The version stamps live in the
+# cache, so they are only trustworthy when every process that writes (web
+# workers and the FastAPI gateway) shares it: on by default with Redis only.
+ETAGS_ENABLED = config('ETAGS_ENABLED', cast=bool, default=bool(config('REDIS_URL', default='')))
+
+# Cached JSON bodies of the per-user list endpoints (app.response_cache),
+# keyed by the same version stamps; 0 disables. Concurrent misses wait up to
+# the lock timeout for a single rebuild.
+RESPONSE_CACHE_TIMEOUT = config(
+    'RESPONSE_CACHE_TIMEOUT', cast=int, default=300 if config('REDIS_URL', default='') else 0
+)
+RESPONSE_CACHE_LOCK_TIMEOUT = config('RESPONSE_CACHE_LOCK_TIMEOUT', cast=float, default=5.0)
+
+# Presence (app.presence): online entries live PRESENCE_TTL seconds in the
+# cache unless a gateway heartbeat refreshes them; a user must stay
+# disconnected PRESENCE_DEBOUNCE seconds before friends see them go offline.
+# The gateways write the entries and the API reads them, so like ETags it is
+# on by default with Redis only.
+PRESENCE_ENABLED = config('PRESENCE_ENABLED', cast=bool, default=bool(config('REDIS_URL', default='')))
+PRESENCE_TTL = config('PRESENCE_TTL', cast=int, default=60)
+PRESENCE_DEBOUNCE = config('PRESENCE_DEBOUNCE', cast=float, default=5.0)
+PRESENCE_BULK_LIMIT = config('PRESENCE_BULK_LIMIT', cast=int, default=500)
+
+# Read/delivered watermarks (app.receipts) are coalesced per gateway process
+# and written, then announced per room, every RECEIPT_FLUSH_INTERVAL seconds
+# or as soon as RECEIPT_FLUSH_SIZE (user, room) pairs are pending.
+RECEIPT_FLUSH_INTERVAL = config('RECEIPT_FLUSH_INTERVAL', cast=float, default=1.0)
+RECEIPT_FLUSH_SIZE = config('RECEIPT_FLUSH_SIZE', cast=int, default=1000)
+
+# Websocket frame rate limits (app.ratelimit) per gateway process, as
+# "rate/burst": tokens refilled per second and bucket size, for each
+# connection, user and room. An empty value turns that bucket off. A room's
+# bucket is only charged by senders allowed in it, and only by sends, typing
+# indicators and joins.
+def _rate(value):
+    if not value:
+        return None
+    rate, burst = value.split('/')
+    return float(rate), float(burst)
+
+WS_RATE_LIMITS = {
+    'message': {
+        'connection': config('WS_MESSAGE_RATE_CONNECTION', cast=_rate, default='5/10'),
+        'user': config('WS_MESSAGE_RATE_USER', cast=_rate, default='10/20'),
+        'room': config('WS_MESSAGE_RATE_ROOM', cast=_rate, default='50/100'),
+    },
+    'typing': {
+        'connection': config('WS_TYPING_RATE_CONNECTION', cast=_rate, default='2/5'),
+        'user': config('WS_TYPING_RATE_USER', cast=_rate, default='4/10'),
+        'room': config('WS_TYPING_RATE_ROOM', cast=_rate, default='20/40'),
+    },
+    # A client joins each of its rooms on connect, and every member of a room
+    # may rejoin at once after a gateway restart, so there is no room bucket.
+    'join': {
+        'connection': config('WS_JOIN_RATE_CONNECTION', cast=_rate, default='2/20'),
+        'user': config('WS_JOIN_RATE_USER', cast=_rate, default='5/50'),
+        'room': config('WS_JOIN_RATE_ROOM', cast=_rate, default=''),
+    },
+    # Clients ack every message they receive, but acks are coalesced before
+    # they are written; receipts have no room bucket.
+    'receipt': {
+        'connection': config('WS_RECEIPT_RATE_CONNECTION', cast=_rate, default='20/100'),
+        'user': config('WS_RECEIPT_RATE_USER', cast=_rate, default='40/200'),
+    },
+}
+
+# On SIGTERM the FastAPI gateway drains (app.main.drain): it refuses new
+# sockets, then closes the open ones in GATEWAY_DRAIN_WAVES waves spread over
+# GATEWAY_DRAIN_SECONDS, telling each client to wait a random delay of up to
+# GATEWAY_RECONNECT_JITTER seconds before reconnecting.
+GATEWAY_DRAIN_SECONDS = config('GATEWAY_DRAIN_SECONDS', cast=float, default=10.0)
+GATEWAY_DRAIN_WAVES = config('GATEWAY_DRAIN_WAVES', cast=int, default=10)
+GATEWAY_RECONNECT_JITTER = config('GATEWAY_RECONNECT_JITTER', cast=float, default=10.0)
+
+# The gateways' in-memory room directory (app.rooms) relies on version
+# stamps shared with the API processes, so like ETags it defaults to on only
+# with Redis. Rooms with messages in the last GATEWAY_PRELOAD_DAYS days are
+# loaded at startup (0 = none) before /ready reports the gateway ready.
+GATEWAY_ROOM_DIRECTORY = config(
+    'GATEWAY_ROOM_DIRECTORY', cast=bool, default=bool(config('REDIS_URL', default=''))
+)
+GATEWAY_PRELOAD_DAYS = config('GATEWAY_PRELOAD_DAYS', cast=int, default=7)
+
+# Room lists name at most ROOM_PARTICIPANT_PREVIEW members of each room next
+# to the full count; larger groups are paged through get_participants.
+ROOM_PARTICIPANT_PREVIEW = config('ROOM_PARTICIPANT_PREVIEW', cast=int, default=10)
+
 if config('REDIS_URL', default=None):
     CHANNEL_LAYERS = {
         "default": {
@@ -0,0 +1,17 @@
+"""Settings for the FastAPI websocket gateway (app.main).
+
+The gateway only needs the app's models and the auth User, so it leaves out
+the admin, sessions, messages, static files, Channels, CORS, DRF and the
+token blacklist: fewer modules imported at startup and less memory per
+worker. Database, cache and feature settings all come from chat_app.settings.
+"""
+from .settings import *  # noqa: F401,F403
+
+INSTALLED_APPS = [
+    "django.contrib.contenttypes",
+    "django.contrib.auth",
+    "app",
+]
+
+MIDDLEWARE = []
+TEMPLATES = []